@@ -1,3 +1,4 @@
+from datetime import timedelta
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -52,6 +53,21 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db" / "db.sqlite3",
+        # Crawler threads write concurrently, wait for the lock instead of failing fast
+        "OPTIONS": {"timeout": 20},
+        # Tests run crawls with the result writer on, they need a file database: the in-memory
+        # one shares a cache between connections and fails on a locked table instead of waiting
+        "TEST": {"NAME": BASE_DIR / "db" / "test_db.sqlite3"},
+    }
+}
+
+# Book list and book page caches (core.cache). Crawl workers invalidate them by bumping version
+# keys in the cache, so the backend must be shared between processes, the local memory one is not
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / "data" / "cache",
+        "OPTIONS": {"MAX_ENTRIES": 10000},
     }
 }
 
@@ -82,3 +98,135 @@ USE_TZ = True
 STATIC_URL = "static/"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# Bulk crawl settings
+PARSER_CRAWL_WORKERS = 8
+PARSER_CRAWL_CHUNK_SIZE = 500
+PARSER_CRAWL_PROGRESS_EVERY = 50
+
+# Per-host request limits: max concurrent requests and min seconds between request starts
+PARSER_HOST_RATE_LIMITS = {
+    "default": {"concurrency": 2, "interval": 1.0},
+    "www.amazon.com": {"concurrency": 4, "interval": 0.5},
+    "www.amazon.de": {"concurrency": 2, "interval": 1.0},
+    "www.amazon.fr": {"concurrency": 2, "interval": 1.0},
+}
+
+# BeautifulSoup tree builder used for product pages: "lxml", "html.parser" or "html5lib"
+PARSER_HTML_BACKEND = "lxml"
+# Parse only the page regions the extractors read instead of the whole page, see core.html_backends
+PARSER_PARTIAL_PARSING = True
+# Directories of extra extraction rule files, a file replaces the built-in one of the same name, see core.extraction
+PARSER_EXTRACTION_RULES_DIRS = []
+# Skip the extraction of pages whose extracted regions are the same as at the last parse, see core.fingerprints
+PARSER_PAGE_FINGERPRINTS = True
+
+# Archive of fetched product pages, compressed and deduplicated by content hash
+PARSER_SNAPSHOTS_ENABLED = True
+PARSER_SNAPSHOT_DIR = BASE_DIR / "data" / "snapshots"
+# "gzip" is always available, "zstd" needs zstandard, the zstd extra
+PARSER_SNAPSHOT_COMPRESSION = "gzip"
+# Pages waiting for the background snapshot writer, fetches wait while that many are queued
+PARSER_SNAPSHOT_WRITE_QUEUE = 64
+# Retention: the newest snapshots of every ASIN are always kept, older ones expire after max age
+PARSER_SNAPSHOT_KEEP_LAST = 5
+PARSER_SNAPSHOT_MAX_AGE_DAYS = 90
+
+# Refresh scheduling
+PARSER_REFRESH_INTERVAL = timedelta(days=1)
+# Books ranked at or above this best seller place are refreshed more often
+PARSER_TOP_RANK_THRESHOLD = 1000
+PARSER_TOP_RANK_REFRESH_INTERVAL = timedelta(hours=1)
+# Failed parses are retried with exponential backoff: base * 2 ** (failures - 1), capped at max
+PARSER_RETRY_BACKOFF_BASE = timedelta(minutes=10)
+PARSER_RETRY_BACKOFF_MAX = timedelta(hours=12)
+# Random spread applied to due times and dispatch gaps, as a fraction of the interval
+PARSER_SCHEDULER_JITTER = 0.1
+# Books due within this window are spread evenly over it
+PARSER_SCHEDULER_WINDOW = timedelta(hours=1)
+
+# Proxies in "host:port:user:pass" format, requests go direct when the list is empty
+PARSER_PROXIES = [
+    "91.132.12.165:12323:14a0693892686:42fbec1479",
+    "141.98.58.86:12323:14a0693892686:42fbec1479",
+    "205.233.201.252:12323:14a0693892686:42fbec1479",
+]
+# Keep-alive connections kept per proxy
+PARSER_PROXY_POOL_SIZE = 16
+# Consecutive failures (errors or captchas) that open a proxy's circuit
+PARSER_PROXY_FAILURE_THRESHOLD = 5
+# Seconds before a proxy with an open circuit is probed again
+PARSER_PROXY_COOLDOWN = 120
+
+# Pooled sessions (core.sessions): cookie jars are kept in the directory across restarts, None
+# keeps them in memory only. A session is warmed up with a visit of the marketplace home page and
+# retired after its max age, max requests or max captchas
+PARSER_SESSION_DIR = BASE_DIR / "data" / "sessions"
+PARSER_SESSION_WARM_UP = True
+PARSER_SESSION_MAX_AGE = timedelta(hours=6)
+PARSER_SESSION_MAX_REQUESTS = 500
+PARSER_SESSION_MAX_CAPTCHAS = 2
+
+# Crawl job queue: seconds an idle worker waits before polling again, and how long a claimed
+# task may go without its worker renewing the lease before it is considered abandoned and requeued
+PARSER_WORKER_POLL_INTERVAL = 5
+PARSER_TASK_LEASE = timedelta(minutes=15)
+# Throttled or failed fetches go back to the queue instead of blocking a worker: the task becomes
+# available again after base * 2 ** (attempt - 1) capped at max, or the server's Retry-After if longer,
+# and fails for good after the max attempts
+PARSER_FETCH_RETRY_BASE = timedelta(seconds=30)
+PARSER_FETCH_RETRY_MAX = timedelta(minutes=30)
+PARSER_TASK_MAX_ATTEMPTS = 5
+# Priority of "Parse Now" tasks, claimed before the tasks of bulk crawls (priority 0), and how
+# often the book page asks for the status of its parse, in milliseconds
+PARSER_SINGLE_PARSE_PRIORITY = 100
+PARSER_SINGLE_PARSE_POLL_INTERVAL = 2000
+
+# Async workers (run_worker --async, needs httpx): books in flight per worker, requests in flight
+# per proxy, threads parsing fetched pages and whether HTTP/2 is negotiated (needs the h2 package)
+PARSER_ASYNC_CONCURRENCY = 200
+PARSER_ASYNC_PROXY_CONCURRENCY = 32
+PARSER_ASYNC_PARSE_WORKERS = 4
+PARSER_ASYNC_HTTP2 = True
+
+# Parse results are written with one bulk update per this many books or seconds, whichever comes first
+PARSER_WRITE_BATCH_SIZE = 100
+PARSER_WRITE_FLUSH_INTERVAL = 5
+# The last flush of a stopping writer is tried again this many times, the pause doubles from the flush interval
+PARSER_WRITE_CLOSE_RETRIES = 3
+
+# Rating and rank history: raw points are rolled up into hourly averages after the first
+# period, hourly ones into daily averages after the second; daily points are kept
+PARSER_HISTORY_RAW_RETENTION = timedelta(days=2)
+PARSER_HISTORY_HOURLY_RETENTION = timedelta(days=30)
+
+# Full review crawls (crawl_reviews): listing pages read per book at most, newest reviews first,
+# and how often the reviews of a book are crawled again
+PARSER_REVIEW_MAX_PAGES = 10
+PARSER_REVIEW_REFRESH_INTERVAL = timedelta(days=1)
+
+# Pagination of the book list: "offset" shows numbered pages, "keyset" only previous/next
+# links but its pages cost the same however deep they are; a ?cursor= parameter always uses keyset
+PARSER_BOOK_LIST_PAGINATION = "offset"
+
+# Bulk imports (import_books): books inserted per query, and invalid rows listed on the import page
+PARSER_IMPORT_BATCH_SIZE = 1000
+PARSER_IMPORT_MAX_SHOWN_ERRORS = 50
+# Exports (/books/export/, export_books): rows read per query and written per block, a Parquet row group
+PARSER_EXPORT_CHUNK_SIZE = 5000
+
+# JSON API (/books/api/): books per page by default and at most, with ?limit=
+PARSER_API_PAGE_SIZE = 100
+PARSER_API_MAX_PAGE_SIZE = 1000
+
+# Seconds book list pages, book charts and book page fragments are cached at most, saves
+# invalidate them earlier
+PARSER_PAGE_CACHE_TIMEOUT = 300
+
+# Per-stage crawl metrics served at /books/metrics/ in Prometheus format. Crawl workers write
+# their samples to the directory every export interval seconds, files of workers that stopped
+# are dropped after the retention, which the counters of a Prometheus rate() see as a reset
+PARSER_METRICS_ENABLED = True
+PARSER_METRICS_DIR = BASE_DIR / "data" / "metrics"
+PARSER_METRICS_EXPORT_INTERVAL = 15
+PARSER_METRICS_RETENTION = timedelta(hours=1)
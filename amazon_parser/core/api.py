@@ -0,0 +1,186 @@
+"""
+Read-only JSON API of books, series and parse status for dashboards.
+
+Responses carry an ETag and a Last-Modified time taken from the version
+stamps of core.cache, which every save, parse included, bumps. A poll of
+something unchanged is answered with 304 before any database query. Book
+lists use keyset pagination and ?fields= selects the book fields, the
+popular_reviews blobs are only loaded when asked for.
+"""
+from typing import Callable, Final
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, set_response_etag
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_GET
+
+from .cache import book_modified_at, book_version, list_modified_at, list_version, params_hash
+from .filters import BookFilter
+from .jobs import ACTIVE_STATUSES, job_progress
+from .models import Book, BookSeries, CrawlJob
+from .pagination import InvalidCursor, KeysetPaginator
+
+
+def _series_title(book: Book) -> str | None:
+    return book.series.title if book.series_id else None
+
+
+# Book fields of the API: the model fields to load and how to read the value
+BOOK_FIELDS: Final[dict[str, tuple[tuple[str, ...], Callable[[Book], object]]]] = {
+    name: ((name,), lambda book, name=name: getattr(book, name))
+    for name in (
+        'id', 'name', 'url', 'language', 'rating', 'reviews_count', 'popular_reviews_count', 'best_seller_ranks',
+        'popular_reviews', 'parse_status', 'parsed_at', 'next_parse_at', 'parse_failures', 'last_error',
+        'created_at', 'reviews_crawled_at',
+    )
+} | {
+    'series_id': (('series',), lambda book: book.series_id),
+    'series': (('series__title',), _series_title),
+}
+DEFAULT_BOOK_FIELDS: Final = tuple(name for name in BOOK_FIELDS if name != 'popular_reviews')
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def _error(message: str, status: int = 400) -> JsonResponse:
+    return JsonResponse({'error': message}, status=status)
+
+
+def _requested_fields(request) -> tuple[str, ...]:
+    if 'fields' not in request.GET:
+        return DEFAULT_BOOK_FIELDS
+    fields = tuple(dict.fromkeys(name.strip() for name in request.GET['fields'].split(',') if name.strip()))
+    unknown = [name for name in fields if name not in BOOK_FIELDS]
+    if unknown:
+        raise BadRequest(f"Unknown fields: {', '.join(unknown)}, expected some of: {', '.join(BOOK_FIELDS)}")
+    return fields or ('id',)
+
+
+def _load_fields(queryset, fields: tuple[str, ...]):
+    """Load only the columns of the requested fields, the JSON blobs stay in the database otherwise."""
+    columns = {'id'} | {column for name in fields for column in BOOK_FIELDS[name][0]}
+    if 'series__title' in columns:
+        queryset = queryset.select_related('series')
+    return queryset.only(*columns)
+
+
+def book_data(book: Book, fields: tuple[str, ...]) -> dict:
+    return {name: BOOK_FIELDS[name][1](book) for name in fields}
+
+
+def _page_url(request, cursor: str | None) -> str | None:
+    if cursor is None:
+        return None
+    params = request.GET.copy()
+    params['cursor'] = cursor
+    return f'{request.path}?{params.urlencode()}'
+
+
+def _list_etag(request, *args, **kwargs) -> str:
+    return f'{list_version()}-{params_hash(request.GET)}'
+
+
+def _list_last_modified(request, *args, **kwargs):
+    return list_modified_at()
+
+
+def _book_etag(request, pk) -> str:
+    return f'{book_version(pk)}-{params_hash(request.GET)}'
+
+
+def _book_last_modified(request, pk):
+    return book_modified_at(pk)
+
+
+@require_GET
+@cache_control(no_cache=True)
+@condition(etag_func=_list_etag, last_modified_func=_list_last_modified)
+def books(request):
+    """Books matching the book list's filter and sort parameters, a page at a time."""
+    try:
+        fields = _requested_fields(request)
+        limit = int(request.GET.get('limit', settings.PARSER_API_PAGE_SIZE))
+        if not 1 <= limit <= settings.PARSER_API_MAX_PAGE_SIZE:
+            raise BadRequest(f"limit must be between 1 and {settings.PARSER_API_MAX_PAGE_SIZE}")
+    except BadRequest as e:
+        return _error(str(e))
+    except ValueError:
+        return _error("limit must be a number")
+
+    book_filter = BookFilter(request.GET, queryset=Book.objects.all())
+    if not book_filter.is_valid():
+        return JsonResponse({'error': 'Invalid filter', 'fields': book_filter.errors.get_json_data()}, status=400)
+    queryset = _load_fields(book_filter.qs, fields)
+    try:
+        page = KeysetPaginator(queryset, limit).page(request.GET.get('cursor') or None)
+    except InvalidCursor:
+        return _error("Invalid cursor")
+    return JsonResponse({
+        'results': [book_data(book, fields) for book in page],
+        'next': _page_url(request, page.next_cursor if page.has_next else None),
+        'previous': _page_url(request, page.previous_cursor if page.has_previous else None),
+    })
+
+
+@require_GET
+@cache_control(no_cache=True)
+@condition(etag_func=_book_etag, last_modified_func=_book_last_modified)
+def book(request, pk):
+    try:
+        fields = _requested_fields(request)
+    except BadRequest as e:
+        return _error(str(e))
+    return JsonResponse(book_data(get_object_or_404(_load_fields(Book.objects.all(), fields), pk=pk), fields))
+
+
+@require_GET
+@cache_control(no_cache=True)
+@condition(etag_func=_list_etag, last_modified_func=_list_last_modified)
+def series(request):
+    return JsonResponse({
+        'results': list(
+            BookSeries.objects.annotate(books_count=Count('books')).order_by('title', 'id').values('id', 'title', 'books_count')
+        ),
+    })
+
+
+@require_GET
+@cache_control(no_cache=True)
+def parse_status(request):
+    """Progress of the unfinished crawl jobs and the number of books per parse status."""
+    # Book counts change with books only, job progress changes with every finished task
+    counts_key = f'books:status:{list_version()}'
+    counts = cache.get(counts_key)
+    if counts is None:
+        counts = {
+            row['parse_status'] or 'not parsed': row['count']
+            for row in Book.objects.values('parse_status').annotate(count=Count('id')).order_by()
+        }
+        cache.set(counts_key, counts, settings.PARSER_PAGE_CACHE_TIMEOUT)
+    jobs = []
+    for job in CrawlJob.objects.filter(status__in=ACTIVE_STATUSES).order_by('created_at'):
+        progress = job_progress(job)
+        jobs.append({
+            'id': job.id,
+            'kind': job.kind,
+            'status': job.status,
+            'created_at': job.created_at,
+            'started_at': job.started_at,
+            'total': progress.total,
+            'queued': progress.queued,
+            'running': progress.running,
+            'done': progress.done,
+            'failed': progress.failed,
+            'percent': round(progress.percent, 1),
+            'eta_seconds': round(progress.eta.total_seconds()) if progress.eta else None,
+        })
+    response = JsonResponse({'books': counts, 'jobs': jobs})
+    # The body is built anyway, an unchanged one is still not sent again
+    set_response_etag(response)
+    return get_conditional_response(request, etag=response['ETag'], response=response)
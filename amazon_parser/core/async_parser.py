@@ -0,0 +1,264 @@
+"""
+Asyncio fetch backend.
+
+A single event loop keeps hundreds of requests in flight where the
+requests based AmazonKDPParser needs a thread for each one. Every proxy
+gets its own httpx client, a browser-like session with keep-alive
+connections and HTTP/2 when the proxy tunnels it, which visits the warm-up
+pages before its first product page. Concurrency is bounded
+per proxy and per host, and pages are parsed in a thread pool so parsing
+never stalls the loop. parse_amazon_book keeps the contract of the
+synchronous parser: the same ParsedResult and the same fetch errors.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+import logging
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .marketplaces import url_host
+from .metrics import HttpxTrace, observe_fetch
+from .snapshots import default_store
+from .utils import (
+    RETRYABLE_STATUS_CODES,
+    WARM_UP_URLS,
+    AmazonKDPParser,
+    FetchedPage,
+    FetchError,
+    ParsedResult,
+    ProxyHealth,
+    RetryableFetchError,
+    browser_headers,
+    get_proxy_manager,
+    parse_retry_after,
+)
+
+try:
+    import httpx
+except ImportError:  # only async workers need httpx
+    httpx = None
+
+try:
+    import h2
+except ImportError:  # HTTP/2 is optional, httpx falls back to HTTP/1.1
+    h2 = None
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncHostRateLimiter:
+    """asyncio counterpart of HostRateLimiter, configured by the same PARSER_HOST_RATE_LIMITS."""
+
+    def __init__(self, limits: dict[str, dict] | None = None):
+        self.limits = limits if limits is not None else settings.PARSER_HOST_RATE_LIMITS
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+        self._interval_locks: dict[str, asyncio.Lock] = {}
+        self._next_start: dict[str, float] = {}
+
+    def _host_limits(self, host: str) -> dict:
+        return self.limits.get(host) or self.limits.get('default') or {}
+
+    @asynccontextmanager
+    async def slot(self, url: str):
+        """Hold a request slot for the host of the url for the duration of the request."""
+        host = url_host(url)
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self._host_limits(host).get('concurrency', 1))
+            self._interval_locks[host] = asyncio.Lock()
+            self._next_start[host] = 0.0
+        interval = self._host_limits(host).get('interval', 0)
+        async with self._semaphores[host]:
+            async with self._interval_locks[host]:
+                delay = self._next_start[host] - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                self._next_start[host] = time.monotonic() + interval
+            yield
+
+
+class AsyncAmazonKDPParser:
+    """Parser fetching pages with asyncio, shared by every book of an event loop."""
+
+    def __init__(
+        self,
+        rate_limiter: AsyncHostRateLimiter | None = None,
+        snapshot_store=None,
+        proxy_concurrency: int | None = None,
+        parse_workers: int | None = None,
+        http2: bool | None = None,
+    ):
+        """
+        Args:
+            rate_limiter: Per-host limiter, a new one by default
+            snapshot_store (SnapshotStore, optional): Archive for fetched pages, the configured one by default
+            proxy_concurrency: Maximum requests in flight per proxy, PARSER_ASYNC_PROXY_CONCURRENCY by default
+            parse_workers: Threads parsing pages, PARSER_ASYNC_PARSE_WORKERS by default
+            http2: Negotiate HTTP/2, PARSER_ASYNC_HTTP2 by default
+        """
+        if httpx is None:
+            raise ImproperlyConfigured("The async fetch backend needs httpx, install the async extra")
+        self.rate_limiter = rate_limiter or AsyncHostRateLimiter()
+        self.snapshot_store = snapshot_store if snapshot_store is not None else default_store()
+        self.proxy_manager = get_proxy_manager()
+        self.proxy_concurrency = proxy_concurrency or settings.PARSER_ASYNC_PROXY_CONCURRENCY
+        self.http2 = settings.PARSER_ASYNC_HTTP2 if http2 is None else http2
+        if self.http2 and h2 is None:
+            logger.warning("h2 is not installed, fetching with HTTP/1.1")
+            self.http2 = False
+        self.executor = ThreadPoolExecutor(
+            max_workers=parse_workers or settings.PARSER_ASYNC_PARSE_WORKERS, thread_name_prefix='page-parser',
+        )
+        # The extractors only read the page they are given, so one parser serves every thread
+        self._extractor = AmazonKDPParser(snapshot_store=False)
+        self._clients: dict[str | None, tuple[httpx.AsyncClient, asyncio.Semaphore]] = {}
+        self._warm_ups: dict[str | None, asyncio.Future] = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    def _client(self, proxy: ProxyHealth | None) -> tuple['httpx.AsyncClient', asyncio.Semaphore]:
+        """Return the client and concurrency limit of the proxy, None is the direct route."""
+        key = proxy.name if proxy else None
+        if key not in self._clients:
+            proxy_url = self.proxy_manager.get_proxy_dict(proxy.proxy)['https'] if proxy else None
+            client = httpx.AsyncClient(
+                proxy=proxy_url,
+                http2=self.http2,
+                headers=browser_headers(),
+                follow_redirects=True,
+                timeout=15,
+                limits=httpx.Limits(
+                    max_connections=self.proxy_concurrency,
+                    max_keepalive_connections=self.proxy_concurrency,
+                ),
+            )
+            self._clients[key] = client, asyncio.Semaphore(self.proxy_concurrency)
+        return self._clients[key]
+
+    async def _warm_client(self, proxy: ProxyHealth | None) -> tuple['httpx.AsyncClient', asyncio.Semaphore]:
+        """Return the client of the proxy, a new one is warmed up first when PARSER_SESSION_WARM_UP is on."""
+        client, semaphore = self._client(proxy)
+        if settings.PARSER_SESSION_WARM_UP:
+            key = proxy.name if proxy else None
+            if key not in self._warm_ups:
+                self._warm_ups[key] = asyncio.ensure_future(self._warm_up(proxy, client, semaphore))
+            # Every fetch through a new client waits for the one warm-up, a cancelled fetch must not cancel it
+            await asyncio.shield(self._warm_ups[key])
+        return client, semaphore
+
+    async def _warm_up(self, proxy: ProxyHealth | None, client: 'httpx.AsyncClient', semaphore: asyncio.Semaphore) -> None:
+        """Visit the warm-up pages, so the client looks like a browsing customer."""
+        for url in WARM_UP_URLS:
+            try:
+                async with semaphore, self.rate_limiter.slot(url):
+                    response = await client.get(url)
+                logger.info(f"Warm-up {url} through {proxy.name if proxy else 'direct route'}: {response.status_code}")
+            except httpx.HTTPError as e:
+                logger.warning(f"Warm-up request failed: {e!r}")
+
+    def _record_proxy_outcome(self, proxy: ProxyHealth | None, latency: float | None, outcome: str):
+        if proxy is not None:
+            self.proxy_manager.record(proxy, latency, outcome)
+
+    async def fetch_page(self, url: str, max_retries: int = 3) -> FetchedPage:
+        """
+        Fetch the page, see AmazonKDPParser.fetch_page.
+
+        Every attempt goes through a proxy picked by health, so captchas and
+        connection errors are retried at once through another route.
+
+        Raises:
+            RetryableFetchError: The page may be fetched later, with the server's Retry-After if given
+            FetchError: The page can not be fetched, e.g. it does not exist
+        """
+        reason = "no attempts made"
+        for attempt in range(max_retries):
+            proxy = self.proxy_manager.select()
+            client, semaphore = await self._warm_client(proxy)
+            try:
+                async with semaphore, self.rate_limiter.slot(url):
+                    started_at = time.monotonic()
+                    trace = HttpxTrace()
+                    response = await client.get(url, extensions={'trace': trace})
+            except httpx.HTTPError as e:
+                logger.error(f"Error during fetch of {url}: {e!r}")
+                observe_fetch(url, proxy, 'failed')
+                self._record_proxy_outcome(proxy, None, 'error')
+                reason = f"request failed: {e!r}"
+                if proxy is None:
+                    break
+                continue
+            latency = time.monotonic() - started_at
+            timed = dict(
+                timings=trace.timings,
+                headers_seconds=trace.headers_seconds,
+                total_seconds=latency,
+                size=len(response.content),
+            )
+
+            if response.status_code in RETRYABLE_STATUS_CODES:
+                logger.warning(f"Throttled: {response.status_code}, reason: {response.reason_phrase}")
+                observe_fetch(url, proxy, 'throttled', **timed)
+                self._record_proxy_outcome(proxy, latency, 'error')
+                raise RetryableFetchError(
+                    f"HTTP {response.status_code} {response.reason_phrase}",
+                    retry_after=parse_retry_after(response.headers.get('Retry-After')),
+                )
+            if response.is_error:
+                logger.error(f"Failed to fetch data. Response: {response.status_code}, reason: {response.reason_phrase}")
+                observe_fetch(url, proxy, 'error', **timed)
+                self._record_proxy_outcome(proxy, latency, 'error')
+                raise FetchError(f"HTTP {response.status_code} {response.reason_phrase}")
+
+            page = FetchedPage(url=url, content=response.content, encoding=response.charset_encoding)
+            # A byte scan, cheap enough for the event loop
+            if page.is_captcha:
+                logger.warning(f"Captcha detected through {proxy.name if proxy else 'direct route'}")
+                observe_fetch(url, proxy, 'captcha', **timed)
+                self._record_proxy_outcome(proxy, latency, 'captcha')
+                # The flagged session's cookies would follow the next request through this proxy
+                client.cookies.clear()
+                reason = "captcha"
+                if proxy is None:
+                    break
+                continue
+
+            observe_fetch(url, proxy, 'ok', **timed)
+            self._record_proxy_outcome(proxy, latency, 'ok')
+            return page
+
+        logger.error(f"All attempts to fetch {url} failed")
+        raise RetryableFetchError(f"All attempts failed, last: {reason}")
+
+    async def fetch_book_page(self, url: str, book_id: int | None = None) -> FetchedPage:
+        """Fetch the Amazon book page and archive it."""
+        page = await self.fetch_page(url)
+        if self.snapshot_store:
+            # archive_async() blocks while the snapshot writer is behind, the event loop must not wait with it
+            await asyncio.get_running_loop().run_in_executor(
+                self.executor, partial(self.snapshot_store.archive_async, url, page.content, book_id=book_id),
+            )
+        return page
+
+    async def parse_page(self, page: FetchedPage) -> ParsedResult:
+        """Parse the page in the executor, the tree build would block the event loop."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._extractor.parse_page, page)
+
+    async def parse_amazon_book(self, url: str, book_id: int | None = None) -> ParsedResult:
+        """Parse the Amazon book page and return the data."""
+        return await self.parse_page(await self.fetch_book_page(url, book_id=book_id))
+
+    async def aclose(self) -> None:
+        for warm_up in self._warm_ups.values():
+            warm_up.cancel()
+        self._warm_ups.clear()
+        await asyncio.gather(*(client.aclose() for client, _ in self._clients.values()))
+        self._clients.clear()
+        self.executor.shutdown(wait=False)
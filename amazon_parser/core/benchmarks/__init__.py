@@ -0,0 +1,153 @@
+"""
+Parser benchmark over a fixed corpus of product pages.
+
+corpus/ holds synthetic pages with the structure of real product pages of
+several marketplaces, with and without best seller ranks and reviews, and
+a captcha page. The name of a page starts with its marketplace, whose
+extraction rules it is parsed with. manifest.json keeps the expected extraction result of every
+page, recorded from whole page trees, so a faster parser or the partial
+parsing fast path can not silently extract less.
+"""
+from dataclasses import asdict, dataclass
+import gc
+import json
+from pathlib import Path
+import platform
+import time
+import tracemalloc
+from typing import Final
+
+from bs4.builder import builder_registry
+from django.test.utils import override_settings
+
+from ..extraction import extract_fields
+from ..html_backends import HTML_BACKENDS
+from ..marketplaces import marketplace_of
+from ..utils import AmazonKDPParser, FetchedPage
+
+CORPUS_DIR: Final = Path(__file__).parent / 'corpus'
+MANIFEST: Final = CORPUS_DIR / 'manifest.json'
+
+
+@dataclass
+class CorpusPage:
+    name: str
+    content: bytes
+    expected: dict | None
+
+    @property
+    def url(self) -> str:
+        """Product page url of the page's marketplace, e.g. https://www.amazon.de/ for de_full.html"""
+        return f"https://www.amazon.{self.name.split('_')[0]}/"
+
+
+def load_corpus() -> list[CorpusPage]:
+    """Return the corpus pages with their expected results, pages missing from the manifest expect None."""
+    manifest = json.loads(MANIFEST.read_text()) if MANIFEST.exists() else {}
+    return [
+        CorpusPage(name=path.name, content=path.read_bytes(), expected=manifest.get(path.name))
+        for path in sorted(CORPUS_DIR.glob('*.html'))
+    ]
+
+
+def available_backends() -> list[str]:
+    return [backend for backend in HTML_BACKENDS if builder_registry.lookup(backend)]
+
+
+def extract(parser: AmazonKDPParser, page: CorpusPage) -> dict:
+    """Parse the page the way the crawler does and return the result, or the error raised."""
+    try:
+        return asdict(parser.parse_page(FetchedPage(url=page.url, content=page.content)))
+    except Exception as e:
+        return {'error': str(e)}
+
+
+def _timed(func, *args) -> float:
+    started_at = time.perf_counter()
+    try:
+        func(*args)
+    except Exception:
+        pass
+    return time.perf_counter() - started_at
+
+
+def benchmark_backend(parser: AmazonKDPParser, corpus: list[CorpusPage], backend: str, rounds: int, partial: bool) -> dict:
+    """Measure full parses, the tree build and the extraction, and the peak memory of one pass."""
+    with override_settings(PARSER_HTML_BACKEND=backend, PARSER_PARTIAL_PARSING=partial):
+        mismatches = [page.name for page in corpus if extract(parser, page) != page.expected]
+
+        parse_time = sum(_timed(extract, parser, page) for _ in range(rounds) for page in corpus)
+
+        build_time = extract_time = 0.0
+        for _ in range(rounds):
+            for page in corpus:
+                started_at = time.perf_counter()
+                fetched = FetchedPage(url=page.url, content=page.content)
+                soup = fetched.soup
+                build_time += time.perf_counter() - started_at
+                extract_time += _timed(extract_fields, soup, marketplace_of(page.url), fetched.language)
+
+        # tracemalloc slows every allocation down, so memory gets a pass of its own
+        gc.collect()
+        tracemalloc.start()
+        try:
+            for page in corpus:
+                extract(parser, page)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    parses = rounds * len(corpus)
+    return {
+        'pages_per_sec': round(parses / parse_time, 2),
+        'parse_ms': round(parse_time / parses * 1000, 3),
+        'build_ms': round(build_time / parses * 1000, 3),
+        'extract_ms': round(extract_time / parses * 1000, 3),
+        'peak_memory_kib': round(peak / 1024),
+        'mismatches': mismatches,
+    }
+
+
+def run_benchmark(backends: list[str] | None = None, rounds: int = 5, partial: bool = True) -> dict:
+    """Benchmark the parser over the corpus with every given or installed backend."""
+    corpus = load_corpus()
+    parser = AmazonKDPParser(snapshot_store=False)
+    return {
+        'python': platform.python_version(),
+        'rounds': rounds,
+        'partial_parsing': partial,
+        'corpus': {'pages': len(corpus), 'bytes': sum(len(page.content) for page in corpus)},
+        'backends': {
+            backend: benchmark_backend(parser, corpus, backend, rounds, partial)
+            for backend in backends or available_backends()
+        },
+    }
+
+
+def find_regressions(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Compare results with a baseline run, throughput may drop and memory grow by the threshold fraction."""
+    regressions = []
+    if baseline.get('partial_parsing', False) != results['partial_parsing']:
+        return ["The baseline was run with the other parsing mode, --full-parse must match"]
+    for backend, current in results['backends'].items():
+        previous = baseline.get('backends', {}).get(backend)
+        if not previous:
+            continue
+        if current['pages_per_sec'] < previous['pages_per_sec'] * (1 - threshold):
+            regressions.append(
+                f"{backend}: {current['pages_per_sec']} pages/sec, baseline {previous['pages_per_sec']}"
+            )
+        if current['peak_memory_kib'] > previous['peak_memory_kib'] * (1 + threshold):
+            regressions.append(
+                f"{backend}: {current['peak_memory_kib']} KiB peak memory, baseline {previous['peak_memory_kib']}"
+            )
+    return regressions
+
+
+def update_manifest(backend: str = 'lxml') -> dict:
+    """Record the current extraction results of whole page trees as the expected ones."""
+    parser = AmazonKDPParser(snapshot_store=False)
+    with override_settings(PARSER_HTML_BACKEND=backend, PARSER_PARTIAL_PARSING=False):
+        manifest = {page.name: extract(parser, page) for page in load_corpus()}
+    MANIFEST.write_text(json.dumps(manifest, indent=2, ensure_ascii=False) + '\n')
+    return manifest
@@ -0,0 +1,111 @@
+"""
+Versioned cache of book list pages, the series list and book page fragments.
+
+Cache keys contain version stamps instead of being deleted on change: the
+book list version changes with any book or series, the version of a book
+with that book, and the books epoch with bulk changes of many books, e.g.
+a history rollup. Versions are bumped by model signals and by the bulk
+writers, which send no signals, once their transaction has committed, so
+a reader can never cache rows of the old version under the new one.
+
+The version stamps live in the cache itself, so crawl workers and the web
+server must share a cache backend, e.g. the file based one.
+"""
+from datetime import datetime, timezone
+from hashlib import sha1
+import time
+from typing import Iterable
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import BookSeries
+
+LIST_VERSION_KEY = 'books:list:version'
+EPOCH_KEY = 'books:epoch'
+
+
+def _book_version_key(book_id: int) -> str:
+    return f'book:{book_id}:version'
+
+
+def _new_stamp() -> int:
+    # Time based, so a version key that was evicted never comes back as an old value
+    return time.time_ns()
+
+
+def _version(key: str) -> int:
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_stamp(), None)
+        version = cache.get(key)
+    return version
+
+
+def list_version() -> int:
+    return _version(LIST_VERSION_KEY)
+
+
+def book_version(book_id: int) -> str:
+    """Version of the cached fragments of a book, changes with the book and with bulk changes."""
+    return f'{_version(EPOCH_KEY)}.{_version(_book_version_key(book_id))}'
+
+
+def _stamp_datetime(stamp: int) -> datetime:
+    return datetime.fromtimestamp(stamp / 1e9, tz=timezone.utc)
+
+
+def list_modified_at() -> datetime:
+    """Time of the last change of any book or series, or a later time if the version was evicted."""
+    return _stamp_datetime(list_version())
+
+
+def book_modified_at(book_id: int) -> datetime:
+    """Time of the last change of the book, or a later time if its version was evicted."""
+    return _stamp_datetime(max(_version(EPOCH_KEY), _version(_book_version_key(book_id))))
+
+
+def _bump(book_ids: list[int] | None) -> None:
+    stamp = _new_stamp()
+    keys = {LIST_VERSION_KEY: stamp}
+    if book_ids is None:
+        keys[EPOCH_KEY] = stamp
+    else:
+        keys.update((_book_version_key(book_id), stamp) for book_id in book_ids)
+    cache.set_many(keys, None)
+
+
+def invalidate_books(book_ids: Iterable[int] | None = None) -> None:
+    """
+    Drop the cached pages showing the given books, or all books when None.
+
+    Inside a transaction the versions are bumped once it commits.
+    """
+    book_ids = list(book_ids) if book_ids is not None else None
+    transaction.on_commit(lambda: _bump(book_ids))
+
+
+def params_hash(params) -> str:
+    """Hash of query parameters, the same for any order of the parameters."""
+    query = '&'.join(f'{key}={value}' for key, values in sorted(params.lists()) for value in values)
+    return sha1(query.encode()).hexdigest()
+
+
+def list_cache_key(params) -> str:
+    """Cache key of a book list page by its query parameters."""
+    return f'books:list:{list_version()}:{params_hash(params)}'
+
+
+def book_cache_key(book_id: int, name: str) -> str:
+    return f'book:{book_id}:{book_version(book_id)}:{name}'
+
+
+def series_choices() -> list[tuple[int, str]]:
+    """Primary keys and titles of all series, sorted by title."""
+    key = f'books:series:{list_version()}'
+    choices = cache.get(key)
+    if choices is None:
+        choices = list(BookSeries.objects.order_by('title', 'id').values_list('id', 'title'))
+        cache.set(key, choices, settings.PARSER_PAGE_CACHE_TIMEOUT)
+    return choices
@@ -0,0 +1,537 @@
+"""
+Concurrent bulk crawl engine with per-marketplace rate limits
+"""
+import asyncio
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+import logging
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django import db
+from django.conf import settings
+from django.db import transaction
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from .cache import invalidate_books
+from .history import record_history
+from .marketplaces import url_host
+from .metrics import DB_SAVE_SECONDS, DB_SAVED_BOOKS, start_exporter
+from .models import Book, CrawlTask, TaskStatus
+from .pagination import keyset_batches
+
+logger = logging.getLogger(__name__)
+
+
+class HostRateLimiter:
+    """
+    Limits concurrent requests and request rate per host.
+
+    Limits are given as {host: {"concurrency": int, "interval": float}},
+    the "default" entry is used for hosts without their own limits.
+    """
+
+    def __init__(self, limits: dict[str, dict] | None = None):
+        self.limits = limits if limits is not None else settings.PARSER_HOST_RATE_LIMITS
+        self._lock = threading.Lock()
+        self._semaphores: dict[str, threading.BoundedSemaphore] = {}
+        self._interval_locks: dict[str, threading.Lock] = {}
+        self._next_start: dict[str, float] = {}
+
+    def _host_limits(self, host: str) -> dict:
+        return self.limits.get(host) or self.limits.get('default') or {}
+
+    def _host_state(self, host: str) -> tuple[threading.BoundedSemaphore, threading.Lock]:
+        with self._lock:
+            if host not in self._semaphores:
+                concurrency = self._host_limits(host).get('concurrency', 1)
+                self._semaphores[host] = threading.BoundedSemaphore(concurrency)
+                self._interval_locks[host] = threading.Lock()
+                self._next_start[host] = 0.0
+            return self._semaphores[host], self._interval_locks[host]
+
+    @contextmanager
+    def slot(self, url: str):
+        """Hold a request slot for the host of the url for the duration of the request."""
+        host = url_host(url)
+        semaphore, interval_lock = self._host_state(host)
+        interval = self._host_limits(host).get('interval', 0)
+        with semaphore:
+            with interval_lock:
+                delay = self._next_start[host] - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                self._next_start[host] = time.monotonic() + interval
+            yield
+
+
+@dataclass
+class CrawlStats:
+    total: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    retried: int = 0
+    # Seconds spent parsing every book, fetch included, and writing result batches
+    latencies: list[float] = field(default_factory=list, repr=False)
+    write_time: float = 0.0
+    writes: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, success: bool, retried: bool = False, latency: float | None = None) -> None:
+        with self._lock:
+            self.total += 1
+            if success:
+                self.succeeded += 1
+            elif retried:
+                self.retried += 1
+            else:
+                self.failed += 1
+            if latency is not None:
+                self.latencies.append(latency)
+
+    def record_write(self, seconds: float) -> None:
+        with self._lock:
+            self.write_time += seconds
+            self.writes += 1
+
+    def latency_percentile(self, percent: float) -> float | None:
+        """Return the book parse latency below which the given percent of books finished."""
+        with self._lock:
+            latencies = sorted(self.latencies)
+        if not latencies:
+            return None
+        return latencies[min(int(len(latencies) * percent / 100), len(latencies) - 1)]
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    @property
+    def books_per_minute(self) -> float:
+        return self.total / self.elapsed * 60 if self.elapsed else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.total} books ({self.succeeded} ok, {self.failed} failed, {self.retried} retried later) "
+            f"in {self.elapsed:.1f}s, {self.books_per_minute:.1f} books/min"
+        )
+
+
+class ThreadParsers:
+    """One warm parser per worker thread, so sessions and connections are reused across books."""
+
+    def __init__(self, rate_limiter: HostRateLimiter):
+        self.rate_limiter = rate_limiter
+        self._local = threading.local()
+
+    def get(self):
+        from .utils import AmazonKDPParser
+
+        parser = getattr(self._local, 'parser', None)
+        if parser is None:
+            parser = self._local.parser = AmazonKDPParser(rate_limiter=self.rate_limiter)
+        return parser
+
+
+def _held_tasks(claimed_by: str) -> QuerySet:
+    return CrawlTask.objects.filter(claimed_by=claimed_by, status=TaskStatus.RUNNING)
+
+
+class BookResultWriter:
+    """
+    Buffers parsed books and writes them in batches.
+
+    Every flush runs in one transaction: books are saved with bulk_update on
+    only their changed fields, history points of the books whose result
+    changed are added and the crawl tasks they came from are marked done or
+    failed, or queued again for a later retry. Books parsed to an unchanged
+    result only have their parse bookkeeping, e.g. parsed_at, updated. A
+    flush happens every batch_size books or flush_interval seconds,
+    whichever comes first. When the transaction of a flush fails, e.g. on a
+    locked database, its batch goes back in the buffers and is written with
+    the next flush.
+    """
+
+    def __init__(self, batch_size: int | None = None, flush_interval: float | None = None, stats: CrawlStats | None = None):
+        self.batch_size = batch_size or settings.PARSER_WRITE_BATCH_SIZE
+        self.flush_interval = flush_interval or settings.PARSER_WRITE_FLUSH_INTERVAL
+        self.stats = stats
+        self._lock = threading.Lock()
+        self._books: list[tuple[Book, frozenset[str]]] = []
+        self._parsed: list[Book] = []
+        # Task id: success, retry time, error and the claim that holds the task
+        self._tasks: dict[int, tuple[bool, datetime | None, str, str]] = {}
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, name='result-writer', daemon=True)
+        self._flusher.start()
+
+    def add(self, book: Book, changed: set[str], success: bool, task_id: int | None = None, claimed_by: str = '',
+            retry_at: datetime | None = None, error: str = '', urgent: bool = False, unchanged: bool = False) -> None:
+        # Urgent results, e.g. of a parse a user is waiting for, are written right away
+        with self._lock:
+            if changed:
+                self._books.append((book, frozenset(changed)))
+            if success and not unchanged:
+                self._parsed.append(book)
+            if task_id is not None:
+                self._tasks[task_id] = (success, retry_at, error, claimed_by)
+            full = len(self._books) + len(self._tasks) >= self.batch_size
+        if full or urgent:
+            try:
+                self.flush()
+            except Exception as e:
+                # The batch stays buffered, so the result is not lost for the caller
+                logger.error("Failed to flush parse results, keeping them for the next flush", exc_info=e)
+
+    def flush(self) -> None:
+        with self._lock:
+            books, self._books = self._books, []
+            parsed, self._parsed = self._parsed, []
+            tasks, self._tasks = self._tasks, {}
+        if not books and not parsed and not tasks:
+            return
+        # bulk_update writes the same columns for every row, so books are grouped by their changed fields
+        by_fields: dict[frozenset[str], list[Book]] = {}
+        for book, changed in books:
+            by_fields.setdefault(changed, []).append(book)
+        now = timezone.now()
+        # Tasks are grouped by their claim, a task whose lease expired meanwhile belongs to another claim now
+        finished: dict[str, list[CrawlTask]] = {}
+        retried: dict[str, list[CrawlTask]] = {}
+        for task_id, (success, retry_at, error, claimed_by) in tasks.items():
+            if retry_at is None:
+                status = TaskStatus.DONE if success else TaskStatus.FAILED
+                finished.setdefault(claimed_by, []).append(CrawlTask(id=task_id, status=status, finished_at=now, error=error))
+            else:
+                retried.setdefault(claimed_by, []).append(CrawlTask(
+                    id=task_id, status=TaskStatus.QUEUED, available_at=retry_at, claimed_by='', claimed_at=None, error=error,
+                ))
+        started_at = time.monotonic()
+        try:
+            with transaction.atomic():
+                for fields, group in by_fields.items():
+                    Book.objects.bulk_update(group, sorted(fields))
+                record_history(parsed)
+                written = 0
+                for claimed_by, group in finished.items():
+                    written += _held_tasks(claimed_by).bulk_update(group, ['status', 'finished_at', 'error'])
+                for claimed_by, group in retried.items():
+                    written += _held_tasks(claimed_by).bulk_update(
+                        group, ['status', 'available_at', 'claimed_by', 'claimed_at', 'error'],
+                    )
+        except Exception:
+            self._requeue(books, parsed, tasks)
+            raise
+        finally:
+            db.close_old_connections()
+        elapsed = time.monotonic() - started_at
+        # History points of the parsed books are invalidated by record_history
+        if books:
+            invalidate_books(book.id for book, _ in books)
+        if written < len(tasks):
+            logger.warning(f"Skipped {len(tasks) - written} tasks whose lease expired before their result was written")
+        DB_SAVE_SECONDS.observe(elapsed, operation='batch')
+        DB_SAVED_BOOKS.inc(len(books), operation='batch')
+        if self.stats is not None:
+            self.stats.record_write(elapsed)
+        logger.debug(f"Flushed {len(books)} books and {len(tasks)} tasks")
+
+    def claims(self) -> set[str]:
+        """Claims of the buffered tasks, their leases have to be renewed until they are written."""
+        with self._lock:
+            return {claimed_by for *_, claimed_by in self._tasks.values()}
+
+    def _requeue(self, books: list[tuple[Book, frozenset[str]]], parsed: list[Book],
+                 tasks: dict[int, tuple[bool, datetime | None, str, str]]) -> None:
+        # A failed batch goes back in front of the buffers and is written again with the next flush
+        with self._lock:
+            self._books[:0] = books
+            self._parsed[:0] = parsed
+            # A task added since the failed flush holds its newer state
+            self._tasks = {**tasks, **self._tasks}
+
+    def _flush_periodically(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("Failed to flush parse results", exc_info=e)
+
+    def close(self) -> None:
+        """
+        Stop the periodic flushes and write what is still buffered.
+
+        A failed last flush is tried again with a growing pause, the batch is
+        kept meanwhile. When every attempt fails the error is raised; the tasks
+        of the batch are still running under their claims then and are queued
+        again by requeue_stale_tasks once their leases expire.
+        """
+        self._stop.set()
+        self._flusher.join()
+        retries = settings.PARSER_WRITE_CLOSE_RETRIES
+        for attempt in range(retries + 1):
+            try:
+                self.flush()
+                return
+            except Exception as e:
+                if attempt == retries:
+                    with self._lock:
+                        logger.error(f"Failed to write {len(self._books)} books and {len(self._tasks)} tasks, "
+                                     f"their tasks are queued again when their leases expire")
+                    raise
+                pause = self.flush_interval * 2 ** attempt
+                logger.warning(f"Failed to flush parse results, trying again in {pause:.1f}s", exc_info=e)
+                time.sleep(pause)
+
+
+def crawl_books(
+    queryset: QuerySet,
+    workers: int | None = None,
+    chunk_size: int | None = None,
+    rate_limiter: HostRateLimiter | None = None,
+) -> CrawlStats:
+    """
+    Parse books of the queryset concurrently with a pool of worker threads.
+
+    The queryset is read in keyset batches of chunk_size books, so the whole
+    table never sits in memory and no read statement stays open while the
+    results are written, and at most two books per worker are queued at any
+    time. Every thread reuses its parser and results are written in batches.
+    """
+    from .tasks import parse_book
+    from .utils import get_proxy_manager
+
+    workers = workers or settings.PARSER_CRAWL_WORKERS
+    chunk_size = chunk_size or settings.PARSER_CRAWL_CHUNK_SIZE
+    rate_limiter = rate_limiter or HostRateLimiter()
+    parsers = ThreadParsers(rate_limiter)
+    stats = CrawlStats()
+    writer = BookResultWriter(stats=stats)
+    progress_every = settings.PARSER_CRAWL_PROGRESS_EVERY
+    in_flight = threading.BoundedSemaphore(workers * 2)
+
+    def _crawl_one(book: Book) -> None:
+        # Transient failures are not retried within the crawl, the book's next_parse_at is set to the retry time
+        started_at = time.monotonic()
+        try:
+            outcome = parse_book(book, parsers.get())
+            writer.add(book, outcome.changed, outcome.success, unchanged=outcome.unchanged)
+            success = outcome.success
+        except Exception as e:
+            logger.error(f"Unexpected error while crawling book {book.id}", exc_info=e)
+            success = False
+        finally:
+            in_flight.release()
+        stats.record(success, latency=time.monotonic() - started_at)
+        if stats.total % progress_every == 0:
+            logger.info(f"Crawl progress: {stats}")
+
+    start_exporter()
+    logger.info(f"Starting crawl with {workers} workers")
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='crawler') as executor:
+            for batch in keyset_batches(queryset, chunk_size):
+                for book in batch:
+                    in_flight.acquire()
+                    executor.submit(_crawl_one, book)
+    finally:
+        writer.close()
+    logger.info(f"Crawl finished: {stats}")
+    for proxy_stats in get_proxy_manager().stats():
+        logger.info(f"Proxy stats: {proxy_stats}")
+    return stats
+
+
+def _renewal_interval() -> float:
+    # Leases are renewed three times per lease, a slow renewal still lands before the lease expires
+    return settings.PARSER_TASK_LEASE.total_seconds() / 3
+
+
+def _has_queued_tasks(writer: BookResultWriter) -> bool:
+    # Buffered retries are still running in the database until they are written
+    writer.flush()
+    return CrawlTask.objects.filter(status=TaskStatus.QUEUED).exists()
+
+
+def run_worker(workers: int | None = None, stop: threading.Event | None = None, exit_when_idle: bool = False) -> CrawlStats:
+    """
+    Process tasks of the crawl job queue until stopped.
+
+    Tasks are claimed in batches that keep at most two books per worker thread
+    in flight. Leases of the tasks held are renewed while they are parsed or buffered,
+    tasks of crashed workers are requeued once their lease expires.
+    Transient fetch failures requeue the task with a backoff delay, so threads
+    never sleep on a throttled book, until PARSER_TASK_MAX_ATTEMPTS is reached.
+
+    Args:
+        workers: Number of crawler threads, PARSER_CRAWL_WORKERS by default
+        stop: Event that stops the worker after the running tasks
+        exit_when_idle: Return once no queued tasks are left, delayed retries included, instead of polling
+    """
+    from .jobs import claim_tasks, finish_jobs, renew_leases, requeue_stale_tasks, worker_id
+    from .tasks import parse_book
+
+    workers = workers or settings.PARSER_CRAWL_WORKERS
+    stop = stop or threading.Event()
+    parsers = ThreadParsers(HostRateLimiter())
+    stats = CrawlStats()
+    writer = BookResultWriter(stats=stats)
+    name = worker_id()
+    pending = set()
+    # Claims of the tasks being parsed, a task's result holds its claim in the writer afterwards
+    fetching: dict[int, str] = {}
+
+    def _run(task: CrawlTask) -> None:
+        retry_at = None
+        started_at = time.monotonic()
+        try:
+            outcome = parse_book(task.book, parsers.get())
+            success = outcome.success
+            if task.attempts < settings.PARSER_TASK_MAX_ATTEMPTS:
+                retry_at = outcome.retry_at
+            writer.add(
+                task.book, outcome.changed, success, task_id=task.id, claimed_by=task.claimed_by, retry_at=retry_at,
+                error=outcome.error, urgent=task.priority > 0, unchanged=outcome.unchanged,
+            )
+        except Exception as e:
+            logger.error(f"Unexpected error while crawling book {task.book_id}", exc_info=e)
+            success = False
+            writer.add(
+                task.book, set(), success, task_id=task.id, claimed_by=task.claimed_by, error=str(e),
+                urgent=task.priority > 0,
+            )
+        finally:
+            fetching.pop(task.id, None)
+        stats.record(success, retried=retry_at is not None, latency=time.monotonic() - started_at)
+        if stats.total % settings.PARSER_CRAWL_PROGRESS_EVERY == 0:
+            logger.info(f"Worker progress: {stats}")
+
+    start_exporter()
+    logger.info(f"Worker {name} started with {workers} threads")
+    next_maintenance = next_renewal = 0.0
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='worker') as executor:
+            while not stop.is_set():
+                if time.monotonic() >= next_renewal:
+                    renew_leases({*fetching.copy().values(), *writer.claims()})
+                    next_renewal = time.monotonic() + _renewal_interval()
+                if time.monotonic() >= next_maintenance:
+                    requeue_stale_tasks(settings.PARSER_TASK_LEASE)
+                    finish_jobs()
+                    next_maintenance = time.monotonic() + settings.PARSER_WORKER_POLL_INTERVAL
+
+                free_slots = workers * 2 - len(pending)
+                tasks = claim_tasks(name, free_slots) if free_slots > 0 else []
+                for task in tasks:
+                    fetching[task.id] = task.claimed_by
+                    pending.add(executor.submit(_run, task))
+
+                if pending:
+                    done, _ = wait(pending, timeout=settings.PARSER_WORKER_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                    pending -= done
+                elif exit_when_idle and not _has_queued_tasks(writer):
+                    break
+                else:
+                    stop.wait(settings.PARSER_WORKER_POLL_INTERVAL)
+            wait(pending)
+    finally:
+        writer.close()
+    finish_jobs()
+    logger.info(f"Worker {name} stopped: {stats}")
+    return stats
+
+
+def run_async_worker(concurrency: int | None = None, stop: threading.Event | None = None, exit_when_idle: bool = False) -> CrawlStats:
+    """
+    Process tasks of the crawl job queue with the asyncio fetch backend until stopped.
+
+    Same as run_worker, but up to concurrency books are fetched at once by a
+    single event loop instead of a thread each. Database access runs in
+    Django's sync thread, pages are parsed in the parser's thread pool.
+
+    Args:
+        concurrency: Number of books in flight, PARSER_ASYNC_CONCURRENCY by default
+        stop: Event that stops the worker after the running tasks
+        exit_when_idle: Return once no queued tasks are left, delayed retries included, instead of polling
+    """
+    return asyncio.run(_async_worker(
+        concurrency or settings.PARSER_ASYNC_CONCURRENCY, stop or threading.Event(), exit_when_idle,
+    ))
+
+
+async def _async_worker(concurrency: int, stop: threading.Event, exit_when_idle: bool) -> CrawlStats:
+    from .async_parser import AsyncAmazonKDPParser
+    from .jobs import claim_tasks, finish_jobs, renew_leases, requeue_stale_tasks, worker_id
+    from .tasks import parse_book_async
+
+    stats = CrawlStats()
+    writer = BookResultWriter(stats=stats)
+    name = worker_id()
+    pending: set[asyncio.Task] = set()
+    fetching: dict[int, str] = {}
+
+    async def _run(task: CrawlTask) -> None:
+        retry_at = None
+        started_at = time.monotonic()
+        try:
+            outcome = await parse_book_async(task.book, parser)
+            success = outcome.success
+            if task.attempts < settings.PARSER_TASK_MAX_ATTEMPTS:
+                retry_at = outcome.retry_at
+            await sync_to_async(writer.add)(
+                task.book, outcome.changed, success, task_id=task.id, claimed_by=task.claimed_by, retry_at=retry_at,
+                error=outcome.error, urgent=task.priority > 0, unchanged=outcome.unchanged,
+            )
+        except Exception as e:
+            logger.error(f"Unexpected error while crawling book {task.book_id}", exc_info=e)
+            success = False
+            await sync_to_async(writer.add)(
+                task.book, set(), success, task_id=task.id, claimed_by=task.claimed_by, error=str(e),
+                urgent=task.priority > 0,
+            )
+        finally:
+            fetching.pop(task.id, None)
+        stats.record(success, retried=retry_at is not None, latency=time.monotonic() - started_at)
+        if stats.total % settings.PARSER_CRAWL_PROGRESS_EVERY == 0:
+            logger.info(f"Worker progress: {stats}")
+
+    start_exporter()
+    logger.info(f"Async worker {name} started with {concurrency} books in flight")
+    next_maintenance = next_renewal = 0.0
+    try:
+        async with AsyncAmazonKDPParser() as parser:
+            while not stop.is_set():
+                if time.monotonic() >= next_renewal:
+                    await sync_to_async(renew_leases)({*fetching.values(), *writer.claims()})
+                    next_renewal = time.monotonic() + _renewal_interval()
+                if time.monotonic() >= next_maintenance:
+                    await sync_to_async(requeue_stale_tasks)(settings.PARSER_TASK_LEASE)
+                    await sync_to_async(finish_jobs)()
+                    next_maintenance = time.monotonic() + settings.PARSER_WORKER_POLL_INTERVAL
+
+                free_slots = concurrency - len(pending)
+                tasks = await sync_to_async(claim_tasks)(name, free_slots) if free_slots > 0 else []
+                for task in tasks:
+                    fetching[task.id] = task.claimed_by
+                    pending.add(asyncio.create_task(_run(task)))
+
+                if pending:
+                    _, pending = await asyncio.wait(
+                        pending, timeout=settings.PARSER_WORKER_POLL_INTERVAL, return_when=asyncio.FIRST_COMPLETED,
+                    )
+                elif exit_when_idle and not await sync_to_async(_has_queued_tasks)(writer):
+                    break
+                else:
+                    await asyncio.sleep(settings.PARSER_WORKER_POLL_INTERVAL)
+            if pending:
+                await asyncio.wait(pending)
+    finally:
+        await sync_to_async(writer.close)()
+    await sync_to_async(finish_jobs)()
+    logger.info(f"Async worker {name} stopped: {stats}")
+    return stats
@@ -0,0 +1,208 @@
+"""
+Streaming export of books and their history as CSV, JSON lines or Parquet.
+
+Rows are read in keyset batches and written in blocks of
+PARSER_EXPORT_CHUNK_SIZE rows, so memory stays the same however many rows
+are exported, and no read statement stays open while the response streams. Parquet needs pyarrow, every block becomes a row group.
+"""
+import csv
+from datetime import datetime
+import io
+import json
+from typing import Final, Iterable, Iterator
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import QuerySet
+
+from .models import BookMetricsHistory, BookRankHistory
+from .pagination import keyset_batches
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # only Parquet exports need pyarrow
+    pyarrow = None
+
+# Column name, queryset lookup and type of every dataset
+BOOK_COLUMNS: Final = (
+    ('id', 'id', 'int'),
+    ('name', 'name', 'str'),
+    ('url', 'url', 'str'),
+    ('language', 'language', 'str'),
+    ('series', 'series__title', 'str'),
+    ('rating', 'rating', 'float'),
+    ('reviews_count', 'reviews_count', 'int'),
+    ('popular_reviews_count', 'popular_reviews_count', 'int'),
+    ('best_seller_ranks', 'best_seller_ranks', 'json'),
+    ('parse_status', 'parse_status', 'str'),
+    ('parsed_at', 'parsed_at', 'datetime'),
+    ('created_at', 'created_at', 'datetime'),
+)
+RANK_COLUMNS: Final = (
+    ('book_id', 'book_id', 'int'),
+    ('category', 'category__name', 'str'),
+    ('captured_at', 'captured_at', 'datetime'),
+    ('resolution', 'resolution', 'str'),
+    ('rank', 'rank', 'int'),
+)
+METRIC_COLUMNS: Final = (
+    ('book_id', 'book_id', 'int'),
+    ('captured_at', 'captured_at', 'datetime'),
+    ('resolution', 'resolution', 'str'),
+    ('rating', 'rating', 'float'),
+    ('reviews_count', 'reviews_count', 'int'),
+)
+DATASETS: Final = {'books': BOOK_COLUMNS, 'ranks': RANK_COLUMNS, 'metrics': METRIC_COLUMNS}
+
+# Content type and file extension of every format
+FORMATS: Final = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'jsonl': ('application/x-ndjson; charset=utf-8', 'jsonl'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+
+def available_formats() -> list[str]:
+    return [name for name in FORMATS if name != 'parquet' or pyarrow is not None]
+
+
+def dataset_rows(dataset: str, books: QuerySet) -> Iterator[tuple]:
+    """
+    Rows of the dataset for the books, read in chunks.
+
+    Books keep the queryset's order, history rows are sorted by book and time.
+    Every chunk is two fully fetched queries, the ids of the next keyset page
+    and then the values of those rows.
+    """
+    lookups = [lookup for _, lookup, _ in DATASETS[dataset]]
+    if dataset == 'books':
+        queryset = books
+    else:
+        model = BookRankHistory if dataset == 'ranks' else BookMetricsHistory
+        queryset = model.objects.filter(book__in=books.values('id')).order_by('book_id', 'captured_at', 'id')
+    for batch in keyset_batches(queryset.select_related(None).only('id'), settings.PARSER_EXPORT_CHUNK_SIZE):
+        ids = [row.id for row in batch]
+        values = {row[0]: row[1:] for row in queryset.model.objects.filter(id__in=ids).values_list('id', *lookups)}
+        # Rows deleted since their page was read are left out
+        yield from (values[row_id] for row_id in ids if row_id in values)
+
+
+def _chunks(rows: Iterable[tuple], size: int) -> Iterator[list[tuple]]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _text_value(value, kind: str):
+    if value is None:
+        return ''
+    if kind == 'json':
+        return json.dumps(value, ensure_ascii=False)
+    if kind == 'datetime':
+        return value.isoformat()
+    return value
+
+
+def _write_csv(columns: tuple, rows: Iterable[tuple]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _, _ in columns])
+    kinds = [kind for _, _, kind in columns]
+    for chunk in _chunks(rows, settings.PARSER_EXPORT_CHUNK_SIZE):
+        writer.writerows([_text_value(value, kind) for value, kind in zip(row, kinds)] for row in chunk)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _write_jsonl(columns: tuple, rows: Iterable[tuple]) -> Iterator[bytes]:
+    names = [name for name, _, _ in columns]
+    for chunk in _chunks(rows, settings.PARSER_EXPORT_CHUNK_SIZE):
+        yield ''.join(
+            json.dumps(dict(zip(names, row)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n' for row in chunk
+        ).encode()
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file that keeps what was written until it is drained, pyarrow writes Parquet into it."""
+
+    def __init__(self):
+        self._parts: list[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data, self._parts = b''.join(self._parts), []
+        return data
+
+
+def _arrow_schema(columns: tuple):
+    types = {
+        'int': pyarrow.int64(),
+        'float': pyarrow.float64(),
+        'str': pyarrow.string(),
+        'json': pyarrow.string(),
+        'datetime': pyarrow.timestamp('us', tz='UTC'),
+    }
+    return pyarrow.schema([(name, types[kind]) for name, _, kind in columns])
+
+
+def _write_parquet(columns: tuple, rows: Iterable[tuple]) -> Iterator[bytes]:
+    schema = _arrow_schema(columns)
+    json_columns = [index for index, (_, _, kind) in enumerate(columns) if kind == 'json']
+    sink = _Sink()
+    with pyarrow.parquet.ParquetWriter(sink, schema, compression='zstd') as writer:
+        for chunk in _chunks(rows, settings.PARSER_EXPORT_CHUNK_SIZE):
+            data = [list(values) for values in zip(*chunk)]
+            for index in json_columns:
+                data[index] = [json.dumps(value, ensure_ascii=False) if value is not None else None for value in data[index]]
+            writer.write_table(pyarrow.Table.from_pydict(dict(zip(schema.names, data)), schema=schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+WRITERS: Final = {'csv': _write_csv, 'jsonl': _write_jsonl, 'parquet': _write_parquet}
+
+
+def export(dataset: str, export_format: str, books: QuerySet) -> Iterator[bytes]:
+    """
+    Stream a dataset of the books in the given format.
+
+    Args:
+        dataset: "books", "ranks" or "metrics"
+        export_format: "csv", "jsonl" or "parquet"
+        books: Books to export, or whose history to export
+
+    Returns:
+        Iterator: blocks of the file
+
+    Raises:
+        ImproperlyConfigured: for Parquet without pyarrow
+    """
+    if export_format == 'parquet' and pyarrow is None:
+        raise ImproperlyConfigured("Parquet exports need pyarrow, install the parquet extra")
+    return WRITERS[export_format](DATASETS[dataset], dataset_rows(dataset, books))
+
+
+def export_filename(dataset: str, export_format: str, now: datetime) -> str:
+    return f"{dataset}-{now:%Y%m%d-%H%M%S}.{FORMATS[export_format][1]}"
@@ -0,0 +1,488 @@
+"""
+Declarative extraction rules per marketplace, compiled once.
+
+Every field of a product page has an ordered chain of rules, the first rule
+that yields a value wins. rules/<marketplace>.json holds the chains of a
+marketplace and the number format of its language, "extends" names the file
+whose chains are tried after its own. default.json serves marketplaces
+without a file of their own. Numbers are read in the format of the page's
+language, e.g. English ones on a German page requested in English, which is
+the format of the file named like the language, default.json's for
+languages without one, or the marketplace's when the page names none. Files in PARSER_EXTRACTION_RULES_DIRS are read
+after the built-in ones and replace those of the same name, so a marketplace
+variant is a JSON file, not code.
+
+A rule has these keys:
+    select  CSS-like selector: compounds of tag, #id, .class and [attr] or
+            [attr=value] joined by descendant, ">", "+" or "~" combinators,
+            comma separated alternatives. A part without one reads the
+            element of the rule it belongs to
+    text    Regex the text of the element has to contain
+    value   "text" (default), "next_text" for the text node after the
+            element, or "@name" for an attribute
+    regex   Regex the value has to contain, its first group or else the
+            whole match is kept
+    type    "str" (default), "number", "int" or "rank"
+    many    Every matching element instead of the first one
+    parts   Rules within the element, their values make up a list
+    fields  Chains within the element by key, the element becomes a dict
+
+Rules are compiled to predicates when the files are loaded. The root rules
+of a marketplace are matched in a single walk over the tree, every element
+is dispatched on its id, classes and tag name to the few selectors that can
+match it, and the rules within an element walk that element once. Every
+tried rule counts a hit or a miss in amazon_parser_extraction_rules_total.
+"""
+from dataclasses import dataclass
+import hashlib
+import json
+import logging
+from pathlib import Path
+import re
+import threading
+from typing import Final, Iterator
+
+from bs4 import NavigableString, Tag
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from ..metrics import EXTRACTION_RULES
+
+logger = logging.getLogger(__name__)
+
+RULES_DIR: Final = Path(__file__).parent / 'rules'
+DEFAULT_RULES: Final = 'default'
+TYPES: Final = ('str', 'number', 'int', 'rank')
+
+_COMBINATOR_RE: Final = re.compile(r'\s*([>+~])\s*|\s+')
+_COMPOUND_RE: Final = re.compile(r'(?P<tag>[a-zA-Z][\w-]*|\*)?(?P<rest>(?:[#.][\w-]+|\[[\w-]+(?:=[^\]]*)?\])*)')
+_QUALIFIER_RE: Final = re.compile(r'#([\w-]+)|\.([\w-]+)|\[([\w-]+)(?:=([^\]]*))?\]')
+_DIGITS_RE: Final = re.compile(r'\d+')
+
+
+class InvalidRules(ImproperlyConfigured):
+    """A rule file can not be compiled."""
+
+
+@dataclass(frozen=True)
+class Compound:
+    tag: str | None = None
+    id: str | None = None
+    classes: frozenset[str] = frozenset()
+    attrs: tuple[tuple[str, str | None], ...] = ()
+
+    def matches(self, element: Tag) -> bool:
+        if self.tag is not None and element.name != self.tag:
+            return False
+        if self.id is not None and element.get('id') != self.id:
+            return False
+        if self.classes and not self.classes.issubset(element.get('class') or ()):
+            return False
+        for name, value in self.attrs:
+            actual = element.get(name)
+            if actual is None or (value is not None and actual != value):
+                return False
+        return True
+
+
+@dataclass(frozen=True)
+class Selector:
+    """A compiled selector, matched right to left from its last compound."""
+    key: Compound
+    # Compounds left of the key, the nearest first, with the combinator that joins each to the one on its right
+    context: tuple[tuple[str, Compound], ...] = ()
+
+    def matches(self, element: Tag) -> bool:
+        return self.key.matches(element) and _context_matches(element, self.context)
+
+
+def _previous_tags(element: Tag) -> Iterator[Tag]:
+    for sibling in element.previous_siblings:
+        if isinstance(sibling, Tag):
+            yield sibling
+
+
+def _context_matches(element: Tag, context: tuple[tuple[str, Compound], ...]) -> bool:
+    if not context:
+        return True
+    (combinator, compound), rest = context[0], context[1:]
+    if combinator == '>':
+        candidates = (element.parent,)
+    elif combinator == ' ':
+        candidates = element.parents
+    elif combinator == '+':
+        candidates = (next(_previous_tags(element), None),)
+    else:
+        candidates = _previous_tags(element)
+    return any(
+        candidate is not None and compound.matches(candidate) and _context_matches(candidate, rest)
+        for candidate in candidates
+    )
+
+
+def _compile_compound(text: str, selector: str) -> Compound:
+    match = _COMPOUND_RE.fullmatch(text)
+    if not match or not text:
+        raise InvalidRules(f"Invalid selector {selector!r} at {text!r}")
+    tag = match.group('tag')
+    element_id, classes, attrs = None, set(), []
+    for id_name, class_name, attr, value in _QUALIFIER_RE.findall(match.group('rest')):
+        if id_name:
+            element_id = id_name
+        elif class_name:
+            classes.add(class_name)
+        else:
+            attrs.append((attr, value.strip('"\'') if value else None))
+    return Compound(tag=tag if tag != '*' else None, id=element_id, classes=frozenset(classes), attrs=tuple(attrs))
+
+
+def compile_selector(selector: str) -> tuple[Selector, ...]:
+    """
+    Compile a selector, one Selector per comma separated alternative.
+
+    Raises:
+        InvalidRules: if the selector is not understood
+    """
+    compiled = []
+    for alternative in selector.split(','):
+        tokens = _COMBINATOR_RE.split(alternative.strip())
+        # split() alternates compounds and combinators, a run of whitespace is a descendant combinator
+        compounds = [_compile_compound(token, selector) for token in tokens[::2]]
+        combinators = [token or ' ' for token in tokens[1::2]]
+        context = tuple(zip(reversed(combinators), reversed(compounds[:-1])))
+        compiled.append(Selector(key=compounds[-1], context=context))
+    return tuple(compiled)
+
+
+@dataclass(frozen=True)
+class NumberFormat:
+    decimal: str = '.'
+    thousands: str = ','
+
+    def __post_init__(self):
+        pattern = re.compile(rf'(?<=\d)[{re.escape(self.thousands)}](?=\d{{3}}(?!\d))') if self.thousands else None
+        object.__setattr__(self, '_grouping_re', pattern)
+
+    def ungroup(self, text: str) -> str:
+        """Drop the thousands separators between digits, "12,345 in Books, Kids" -> "12345 in Books, Kids"."""
+        return self._grouping_re.sub('', text) if self._grouping_re else text
+
+    def number(self, text: str) -> float | None:
+        try:
+            return float(self.ungroup(text).strip().replace(self.decimal, '.'))
+        except ValueError:
+            return None
+
+    def integer(self, text: str) -> int | None:
+        digits = ''.join(_DIGITS_RE.findall(text))
+        return int(digits) if digits else None
+
+    def rank(self, text: str) -> dict:
+        """Place and category of a best sellers rank, "#1,203 in Poetry" -> 1203, "in Poetry"."""
+        text = self.ungroup(text)
+        place = _DIGITS_RE.search(text)
+        if not place:
+            return {'place': None, 'rank_name': text}
+        return {
+            'place': place.group(),
+            'rank_name': (text[:place.start()] + text[place.end():]).replace('#', '').strip(),
+        }
+
+
+@dataclass
+class Rule:
+    name: str
+    selectors: tuple[Selector, ...] | None = None
+    text: re.Pattern | None = None
+    value: str = 'text'
+    regex: re.Pattern | None = None
+    type: str = 'str'
+    many: bool = False
+    parts: 'RuleSet | None' = None
+    fields: 'RuleSet | None' = None
+
+
+def _element_value(element: Tag, value: str) -> str | None:
+    if value == 'text':
+        return element.get_text(strip=True)
+    if value == 'next_text':
+        sibling = element.next_sibling
+        if sibling is None:
+            return None
+        return sibling.strip() if isinstance(sibling, NavigableString) else sibling.get_text(strip=True)
+    attribute = element.get(value[1:])
+    return ' '.join(attribute) if isinstance(attribute, list) else attribute
+
+
+class RuleSet:
+    """Chains of rules by field, matched together in one walk of a tree."""
+
+    def __init__(self, chains: dict[str, tuple[Rule, ...]]):
+        self.chains = chains
+        self._by_id: dict[str, list[tuple[Selector, Rule]]] = {}
+        self._by_class: dict[str, list[tuple[Selector, Rule]]] = {}
+        self._by_tag: dict[str, list[tuple[Selector, Rule]]] = {}
+        self._any: list[tuple[Selector, Rule]] = []
+        for chain in chains.values():
+            for rule in chain:
+                for selector in rule.selectors or ():
+                    key = selector.key
+                    if key.id is not None:
+                        self._by_id.setdefault(key.id, []).append((selector, rule))
+                    elif key.classes:
+                        self._by_class.setdefault(min(key.classes), []).append((selector, rule))
+                    elif key.tag is not None:
+                        self._by_tag.setdefault(key.tag, []).append((selector, rule))
+                    else:
+                        self._any.append((selector, rule))
+
+    def scan(self, root: Tag) -> dict[int, list[Tag]]:
+        """Elements under the root matched by every rule, in document order, keyed by id() of the rule."""
+        matches: dict[int, list[Tag]] = {}
+        by_id, by_class, by_tag, any_ = self._by_id, self._by_class, self._by_tag, self._any
+        for element in root.descendants:
+            if not isinstance(element, Tag):
+                continue
+            candidates = []
+            if by_id and (element_id := element.get('id')) in by_id:
+                candidates += by_id[element_id]
+            if by_class:
+                for class_name in element.get('class') or ():
+                    if class_name in by_class:
+                        candidates += by_class[class_name]
+            if element.name in by_tag:
+                candidates += by_tag[element.name]
+            for selector, rule in candidates + any_ if any_ else candidates:
+                if selector.matches(element):
+                    found = matches.setdefault(id(rule), [])
+                    # An element matched by two alternatives of the rule counts once
+                    if not found or found[-1] is not element:
+                        found.append(element)
+        return matches
+
+    def extract(self, root: Tag, numbers: NumberFormat, marketplace: str, prefix: str = '') -> dict:
+        """Walk the tree once and return the value of every field, None for fields no rule matched."""
+        matches = self.scan(root) if self._has_selectors else {}
+        results = {}
+        for field_name, chain in self.chains.items():
+            label = f'{prefix}{field_name}'
+            value = None
+            for rule in chain:
+                elements = [root] if rule.selectors is None else matches.get(id(rule), [])
+                value = _evaluate(rule, elements, numbers, marketplace, label)
+                EXTRACTION_RULES.inc(field=label, rule=rule.name, outcome='miss' if value is None else 'hit', marketplace=marketplace)
+                if value is not None:
+                    break
+            results[field_name] = value
+        return results
+
+    @property
+    def _has_selectors(self) -> bool:
+        return bool(self._by_id or self._by_class or self._by_tag or self._any)
+
+
+def _evaluate(rule: Rule, elements: list[Tag], numbers: NumberFormat, marketplace: str, label: str):
+    """Value of the rule for its matched elements, None when it yields nothing."""
+    values = []
+    for element in elements:
+        if rule.text is not None and not rule.text.search(element.get_text(strip=True)):
+            continue
+        if rule.fields is not None:
+            value = rule.fields.extract(element, numbers, marketplace, f'{label}.')
+        elif rule.parts is not None:
+            value = []
+            for part in rule.parts.extract(element, numbers, marketplace, f'{label}.').values():
+                if isinstance(part, list):
+                    value += part
+                elif part is not None:
+                    value.append(part)
+            value = value or None
+        else:
+            value = _convert(rule, _element_value(element, rule.value), numbers)
+        if value is None:
+            continue
+        if not rule.many:
+            return value
+        values.append(value)
+    return values or None
+
+
+def _convert(rule: Rule, text: str | None, numbers: NumberFormat):
+    if text is None:
+        return None
+    if rule.regex is not None:
+        match = rule.regex.search(text)
+        if not match:
+            return None
+        text = match.group(1) if rule.regex.groups else match.group()
+    if rule.type == 'number':
+        return numbers.number(text)
+    if rule.type == 'int':
+        return numbers.integer(text)
+    if rule.type == 'rank':
+        return numbers.rank(text)
+    return text
+
+
+@dataclass
+class MarketplaceRules:
+    """Compiled chains of a rule file, with those of the files it extends."""
+    name: str
+    numbers: NumberFormat
+    rules: RuleSet
+
+    def extract(self, root: Tag, marketplace: str, numbers: NumberFormat | None = None) -> dict:
+        return self.rules.extract(root, numbers or self.numbers, marketplace)
+
+
+RULE_KEYS: Final = frozenset({'name', 'select', 'text', 'value', 'regex', 'type', 'many', 'parts', 'fields'})
+
+
+def _compile_regex(pattern: str, where: str) -> re.Pattern:
+    try:
+        return re.compile(pattern)
+    except re.error as e:
+        raise InvalidRules(f"{where}: invalid regex {pattern!r}: {e}") from e
+
+
+def _compile_rule(data: dict, name: str) -> Rule:
+    where = f"Rule {name}"
+    if not isinstance(data, dict):
+        raise InvalidRules(f"{where} is not an object")
+    unknown = data.keys() - RULE_KEYS
+    if unknown:
+        raise InvalidRules(f"{where}: unknown keys {', '.join(sorted(unknown))}")
+    value = data.get('value', 'text')
+    if value not in ('text', 'next_text') and not (value.startswith('@') and len(value) > 1):
+        raise InvalidRules(f"{where}: value must be text, next_text or @attribute, not {value!r}")
+    if data.get('type', 'str') not in TYPES:
+        raise InvalidRules(f"{where}: type must be one of {', '.join(TYPES)}")
+    if 'parts' in data and 'fields' in data:
+        raise InvalidRules(f"{where}: a rule has either parts or fields")
+    name = data.get('name', name)
+    parts = fields = None
+    if 'parts' in data:
+        parts = RuleSet({
+            f'{index}': (_compile_rule(part, f'{name}.{index}'),) for index, part in enumerate(data['parts'])
+        })
+    if 'fields' in data:
+        fields = RuleSet(_compile_chains(data['fields'], name))
+    return Rule(
+        name=name,
+        selectors=compile_selector(data['select']) if 'select' in data else None,
+        text=_compile_regex(data['text'], where) if 'text' in data else None,
+        value=value,
+        regex=_compile_regex(data['regex'], where) if 'regex' in data else None,
+        type=data.get('type', 'str'),
+        many=bool(data.get('many', False)),
+        parts=parts,
+        fields=fields,
+    )
+
+
+def _compile_chains(chains: dict, source: str) -> dict[str, tuple[Rule, ...]]:
+    if not isinstance(chains, dict):
+        raise InvalidRules(f"Fields of {source} are not an object")
+    return {
+        field_name: tuple(_compile_rule(rule, f'{source}:{field_name}#{index}') for index, rule in enumerate(chain))
+        for field_name, chain in chains.items()
+    }
+
+
+def rule_files() -> dict[str, Path]:
+    """Rule files by name, files of PARSER_EXTRACTION_RULES_DIRS replace built-in ones of the same name."""
+    files = {}
+    for directory in (RULES_DIR, *settings.PARSER_EXTRACTION_RULES_DIRS):
+        for path in sorted(Path(directory).glob('*.json')):
+            files[path.stem] = path
+    return files
+
+
+def load_rules(files: dict[str, Path] | None = None) -> dict[str, MarketplaceRules]:
+    """
+    Read and compile the rule files.
+
+    Raises:
+        InvalidRules: if a file can not be read or compiled
+    """
+    files = files if files is not None else rule_files()
+    data = {}
+    for name, path in files.items():
+        try:
+            data[name] = json.loads(path.read_text(encoding='utf-8'))
+        except (OSError, ValueError) as e:
+            raise InvalidRules(f"Can not read extraction rules {path}: {e}") from e
+    if DEFAULT_RULES not in data:
+        raise InvalidRules(f"No {DEFAULT_RULES}.json extraction rules")
+
+    # Rules of a file are compiled once, files extending it share them
+    own = {name: _compile_chains(content.get('fields', {}), name) for name, content in data.items()}
+    resolved: dict[str, tuple[dict[str, tuple[Rule, ...]], NumberFormat]] = {}
+
+    def resolve(name: str, seen: tuple[str, ...] = ()) -> tuple[dict[str, tuple[Rule, ...]], NumberFormat]:
+        if name in seen:
+            raise InvalidRules(f"Extraction rules extend each other: {' -> '.join((*seen, name))}")
+        if name not in data:
+            raise InvalidRules(f"Extraction rules {seen[-1]} extend unknown rules {name}")
+        if name not in resolved:
+            chains = dict(own[name])
+            numbers = NumberFormat(**data[name]['numbers']) if 'numbers' in data[name] else None
+            if base := data[name].get('extends'):
+                base_chains, base_numbers = resolve(base, (*seen, name))
+                for field_name, chain in base_chains.items():
+                    chains[field_name] = chains.get(field_name, ()) + chain
+                numbers = numbers or base_numbers
+            resolved[name] = (chains, numbers or NumberFormat())
+        return resolved[name]
+
+    rules = {}
+    for name in data:
+        chains, numbers = resolve(name)
+        rules[name] = MarketplaceRules(name=name, numbers=numbers, rules=RuleSet(chains))
+    logger.info(f"Compiled extraction rules of {len(rules)} marketplaces: {', '.join(sorted(rules))}")
+    return rules
+
+
+def _files_version(files: dict[str, Path]) -> str:
+    digest = hashlib.blake2b(digest_size=8)
+    for name, path in sorted(files.items()):
+        digest.update(name.encode() + b'\0' + path.read_bytes() + b'\0')
+    return digest.hexdigest()
+
+
+_rules: dict[str, MarketplaceRules] | None = None
+_rules_version = ''
+_rules_lock = threading.Lock()
+
+
+def get_rules() -> dict[str, MarketplaceRules]:
+    """Return the compiled rules of every marketplace, compiled on first use."""
+    global _rules, _rules_version
+    with _rules_lock:
+        if _rules is None:
+            files = rule_files()
+            _rules = load_rules(files)
+            _rules_version = _files_version(files)
+        return _rules
+
+
+def rules_version() -> str:
+    """Hash of the rule files in use, pages extracted with other rules may give other results."""
+    get_rules()
+    return _rules_version
+
+
+def rules_for(marketplace: str) -> MarketplaceRules:
+    """Rules of the marketplace, e.g. "de", the default ones for marketplaces without a rule file."""
+    rules = get_rules()
+    return rules.get(marketplace) or rules[DEFAULT_RULES]
+
+
+def number_format(marketplace: str, language: str = '') -> NumberFormat:
+    """Number format of a page in the language, e.g. "en" for <html lang="en-gb">, or of the marketplace without one."""
+    return rules_for(language or marketplace).numbers
+
+
+def extract_fields(root: Tag, marketplace: str, language: str = '') -> dict:
+    """Extract every field of a page tree with the rules of its marketplace and the number format of its language."""
+    return rules_for(marketplace).extract(root, marketplace, number_format(marketplace, language))
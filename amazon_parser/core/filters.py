@@ -49,7 +49,7 @@ class BookFilter(FilterSet):
             ('series__title', 'series'),
             ('rating', 'rating'),
             ('reviews_count', 'reviews_count'),
-            ('popular_reviews', 'popular_reviews'),
+            ('popular_reviews_count', 'popular_reviews'),
         ),
         field_labels={
             'created_at': 'Created Date',
@@ -62,8 +62,8 @@ class BookFilter(FilterSet):
             '-rating': 'Rating (High to Low)',
             'reviews_count': 'Reviews (Least to Most)',
             '-reviews_count': 'Reviews (Most to Least)',
-            'popular_reviews': 'Popular Reviews (Least to Most)',
-            '-popular_reviews': 'Popular Reviews (Most to Least)',
+            'popular_reviews_count': 'Popular Reviews (Least to Most)',
+            '-popular_reviews_count': 'Popular Reviews (Most to Least)',
         },
         widget=Select
     )
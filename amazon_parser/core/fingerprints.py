@@ -0,0 +1,47 @@
+"""
+Fingerprints of parse results and of the page regions they come from.
+
+Most books do not change between two parses. A book keeps the fingerprint
+of its stored result: a parse with the same fingerprint writes nothing but
+the parse bookkeeping, e.g. parsed_at, and adds no history points. It also
+keeps the fingerprint of the raw page regions the result was extracted
+from, together with the extraction rules in use: when those are the same
+again, the page is not even parsed.
+"""
+from dataclasses import asdict
+import hashlib
+import json
+
+from .extraction import rules_version
+from .marketplaces import marketplace_of
+from .utils import FetchedPage, ParsedResult
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def result_fingerprint(result: ParsedResult | dict) -> str:
+    """Fingerprint of a parse result, or of its asdict() form."""
+    values = asdict(result) if isinstance(result, ParsedResult) else result
+    return _digest(json.dumps(values, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode())
+
+
+def page_fingerprint(page: FetchedPage) -> str | None:
+    """
+    Fingerprint of the page regions the fields are extracted from.
+
+    Returns:
+        str: The fingerprint, None when the regions can not be cut out of the page
+    """
+    spans = page.region_spans
+    if spans is None:
+        return None
+    digest = hashlib.blake2b(digest_size=16)
+    # The same markup gives another result with other rules, or the number format of another marketplace or language
+    digest.update(f'{rules_version()}\0{marketplace_of(page.url)}\0{page.language}\0'.encode())
+    for region in page.regions:
+        span = spans[region]
+        digest.update(page.content[span[0]:span[1]] if span else b'')
+        digest.update(b'\0')
+    return digest.hexdigest()
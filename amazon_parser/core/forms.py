@@ -1,6 +1,6 @@
-import re
 from django import forms
-from .models import Book, BookSeries
+from .marketplaces import build_book_url
+from .models import Book, BookSeries, Language
 
 class BookForm(forms.ModelForm):
 
@@ -18,11 +18,7 @@ class BookForm(forms.ModelForm):
     def clean(self) -> str:
         book_id = self.cleaned_data.get('book_id')
         language = self.cleaned_data.get('language')
-        list_of_incorrect_langs = ["en", "no", "ru"]
-        if language in list_of_incorrect_langs:
-            language = 'com'
-        complete_url = f'https://www.amazon.{language}/dp/{book_id}?language=en_GB'
-        self.cleaned_data['url'] = complete_url
+        self.cleaned_data['url'] = build_book_url(book_id, language)
         return self.cleaned_data
 
     class Meta:
@@ -43,3 +39,38 @@ class BookForm(forms.ModelForm):
         if commit:
             instance.save()
         return instance
+
+
+class BookImportForm(forms.Form):
+    file = forms.FileField(
+        required=False,
+        widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '.csv,.tsv,.txt'}),
+    )
+    text = forms.CharField(
+        label='Or paste rows',
+        required=False,
+        widget=forms.Textarea(attrs={'class': 'form-control font-monospace', 'rows': 10}),
+    )
+    language = forms.ChoiceField(
+        label='Default language',
+        choices=[('', '---------'), *Language.choices],
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-select'}),
+    )
+    parse = forms.BooleanField(
+        label='Parse the new books',
+        required=False,
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'}),
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        upload = cleaned_data.get('file')
+        if upload:
+            try:
+                cleaned_data['text'] = upload.read().decode('utf-8-sig')
+            except UnicodeDecodeError:
+                self.add_error('file', 'The file must be UTF-8 encoded')
+        elif not cleaned_data.get('text'):
+            raise forms.ValidationError('Upload a file or paste rows')
+        return cleaned_data
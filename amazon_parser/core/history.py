@@ -0,0 +1,195 @@
+"""
+Time series of book ratings, reviews counts and best seller ranks.
+
+Every parse that changes a book's values adds raw points, the values of
+a point hold until the next one. rollup_history() averages raw
+points into hourly buckets and hourly ones into daily buckets once they
+pass their retention period, so the tables stay bounded.
+"""
+from datetime import datetime, timedelta
+import logging
+import re
+import threading
+from typing import Iterable
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Max, QuerySet
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from .cache import invalidate_books
+from .models import Book, BookMetricsHistory, BookRankHistory, RankCategory, Resolution
+
+logger = logging.getLogger(__name__)
+
+_category_ids: dict[str, int] = {}
+_category_lock = threading.Lock()
+
+
+def normalize_category(rank_name: str) -> str:
+    """Strip the parser's leftovers, e.g. "in Kindle Store (" -> "Kindle Store", "enRomans" -> "Romans"."""
+    name = re.sub(r'^(?:in|en)(?![a-z])\s*', '', rank_name.strip())
+    return name.rstrip(' (').strip()
+
+
+def _cache_category_ids(ids: dict[str, int]) -> None:
+    with _category_lock:
+        _category_ids.update(ids)
+
+
+def category_ids(names: Iterable[str]) -> dict[str, int]:
+    """
+    Return ids of the categories, creating missing ones with a single insert.
+
+    Ids of created categories are only cached once the transaction that
+    inserted them commits, after a rollback the rows would not exist.
+    """
+    names = set(names)
+    with _category_lock:
+        ids = {name: _category_ids[name] for name in names if name in _category_ids}
+    missing = names - ids.keys()
+    if missing:
+        RankCategory.objects.bulk_create([RankCategory(name=name) for name in missing], ignore_conflicts=True)
+        created = dict(RankCategory.objects.filter(name__in=missing).values_list('name', 'id'))
+        ids.update(created)
+        transaction.on_commit(lambda: _cache_category_ids(created))
+    return ids
+
+
+def _ranks(book: Book) -> list[tuple[str, int]]:
+    ranks = []
+    for rank in book.best_seller_ranks or []:
+        try:
+            ranks.append((normalize_category(rank['rank_name']), int(rank['place'])))
+        except (KeyError, TypeError, ValueError):
+            continue
+    return ranks
+
+
+def record_history(books: Iterable[Book]) -> None:
+    """Add raw history points with the current values of the parsed books."""
+    books = list(books)
+    book_ranks = {book.id: _ranks(book) for book in books}
+    ids = category_ids(name for ranks in book_ranks.values() for name, _ in ranks)
+    BookMetricsHistory.objects.bulk_create([
+        BookMetricsHistory(
+            book_id=book.id,
+            captured_at=book.parsed_at,
+            rating=book.rating,
+            reviews_count=book.reviews_count,
+        )
+        for book in books
+    ])
+    BookRankHistory.objects.bulk_create([
+        BookRankHistory(book_id=book.id, category_id=ids[name], captured_at=book.parsed_at, rank=place)
+        for book in books
+        for name, place in book_ranks[book.id]
+    ])
+    invalidate_books(book_ranks)
+
+
+def _rollup(source: str, target: str, trunc, cutoff: datetime) -> tuple[int, int]:
+    """Average source resolution points before the cutoff into target resolution buckets."""
+    metrics = BookMetricsHistory.objects.filter(resolution=source, captured_at__lt=cutoff)
+    ranks = BookRankHistory.objects.filter(resolution=source, captured_at__lt=cutoff)
+    with transaction.atomic():
+        metric_buckets = (
+            metrics.annotate(bucket=trunc('captured_at'))
+            .values('book_id', 'bucket')
+            .annotate(avg_rating=Avg('rating'), max_reviews_count=Max('reviews_count'))
+            .order_by()
+        )
+        BookMetricsHistory.objects.bulk_create(
+            (
+                BookMetricsHistory(
+                    book_id=row['book_id'],
+                    captured_at=row['bucket'],
+                    resolution=target,
+                    rating=round(row['avg_rating'], 2) if row['avg_rating'] is not None else None,
+                    reviews_count=row['max_reviews_count'],
+                )
+                for row in metric_buckets.iterator(chunk_size=2000)
+            ),
+            batch_size=1000,
+        )
+        rank_buckets = (
+            ranks.annotate(bucket=trunc('captured_at'))
+            .values('book_id', 'category_id', 'bucket')
+            .annotate(avg_rank=Avg('rank'))
+            .order_by()
+        )
+        BookRankHistory.objects.bulk_create(
+            (
+                BookRankHistory(
+                    book_id=row['book_id'],
+                    category_id=row['category_id'],
+                    captured_at=row['bucket'],
+                    resolution=target,
+                    rank=round(row['avg_rank']),
+                )
+                for row in rank_buckets.iterator(chunk_size=2000)
+            ),
+            batch_size=1000,
+        )
+        removed_metrics, _ = metrics.delete()
+        removed_ranks, _ = ranks.delete()
+    return removed_metrics, removed_ranks
+
+
+def rollup_history(now: datetime | None = None) -> None:
+    """Downsample raw points to hourly and hourly points to daily ones."""
+    now = now or timezone.now()
+    # Only complete buckets are rolled up, so no bucket is ever averaged twice
+    raw_cutoff = (now - settings.PARSER_HISTORY_RAW_RETENTION).replace(minute=0, second=0, microsecond=0)
+    hourly_cutoff = (now - settings.PARSER_HISTORY_HOURLY_RETENTION).replace(hour=0, minute=0, second=0, microsecond=0)
+    removed = _rollup(Resolution.RAW, Resolution.HOUR, TruncHour, raw_cutoff)
+    logger.info(f"Rolled up {removed[0]} raw metric points and {removed[1]} raw rank points into hourly ones")
+    removed = _rollup(Resolution.HOUR, Resolution.DAY, TruncDay, hourly_cutoff)
+    logger.info(f"Rolled up {removed[0]} hourly metric points and {removed[1]} hourly rank points into daily ones")
+    # The charts of every book may have changed
+    invalidate_books()
+
+
+def metrics_series(books: QuerySet, since: datetime) -> QuerySet:
+    """Rating and reviews count points of the books since the given time, oldest first."""
+    return (
+        BookMetricsHistory.objects.filter(book__in=books, captured_at__gte=since)
+        .order_by('book_id', 'captured_at')
+        .values_list('book_id', 'captured_at', 'rating', 'reviews_count')
+    )
+
+
+def rank_series(books: QuerySet, since: datetime) -> QuerySet:
+    """Best seller rank points of the books since the given time, oldest first."""
+    return (
+        BookRankHistory.objects.filter(book__in=books, captured_at__gte=since)
+        .order_by('book_id', 'captured_at')
+        .values_list('book_id', 'category__name', 'captured_at', 'rank')
+    )
+
+
+def book_chart_data(book: Book, days: int) -> dict:
+    """Return chart series of a single book over the last days."""
+    since = timezone.now() - timedelta(days=days)
+    books = Book.objects.filter(pk=book.pk)
+    metrics = [
+        {'t': captured_at, 'rating': rating, 'reviews_count': reviews_count}
+        for _, captured_at, rating, reviews_count in metrics_series(books, since)
+    ]
+    ranks: dict[str, list[dict]] = {}
+    for _, category, captured_at, rank in rank_series(books, since):
+        ranks.setdefault(category, []).append({'t': captured_at, 'rank': rank})
+
+    # Parses that find the same values add no points, the values of the last point hold until the latest parse
+    if book.parsed_at and book.parsed_at >= since:
+        if not metrics or metrics[-1]['t'] < book.parsed_at:
+            metrics.append({'t': book.parsed_at, 'rating': book.rating, 'reviews_count': book.reviews_count})
+        for category, place in _ranks(book):
+            points = ranks.setdefault(category, [])
+            if not points or points[-1]['t'] < book.parsed_at:
+                points.append({'t': book.parsed_at, 'rank': place})
+
+    for point in (*metrics, *(point for points in ranks.values() for point in points)):
+        point['t'] = point['t'].isoformat()
+    return {'metrics': metrics, 'ranks': ranks}
@@ -0,0 +1,188 @@
+"""
+HTML tree builders used by the page extractors.
+
+All extractors work on a BeautifulSoup tree, the backend only selects the
+underlying tree builder. lxml is several times faster than the pure python
+html.parser, so it is used whenever it is installed.
+
+build_partial_tree skips most of the work: it cuts the elements the
+extractors read out of the raw bytes and builds a tree of those only.
+"""
+from functools import lru_cache
+import logging
+import re
+from typing import Final, Iterable
+
+from bs4 import BeautifulSoup, FeatureNotFound
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+HTML_BACKENDS: Final[tuple[str, ...]] = ('lxml', 'html.parser', 'html5lib')
+FALLBACK_BACKEND: Final[str] = 'html.parser'
+
+_HEAD_END_RE: Final = re.compile(rb'</head\s*>', re.IGNORECASE)
+_CHARSET_RE: Final = re.compile(rb'<meta\b[^>]*?charset\s*=\s*["\']?([\w.:-]+)', re.IGNORECASE)
+_TITLE_RE: Final = re.compile(rb'<title\b[^>]*>.*?</title\s*>', re.IGNORECASE | re.DOTALL)
+_TAG_NAME_RE: Final = re.compile(rb'<([a-zA-Z][\w:-]*)')
+
+_unavailable_backends: set[str] = set()
+
+
+def get_backend(backend: str | None = None) -> str:
+    """Return the backend to use, PARSER_HTML_BACKEND by default."""
+    backend = backend or getattr(settings, 'PARSER_HTML_BACKEND', FALLBACK_BACKEND)
+    if backend not in HTML_BACKENDS:
+        raise ValueError(f"Unknown HTML backend {backend!r}, expected one of {HTML_BACKENDS}")
+    return backend
+
+
+def build_tree(content: bytes | str, encoding: str | None = None, backend: str | None = None, **kwargs) -> BeautifulSoup:
+    """
+    Build a tree from raw page content.
+
+    Args:
+        content: Raw response body, bytes are decoded by the tree builder itself
+        encoding: Charset declared by the response headers, if any
+        backend: Tree builder name, PARSER_HTML_BACKEND by default
+        kwargs: Extra BeautifulSoup arguments, e.g. parse_only
+    """
+    backend = get_backend(backend)
+    if backend in _unavailable_backends:
+        backend = FALLBACK_BACKEND
+    if isinstance(content, bytes) and encoding:
+        kwargs['from_encoding'] = encoding
+    try:
+        return BeautifulSoup(content, backend, **kwargs)
+    except FeatureNotFound:
+        logger.warning(f"HTML backend {backend} is not installed, falling back to {FALLBACK_BACKEND}")
+        _unavailable_backends.add(backend)
+        return BeautifulSoup(content, FALLBACK_BACKEND, **kwargs)
+
+
+@lru_cache(maxsize=32)
+def _id_attribute_re(element_id: str) -> re.Pattern:
+    return re.compile(rb'(?<![\w-])id\s*=\s*["\']?' + re.escape(element_id.encode()) + rb'(?=["\'\s/>])')
+
+
+def _find_id_attribute(content: bytes, element_id: str) -> re.Match | None:
+    # A pattern starting with a lookbehind is tried at every byte, the id itself is found much faster
+    pattern = _id_attribute_re(element_id)
+    needle = element_id.encode()
+    position = content.find(needle)
+    while position >= 0:
+        match = pattern.search(content, max(position - 32, 0), position + len(needle) + 1)
+        if match:
+            return match
+        position = content.find(needle, position + 1)
+    return None
+
+
+@lru_cache(maxsize=32)
+def _tag_tokens_re(tag: bytes) -> re.Pattern:
+    # Comments and scripts may contain markup, they are matched whole so their tags are not counted
+    return re.compile(
+        rb'<!--.*?-->|<script\b.*?</script\s*>|<(/?)' + re.escape(tag) + rb'(?=[\s/>])[^>]*>',
+        re.IGNORECASE | re.DOTALL,
+    )
+
+
+def element_span(content: bytes, element_id: str) -> tuple[int, int] | None:
+    """
+    Find the raw markup of the element with the id by matching its end tag.
+
+    Returns:
+        tuple: start and end offsets of the element, None if the page has no element with the id
+
+    Raises:
+        ValueError: The markup around the element is not balanced, the page has to be parsed whole
+    """
+    match = _find_id_attribute(content, element_id)
+    if not match:
+        return None
+    start = content.rfind(b'<', 0, match.start())
+    tag = _TAG_NAME_RE.match(content, start) if start >= 0 else None
+    start_tag_end = content.find(b'>', match.end())
+    if not tag or start_tag_end < 0:
+        raise ValueError(f"No start tag around id {element_id!r}")
+    if content[start_tag_end - 1:start_tag_end] == b'/':
+        return start, start_tag_end + 1
+
+    depth = 1
+    for token in _tag_tokens_re(tag.group(1).lower()).finditer(content, start_tag_end + 1):
+        closing = token.group(1)
+        if closing is None:
+            continue
+        if closing:
+            depth -= 1
+            if depth == 0:
+                return start, token.end()
+        elif not token.group(0).endswith(b'/>'):
+            depth += 1
+    raise ValueError(f"No end tag of the element with id {element_id!r}")
+
+
+def region_spans(content: bytes, element_ids: Iterable[str]) -> dict[str, tuple[int, int] | None]:
+    """
+    Offsets of the elements with the given ids, None for ids the page does not have.
+
+    Raises:
+        ValueError: The markup around an element is not balanced
+    """
+    return {element_id: element_span(content, element_id) for element_id in element_ids}
+
+
+def build_partial_tree(
+    content: bytes,
+    element_ids: Iterable[str],
+    required_id: str,
+    encoding: str | None = None,
+    backend: str | None = None,
+    spans: dict[str, tuple[int, int] | None] | None = None,
+) -> BeautifulSoup | None:
+    """
+    Build a tree of only the title and the elements with the given ids.
+
+    Elements keep their document order, and elements inside another one
+    are not repeated. The charset declared by the page is kept, so the
+    slices decode as the whole page would.
+
+    Args:
+        content: Raw response body
+        element_ids: Ids of the elements to keep
+        required_id: Id without which the page is not understood, e.g. a different layout
+        encoding: Charset declared by the response headers, if any
+        backend: Tree builder name, PARSER_HTML_BACKEND by default
+        spans: Offsets of the elements if already known, see region_spans
+
+    Returns:
+        BeautifulSoup: The tree, None when the page has to be parsed whole
+    """
+    if spans is None:
+        try:
+            spans = region_spans(content, element_ids)
+        except ValueError as e:
+            logger.debug(f"Parsing the whole page: {e}")
+            return None
+    if spans.get(required_id) is None:
+        return None
+
+    regions = []
+    for start, end in sorted(span for span in spans.values() if span):
+        if regions and start < regions[-1][1]:
+            continue
+        regions.append((start, end))
+
+    head_end = _HEAD_END_RE.search(content)
+    head_end = head_end.start() if head_end else min(len(content), 4096)
+    head = [b'<head>']
+    charset = _CHARSET_RE.search(content, 0, head_end)
+    if charset and not encoding:
+        head.append(b'<meta charset="' + charset.group(1) + b'">')
+    title = _TITLE_RE.search(content, 0, head_end)
+    if title:
+        head.append(title.group(0))
+    head.append(b'</head>')
+
+    document = b''.join([b'<html>', *head, b'<body>', *(content[start:end] for start, end in regions), b'</body></html>'])
+    return build_tree(document, encoding, backend)
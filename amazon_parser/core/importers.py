@@ -0,0 +1,184 @@
+"""
+Bulk import of books from CSV/TSV files or pasted text.
+
+Rows are validated and their urls built like BookForm does. Series are
+resolved with one query per import and existing urls are looked up once
+per batch, so thousands of rows cost a few dozen queries instead of
+several per book.
+"""
+import csv
+from dataclasses import dataclass, field
+import io
+import logging
+import re
+from typing import Final, Iterable, Iterator
+
+from django.conf import settings
+from django.db import transaction
+
+from .cache import invalidate_books
+from .jobs import enqueue_books
+from .marketplaces import build_book_url, extract_asin
+from .models import Book, BookSeries, CrawlJob, JobKind, Language
+
+logger = logging.getLogger(__name__)
+
+ASIN_FULL_RE: Final = re.compile(r'[A-Z0-9]{10}')
+# Accepted header names of every column
+COLUMNS: Final[dict[str, tuple[str, ...]]] = {
+    'book_id': ('book_id', 'asin', 'id', 'url'),
+    'name': ('name', 'title'),
+    'language': ('language', 'lang'),
+    'series_title': ('series_title', 'series'),
+}
+
+
+class InvalidImport(ValueError):
+    """A row, or the header line of the whole import, is invalid."""
+
+
+@dataclass
+class ImportRow:
+    line: int
+    name: str
+    url: str
+    language: str
+    series_title: str = ''
+
+
+@dataclass
+class ImportResult:
+    created: list[int] = field(default_factory=list)
+    # Rows whose url is already stored or repeats an earlier row of the import
+    duplicates: int = 0
+    errors: list[tuple[int, str]] = field(default_factory=list)
+    job: CrawlJob | None = None
+
+
+def read_rows(text: str) -> Iterator[tuple[int, dict[str, str]]]:
+    """
+    Read rows of a CSV or TSV text with a header line, the delimiter is detected.
+
+    Yields:
+        tuple: line number and row by column name
+    """
+    lines = text.lstrip('\ufeff').splitlines()
+    if not lines:
+        return
+    try:
+        dialect = csv.Sniffer().sniff(lines[0], delimiters=',\t;')
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(io.StringIO('\n'.join(lines)), dialect)
+    header = next(reader)
+    names = {}
+    for index, column in enumerate(header):
+        column = column.strip().lower()
+        for name, aliases in COLUMNS.items():
+            if column in aliases:
+                names.setdefault(name, index)
+    if 'book_id' not in names:
+        raise InvalidImport(f"The header line has no book id column, expected one of: {', '.join(COLUMNS['book_id'])}")
+    for line, values in enumerate(reader, start=2):
+        if not any(value.strip() for value in values):
+            continue
+        yield line, {name: values[index].strip() if index < len(values) else '' for name, index in names.items()}
+
+
+def validate_row(line: int, row: dict[str, str], default_language: str | None = None) -> ImportRow:
+    """
+    Validate a row and build its product page url.
+
+    Raises:
+        InvalidImport: if the row is invalid
+    """
+    book_id = row.get('book_id', '')
+    # Product page urls are accepted too, the url is built again for the row's language
+    book_id = (extract_asin(book_id) or '') if '/' in book_id else book_id.upper()
+    if not ASIN_FULL_RE.fullmatch(book_id):
+        raise InvalidImport(f"Invalid ASIN {row.get('book_id')!r}")
+    language = row.get('language', '').lower() or default_language
+    if language not in Language.values:
+        raise InvalidImport(f"Invalid language {row.get('language')!r}" if language else "No language")
+    name = row.get('name', '')
+    if not name:
+        raise InvalidImport("No name")
+    if len(name) > Book._meta.get_field('name').max_length:
+        raise InvalidImport("Name too long")
+    return ImportRow(
+        line=line,
+        name=name,
+        url=build_book_url(book_id, language),
+        language=language,
+        series_title=row.get('series_title', '')[:BookSeries._meta.get_field('title').max_length],
+    )
+
+
+def _resolve_series(titles: set[str]) -> dict[str, int]:
+    """Return series ids by title, missing series are created. The oldest one wins for a repeated title."""
+    if not titles:
+        return {}
+    ids = {}
+    for title, series_id in BookSeries.objects.filter(title__in=titles).order_by('-id').values_list('title', 'id'):
+        ids[title] = series_id
+    missing = [BookSeries(title=title) for title in titles if title not in ids]
+    for series in BookSeries.objects.bulk_create(missing):
+        ids[series.title] = series.id
+    return ids
+
+
+def import_books(rows: Iterable[tuple[int, dict[str, str]]], default_language: str | None = None,
+                 enqueue: bool = False, batch_size: int | None = None) -> ImportResult:
+    """
+    Validate the rows and insert the books that are not stored yet.
+
+    Args:
+        rows: Line numbers and rows as read by read_rows
+        default_language: Language of rows without one
+        enqueue: Queue a parse of the new books for the crawl workers
+        batch_size: Books inserted per query, PARSER_IMPORT_BATCH_SIZE by default
+
+    Returns:
+        ImportResult: ids of the new books, duplicates, row errors and the parse job
+    """
+    batch_size = batch_size or settings.PARSER_IMPORT_BATCH_SIZE
+    result = ImportResult()
+    valid: dict[str, ImportRow] = {}
+    for line, row in rows:
+        try:
+            book = validate_row(line, row, default_language)
+        except InvalidImport as e:
+            result.errors.append((line, str(e)))
+            continue
+        if book.url in valid:
+            result.duplicates += 1
+        else:
+            valid[book.url] = book
+
+    books = list(valid.values())
+    with transaction.atomic():
+        series_ids = _resolve_series({book.series_title for book in books if book.series_title})
+        for start in range(0, len(books), batch_size):
+            batch = books[start:start + batch_size]
+            existing = set(Book.objects.filter(url__in=[book.url for book in batch]).values_list('url', flat=True))
+            result.duplicates += len(existing)
+            created = Book.objects.bulk_create(
+                Book(
+                    name=book.name,
+                    url=book.url,
+                    language=book.language,
+                    series_id=series_ids.get(book.series_title),
+                )
+                for book in batch
+                if book.url not in existing
+            )
+            result.created.extend(book.id for book in created)
+        # New books have no cached pages of their own, only the book list changes
+        invalidate_books([])
+
+    if enqueue and result.created:
+        result.job = enqueue_books(result.created, kind=JobKind.IMPORT)
+    logger.info(
+        f"Imported {len(result.created)} books, {result.duplicates} duplicates, {len(result.errors)} invalid rows"
+    )
+    return result
@@ -0,0 +1,177 @@
+"""
+Database-backed crawl job queue.
+
+Jobs group per-book tasks. Workers claim queued tasks atomically with a
+conditional UPDATE, so several worker processes can share the queue. A
+worker renews the lease of the tasks it holds, a claimed task whose worker
+died is requeued once its lease expires, so a crash mid-crawl resumes
+instead of starting over. Results are only written while the claim that
+took the task still holds it.
+"""
+from dataclasses import dataclass
+from datetime import timedelta
+import logging
+import os
+import socket
+from typing import Iterable
+import uuid
+
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from .models import CrawlJob, CrawlTask, JobKind, TaskStatus
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = (TaskStatus.QUEUED, TaskStatus.RUNNING)
+
+
+@dataclass
+class JobProgress:
+    job: CrawlJob
+    queued: int
+    running: int
+    done: int
+    failed: int
+
+    @property
+    def total(self) -> int:
+        return self.queued + self.running + self.done + self.failed
+
+    @property
+    def finished(self) -> int:
+        return self.done + self.failed
+
+    @property
+    def percent(self) -> float:
+        return self.finished / self.total * 100 if self.total else 100.0
+
+    @property
+    def eta(self) -> timedelta | None:
+        """Estimated time left, from the job's throughput so far."""
+        if not self.job.started_at or not self.finished:
+            return None
+        elapsed = timezone.now() - self.job.started_at
+        return elapsed / self.finished * (self.queued + self.running)
+
+
+def worker_id() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def enqueue_books(book_ids: Iterable[int], kind: str = JobKind.ALL_BOOKS, priority: int = 0,
+                  job: CrawlJob | None = None, batch_size: int = 1000) -> CrawlJob:
+    """
+    Add parse tasks for the books to a new or an existing job.
+
+    Tasks are inserted with bulk_create in batches, book ids may be a lazy iterator.
+    """
+    if job is None:
+        job = CrawlJob.objects.create(kind=kind)
+    added = 0
+    batch = []
+    for book_id in book_ids:
+        batch.append(CrawlTask(job=job, book_id=book_id, priority=priority))
+        if len(batch) >= batch_size:
+            CrawlTask.objects.bulk_create(batch)
+            added += len(batch)
+            batch = []
+    if batch:
+        CrawlTask.objects.bulk_create(batch)
+        added += len(batch)
+    # Reopen the job in case a worker already finished it, e.g. for the scheduler's job
+    CrawlJob.objects.filter(pk=job.pk).update(
+        total=F('total') + added,
+        status=TaskStatus.RUNNING if job.started_at else TaskStatus.QUEUED,
+        finished_at=None,
+    )
+    job.refresh_from_db()
+    if not job.total:
+        job.status = TaskStatus.DONE
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'finished_at'])
+    return job
+
+
+def claim_tasks(worker: str, limit: int) -> list[CrawlTask]:
+    """Atomically claim up to limit queued tasks that are due, highest priority first."""
+    now = timezone.now()
+    candidate_ids = list(
+        CrawlTask.objects
+        .filter(status=TaskStatus.QUEUED, available_at__lte=now)
+        .order_by('-priority', 'available_at', 'id')
+        .values_list('id', flat=True)[:limit]
+    )
+    if not candidate_ids:
+        return []
+    # Only rows still queued are taken, a concurrent worker that won the race keeps its tasks
+    token = f'{worker}:{uuid.uuid4().hex[:8]}'
+    CrawlTask.objects.filter(id__in=candidate_ids, status=TaskStatus.QUEUED).update(
+        status=TaskStatus.RUNNING,
+        claimed_by=token,
+        claimed_at=now,
+        attempts=F('attempts') + 1,
+    )
+    tasks = list(CrawlTask.objects.filter(claimed_by=token, status=TaskStatus.RUNNING).select_related('book'))
+    CrawlJob.objects.filter(
+        id__in={task.job_id for task in tasks}, started_at__isnull=True,
+    ).update(started_at=now, status=TaskStatus.RUNNING)
+    return tasks
+
+
+def complete_task(task: CrawlTask, success: bool, error: str = '') -> bool:
+    """
+    Mark the task done or failed.
+
+    Returns:
+        bool: False when the claim of the task was lost, its lease expired and it was requeued
+    """
+    return bool(CrawlTask.objects.filter(pk=task.pk, claimed_by=task.claimed_by, status=TaskStatus.RUNNING).update(
+        status=TaskStatus.DONE if success else TaskStatus.FAILED,
+        finished_at=timezone.now(),
+        error=error,
+    ))
+
+
+def renew_leases(claims: Iterable[str]) -> int:
+    """Restart the lease of the running tasks of the claims, e.g. of tasks still fetched or waiting to be written."""
+    claims = set(claims)
+    if not claims:
+        return 0
+    return CrawlTask.objects.filter(claimed_by__in=claims, status=TaskStatus.RUNNING).update(claimed_at=timezone.now())
+
+
+def requeue_stale_tasks(lease: timedelta) -> int:
+    """Requeue running tasks whose worker has not finished or renewed them within the lease."""
+    requeued = CrawlTask.objects.filter(
+        status=TaskStatus.RUNNING, claimed_at__lt=timezone.now() - lease,
+    ).update(status=TaskStatus.QUEUED, claimed_by='', claimed_at=None)
+    if requeued:
+        logger.warning(f"Requeued {requeued} tasks with an expired lease")
+    return requeued
+
+
+def finish_jobs() -> None:
+    """Mark started jobs without queued or running tasks as done."""
+    for job in CrawlJob.objects.filter(status=TaskStatus.RUNNING):
+        if not job.tasks.filter(status__in=ACTIVE_STATUSES).exists():
+            job.status = TaskStatus.DONE
+            job.finished_at = timezone.now()
+            job.save(update_fields=['status', 'finished_at'])
+            logger.info(f"{job} finished")
+
+
+def job_progress(job: CrawlJob) -> JobProgress:
+    """Count the job's tasks per status in a single query."""
+    counts = job.tasks.aggregate(
+        queued=Count('id', filter=Q(status=TaskStatus.QUEUED)),
+        running=Count('id', filter=Q(status=TaskStatus.RUNNING)),
+        done=Count('id', filter=Q(status=TaskStatus.DONE)),
+        failed=Count('id', filter=Q(status=TaskStatus.FAILED)),
+    )
+    return JobProgress(job=job, **counts)
+
+
+def active_job(kind: str = JobKind.ALL_BOOKS) -> CrawlJob | None:
+    """Return the latest unfinished job of the kind."""
+    return CrawlJob.objects.filter(kind=kind, status__in=ACTIVE_STATUSES).order_by('-created_at').first()
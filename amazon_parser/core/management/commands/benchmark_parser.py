@@ -0,0 +1,76 @@
+import json
+import logging
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmarks import available_backends, find_regressions, run_benchmark, update_manifest
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the page parser over the checked-in corpus: pages/sec, tree build and extraction "
+        "times and peak memory per HTML backend. Baselines only compare on the same machine."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--backend', action='append', default=[], choices=available_backends(),
+            help='Backend to benchmark, repeatable, every installed one by default',
+        )
+        parser.add_argument(
+            '--full-parse', action='store_true', help='Build whole page trees instead of the partial parsing fast path',
+        )
+        parser.add_argument('--rounds', type=int, default=5, help='Passes over the corpus per measurement')
+        parser.add_argument('--json', help="Write the results as JSON to this file, '-' for stdout")
+        parser.add_argument('--baseline', help='JSON results of an earlier run to compare with')
+        parser.add_argument(
+            '--threshold', type=float, default=0.15,
+            help='Allowed throughput drop and memory growth against the baseline, as a fraction',
+        )
+        parser.add_argument(
+            '--update-manifest', action='store_true',
+            help='Record the current extraction results as the expected ones and exit',
+        )
+
+    def handle(self, *args, **options):
+        # Log records would be part of the measurement
+        logging.getLogger('core').setLevel(logging.CRITICAL)
+
+        if options['update_manifest']:
+            manifest = update_manifest()
+            self.stdout.write(self.style.SUCCESS(f"Recorded expected results of {len(manifest)} pages"))
+            return
+
+        results = run_benchmark(
+            backends=options['backend'] or None, rounds=options['rounds'], partial=not options['full_parse'],
+        )
+
+        if options['json'] == '-':
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self._print(results)
+            if options['json']:
+                Path(options['json']).write_text(json.dumps(results, indent=2) + '\n')
+
+        problems = [
+            f"{backend}: extraction differs from the manifest for {', '.join(row['mismatches'])}"
+            for backend, row in results['backends'].items() if row['mismatches']
+        ]
+        if options['baseline']:
+            baseline = json.loads(Path(options['baseline']).read_text())
+            problems += find_regressions(results, baseline, options['threshold'])
+        if problems:
+            raise CommandError("Benchmark failed:\n" + "\n".join(problems))
+
+    def _print(self, results: dict) -> None:
+        corpus = results['corpus']
+        self.stdout.write(
+            f"{corpus['pages']} pages ({corpus['bytes'] / 1024:.0f} KiB), {results['rounds']} rounds, "
+            f"{'partial' if results['partial_parsing'] else 'whole page'} trees, python {results['python']}"
+        )
+        for backend, row in results['backends'].items():
+            self.stdout.write(
+                f"{backend:<12} {row['pages_per_sec']:>8.1f} pages/sec  parse {row['parse_ms']:.2f} ms  "
+                f"tree {row['build_ms']:.2f} ms  extract {row['extract_ms']:.2f} ms  peak {row['peak_memory_kib']} KiB"
+            )
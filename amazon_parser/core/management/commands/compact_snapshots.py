@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.snapshots import SnapshotStore
+
+
+class Command(BaseCommand):
+    help = "Apply the snapshot retention policy and remove unreferenced page blobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep-last', type=int, default=settings.PARSER_SNAPSHOT_KEEP_LAST,
+            help='Number of newest snapshots always kept per ASIN',
+        )
+        parser.add_argument(
+            '--max-age-days', type=int, default=settings.PARSER_SNAPSHOT_MAX_AGE_DAYS,
+            help='Age after which snapshots beyond --keep-last are removed',
+        )
+
+    def handle(self, *args, **options):
+        removed_rows, removed_blobs = SnapshotStore().compact(
+            keep_last=options['keep_last'],
+            max_age_days=options['max_age_days'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Removed {removed_rows} snapshot entries and {removed_blobs} blobs"
+        ))
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.crawler import crawl_books
+from core.models import Book
+
+
+class Command(BaseCommand):
+    help = "Parse all books concurrently with per-marketplace rate limits"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=settings.PARSER_CRAWL_WORKERS,
+            help='Number of crawler threads',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=settings.PARSER_CRAWL_CHUNK_SIZE,
+            help='Number of book ids read from the database at once',
+        )
+        parser.add_argument(
+            '--language', action='append', default=[],
+            help='Only crawl books of the given language, can be repeated',
+        )
+
+    def handle(self, *args, **options):
+        books = Book.objects.order_by('id')
+        if options['language']:
+            books = books.filter(language__in=options['language'])
+        stats = crawl_books(books, workers=options['workers'], chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Crawl finished: {stats}"))
@@ -0,0 +1,50 @@
+from itertools import islice
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.models import Book
+from core.pagination import keyset_batches
+from core.reviews import books_due_for_review_crawl, crawl_book_reviews
+from core.utils import AmazonKDPParser, FetchError
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Crawl the full review listing of books, newest first, stopping at the reviews stored by the "
+        "previous crawl. Without --book only books not crawled within PARSER_REVIEW_REFRESH_INTERVAL are read."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--book', type=int, action='append', default=[], help='Only crawl the given book ids')
+        parser.add_argument(
+            '--max-pages', type=int, default=settings.PARSER_REVIEW_MAX_PAGES,
+            help='Listing pages read per book at most',
+        )
+        parser.add_argument('--limit', type=int, help='Crawl at most this many books')
+
+    def handle(self, *args, **options):
+        books = Book.objects.filter(id__in=options['book']).order_by('id') if options['book'] else books_due_for_review_crawl()
+        # A run takes hours, so only ids are read ahead, in keyset batches, and every book is loaded when
+        # its turn comes; no read statement stays open while the reviews are written
+        book_ids = (book.id for batch in keyset_batches(books.only('id'), 500) for book in batch)
+
+        parser = AmazonKDPParser(snapshot_store=False)
+        crawled, failed, new_reviews = 0, 0, 0
+        for book_id in islice(book_ids, options['limit']):
+            book = Book.objects.filter(id=book_id).first()
+            if book is None:
+                continue
+            try:
+                new_reviews += crawl_book_reviews(book, parser, max_pages=options['max_pages'])
+                crawled += 1
+            except FetchError as e:
+                # The book stays due, the next run reads it again
+                logger.warning(f"Crawling reviews of book {book.id} failed: {e}")
+                failed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f"Crawled reviews of {crawled} books, {new_reviews} new reviews, {failed} failed"
+        ))
@@ -0,0 +1,52 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.http import QueryDict
+
+from core.exports import DATASETS, FORMATS, available_formats, export
+from core.filters import BookFilter
+from core.models import Book
+
+
+class Command(BaseCommand):
+    help = (
+        "Export books, or their rank or metrics history, as CSV, JSON lines or Parquet (needs pyarrow). "
+        "Books are selected with the filter parameters of the book list, e.g. --filter language=de."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dataset', choices=list(DATASETS), default='books', help='Rows to export')
+        parser.add_argument('--format', choices=list(FORMATS), default='csv', dest='export_format', help='File format')
+        parser.add_argument('--output', '-o', default='-', help="File to write, '-' for stdout")
+        parser.add_argument(
+            '--filter', action='append', default=[], metavar='NAME=VALUE',
+            help='Book list filter, e.g. series=3, search=dragon or order=-rating, may be repeated',
+        )
+
+    def handle(self, *args, **options):
+        if options['export_format'] not in available_formats():
+            raise CommandError("Parquet exports need pyarrow, install the parquet extra")
+        params = QueryDict(mutable=True)
+        for item in options['filter']:
+            name, sep, value = item.partition('=')
+            if not sep:
+                raise CommandError(f"Invalid filter {item!r}, expected NAME=VALUE")
+            params.appendlist(name, value)
+        book_filter = BookFilter(params, queryset=Book.objects.select_related('series'))
+        if not book_filter.is_valid():
+            raise CommandError(f"Invalid filter: {book_filter.errors.as_text()}")
+        books = book_filter.qs
+        books = books.order_by(*books.query.order_by, 'id')
+
+        blocks = export(options['dataset'], options['export_format'], books)
+        if options['output'] == '-':
+            for block in blocks:
+                sys.stdout.buffer.write(block)
+            sys.stdout.buffer.flush()
+            return
+        size = 0
+        with open(options['output'], 'wb') as file:
+            for block in blocks:
+                file.write(block)
+                size += len(block)
+        self.stderr.write(self.style.SUCCESS(f"Wrote {size} bytes to {options['output']}"))
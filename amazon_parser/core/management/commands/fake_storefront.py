@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from core.storefront import FakeStorefront, add_storefront_arguments, storefront_config
+
+
+class Command(BaseCommand):
+    help = "Serve the benchmark corpus as a local stand-in for Amazon product pages at /dp/<ASIN>"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+        parser.add_argument('--port', type=int, default=8900, help='Port to listen on')
+        add_storefront_arguments(parser)
+
+    def handle(self, *args, **options):
+        storefront = FakeStorefront(options['host'], options['port'], storefront_config(options))
+        self.stdout.write(f"Serving product pages at {storefront.base_url}/dp/<ASIN>, press Ctrl+C to stop")
+        try:
+            storefront.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            storefront.server.server_close()
+        self.stdout.write(f"Served: {storefront.stats.as_dict()}")
@@ -0,0 +1,47 @@
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.importers import InvalidImport, import_books, read_rows
+from core.models import Language
+
+
+class Command(BaseCommand):
+    help = (
+        "Import books from a CSV or TSV file with a header line: asin (or a product page url), name, "
+        "and optionally language and series. Books whose url is already stored are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, '-' for stdin")
+        parser.add_argument('--language', choices=Language.values, help='Language of rows without one')
+        parser.add_argument('--parse', action='store_true', help='Queue a parse of the new books for the crawl workers')
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.PARSER_IMPORT_BATCH_SIZE,
+            help='Books inserted per query',
+        )
+
+    def handle(self, *args, **options):
+        if options['path'] == '-':
+            text = sys.stdin.read()
+        else:
+            with open(options['path'], encoding='utf-8-sig') as file:
+                text = file.read()
+        try:
+            result = import_books(
+                read_rows(text),
+                default_language=options['language'],
+                enqueue=options['parse'],
+                batch_size=options['batch_size'],
+            )
+        except InvalidImport as e:
+            raise CommandError(str(e))
+
+        for line, error in result.errors:
+            self.stderr.write(f"Line {line}: {error}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {len(result.created)} books, {result.duplicates} already stored or repeated, "
+            f"{len(result.errors)} invalid rows"
+            + (f", parsing queued as {result.job}" if result.job else "")
+        ))
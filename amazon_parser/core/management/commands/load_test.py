@@ -0,0 +1,138 @@
+from datetime import timedelta
+import json
+import logging
+from pathlib import Path
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Count, Q, Sum
+from django.test.utils import override_settings
+
+from core.crawler import run_async_worker, run_worker
+from core.marketplaces import url_host
+from core.models import Book, CrawlTask, Language, TaskStatus
+from core.storefront import FakeStorefront, add_storefront_arguments, storefront_config
+from core.tasks import parse_all_books
+from core.utils import get_proxy_manager
+
+
+class Command(BaseCommand):
+    help = (
+        "Crawl a local fake storefront end to end through the parse_all_books job queue, in a temporary "
+        "database, and report throughput, latency percentiles, retries and database write time"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=500, help='Number of books to crawl')
+        parser.add_argument('--workers', type=int, default=8, help='Crawler threads of a thread worker')
+        parser.add_argument('--async', action='store_true', dest='use_async', help='Use the asyncio worker')
+        parser.add_argument('--concurrency', type=int, default=200, help='Books in flight of the asyncio worker')
+        parser.add_argument('--host-concurrency', type=int, default=50, help='Concurrent requests to the storefront')
+        parser.add_argument('--host-interval', type=float, default=0.0, help='Min seconds between request starts')
+        parser.add_argument('--retry-base', type=float, default=1.0, help='Seconds of the first retry backoff step')
+        parser.add_argument('--snapshots', action='store_true', help='Archive fetched pages like production does')
+        parser.add_argument('--url', help='Crawl a storefront that is already running at this base url')
+        parser.add_argument('--json', help="Write the report as JSON to this file, '-' for stdout")
+        add_storefront_arguments(parser)
+
+    def handle(self, *args, **options):
+        logging.getLogger('core').setLevel(logging.WARNING)
+        # Corpus pages without ranks or reviews would log an extractor error for every fetch
+        logging.getLogger('core.utils').setLevel(logging.CRITICAL)
+        storefront = None
+        if options['url']:
+            base_url = options['url'].rstrip('/')
+        else:
+            storefront = FakeStorefront(config=storefront_config(options)).start()
+            base_url = storefront.base_url
+
+        # No request may leave the machine: proxies are off and the storefront gets its own limits
+        overrides = {
+            'PARSER_PROXIES': [],
+            'PARSER_SNAPSHOTS_ENABLED': options['snapshots'],
+            'PARSER_HOST_RATE_LIMITS': {
+                url_host(base_url): {'concurrency': options['host_concurrency'], 'interval': options['host_interval']},
+            },
+            'PARSER_FETCH_RETRY_BASE': timedelta(seconds=options['retry_base']),
+            'PARSER_FETCH_RETRY_MAX': timedelta(seconds=options['retry_base'] * 16),
+            'PARSER_WORKER_POLL_INTERVAL': 0.2,
+            # Sessions of a throwaway storefront are not worth keeping, nor warming up
+            'PARSER_SESSION_DIR': None,
+            'PARSER_SESSION_WARM_UP': False,
+        }
+        try:
+            with override_settings(**overrides), tempfile.TemporaryDirectory() as tmp:
+                if get_proxy_manager().health:
+                    raise CommandError("The proxy manager was created with proxies, refusing to send load through them")
+                report = self._run(base_url, Path(tmp) / 'load_test.sqlite3', options)
+        finally:
+            if storefront:
+                storefront.stop()
+        if storefront:
+            report['storefront'] = storefront.stats.as_dict()
+
+        if options['json'] == '-':
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self._print(report)
+        if options['json']:
+            Path(options['json']).write_text(json.dumps(report, indent=2) + '\n')
+
+    def _run(self, base_url: str, db_path: Path, options: dict) -> dict:
+        connection = connections['default']
+        original_name = connection.settings_dict['NAME']
+        connection.settings_dict['TEST']['NAME'] = str(db_path)
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            Book.objects.bulk_create(
+                Book(name=f'Load test book {i}', url=f'{base_url}/dp/B{i:09d}', language=Language.ENGLISH)
+                for i in range(options['books'])
+            )
+            job, _ = parse_all_books()
+            started_at = time.monotonic()
+            if options['use_async']:
+                stats = run_async_worker(concurrency=options['concurrency'], exit_when_idle=True)
+            else:
+                stats = run_worker(workers=options['workers'], exit_when_idle=True)
+            elapsed = time.monotonic() - started_at
+
+            tasks = CrawlTask.objects.filter(job=job).aggregate(
+                done=Count('id', filter=Q(status=TaskStatus.DONE)),
+                failed=Count('id', filter=Q(status=TaskStatus.FAILED)),
+                attempts=Sum('attempts'),
+            )
+        finally:
+            connection.creation.destroy_test_db(original_name, verbosity=0)
+
+        return {
+            'books': options['books'],
+            'worker': f"async, {options['concurrency']} in flight" if options['use_async'] else f"{options['workers']} threads",
+            'elapsed': round(elapsed, 2),
+            'books_per_minute': round(tasks['done'] / elapsed * 60, 1),
+            'done': tasks['done'],
+            'failed': tasks['failed'],
+            'attempts': tasks['attempts'] or 0,
+            'retries': (tasks['attempts'] or 0) - tasks['done'] - tasks['failed'],
+            'latency': {
+                f'p{percent}': round(stats.latency_percentile(percent) or 0, 3) for percent in (50, 90, 99)
+            },
+            'db_write_time': round(stats.write_time, 3),
+            'db_writes': stats.writes,
+        }
+
+    def _print(self, report: dict) -> None:
+        self.stdout.write(
+            f"{report['done']}/{report['books']} books in {report['elapsed']}s with {report['worker']}: "
+            f"{report['books_per_minute']} books/min, {report['failed']} failed, {report['retries']} retries"
+        )
+        latency = report['latency']
+        self.stdout.write(f"Book latency: p50 {latency['p50']}s, p90 {latency['p90']}s, p99 {latency['p99']}s")
+        writes = report['db_writes']
+        self.stdout.write(
+            f"Database writes: {writes} batches in {report['db_write_time']}s"
+            + (f", {report['db_write_time'] / writes * 1000:.1f} ms per batch" if writes else "")
+        )
+        if 'storefront' in report:
+            self.stdout.write(f"Storefront: {report['storefront']}")
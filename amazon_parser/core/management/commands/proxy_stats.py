@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from core.utils import AmazonKDPParser, FetchError, get_proxy_manager
+
+
+class Command(BaseCommand):
+    help = "Probe every proxy with a test request and print per-proxy health statistics"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='https://www.amazon.com/', help='Url requested through every proxy')
+        parser.add_argument('--rounds', type=int, default=1, help='Number of requests per proxy')
+
+    def handle(self, *args, **options):
+        manager = get_proxy_manager()
+        parser = AmazonKDPParser(snapshot_store=False)
+        for _ in range(options['rounds']):
+            for health in manager.health:
+                try:
+                    parser.fetch_page(options['url'], max_retries=1, proxy=health)
+                except FetchError:
+                    pass
+
+        self.stdout.write(f"{'proxy':<24} {'state':<10} {'requests':>8} {'errors':>7} {'captchas':>8} {'latency':>8} {'weight':>7}")
+        for row in manager.stats():
+            self.stdout.write(
+                f"{row['proxy']:<24} {row['state']:<10} {row['requests']:>8} {row['errors']:>7} "
+                f"{row['captchas']:>8} {row['latency'] or '-':>8} {row['weight']:>7}"
+            )
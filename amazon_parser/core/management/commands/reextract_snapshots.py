@@ -0,0 +1,140 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict
+import logging
+import os
+import time
+
+from django import db
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.cache import invalidate_books
+from core.fingerprints import result_fingerprint
+from core.models import Book, PageSnapshot, Status
+from core.snapshots import SnapshotStore
+
+logger = logging.getLogger(__name__)
+
+EXTRACTED_FIELDS = {
+    'rating': 'rating',
+    'reviews_count': 'reviews_count',
+    'best_sellers_ranks': 'best_seller_ranks',
+    'reviews': 'popular_reviews',
+}
+
+_parser = None
+_store = None
+
+
+def _init_worker():
+    """Set up django and a network-free parser once per worker process."""
+    global _parser, _store
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+    from core.utils import AmazonKDPParser
+    logging.getLogger('core.utils').setLevel(logging.WARNING)
+    _parser = AmazonKDPParser()
+    _store = SnapshotStore()
+
+
+def _extract(item: tuple[int, str, str]) -> tuple[int, dict | None]:
+    """Run the page extractors over an archived page, with the extraction rules of the book's marketplace."""
+    from core.utils import FetchedPage
+    book_id, content_hash, url = item
+    try:
+        page = FetchedPage(url=url, content=_store.read(content_hash))
+        return book_id, asdict(_parser.parse_page(page))
+    except Exception as e:
+        logger.warning(f"Failed to re-extract snapshot {content_hash} of book {book_id}: {e}")
+        return book_id, None
+
+
+def _latest_snapshots(books, chunk_size: int = 1000):
+    """Yield (book id, content hash, book url) of the newest snapshot of every book."""
+    book_ids = books.values_list('id', flat=True).iterator(chunk_size=chunk_size)
+    chunk = []
+    for book_id in book_ids:
+        chunk.append(book_id)
+        if len(chunk) == chunk_size:
+            yield from _latest_snapshots_of(chunk)
+            chunk = []
+    if chunk:
+        yield from _latest_snapshots_of(chunk)
+
+
+def _latest_snapshots_of(book_ids: list[int]):
+    seen = set()
+    rows = PageSnapshot.objects.filter(book_id__in=book_ids).order_by('book_id', '-fetched_at')
+    for book_id, content_hash, url in rows.values_list('book_id', 'content_hash', 'book__url'):
+        if book_id not in seen:
+            seen.add(book_id)
+            yield book_id, content_hash, url
+
+
+class Command(BaseCommand):
+    help = "Re-run the page extractors over archived snapshots without network access"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of worker processes')
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of books per bulk update')
+        parser.add_argument('--book', type=int, action='append', default=[], help='Only re-extract the given book ids')
+        parser.add_argument('--dry-run', action='store_true', help='Report extraction results without saving them')
+
+    def handle(self, *args, **options):
+        books = Book.objects.order_by('id')
+        if options['book']:
+            books = books.filter(id__in=options['book'])
+        items = list(_latest_snapshots(books))
+        if not items:
+            self.stdout.write("No archived snapshots to re-extract")
+            return
+
+        batch_size = options['batch_size']
+        hits = dict.fromkeys(EXTRACTED_FIELDS, 0)
+        pages, failed, updated = 0, 0, 0
+        pending: list[Book] = []
+        started_at = time.monotonic()
+
+        # Forked workers must not share the parent's database connection
+        db.connections.close_all()
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker) as executor:
+            for book_id, result in executor.map(_extract, items, chunksize=16):
+                pages += 1
+                if result is None:
+                    failed += 1
+                    continue
+                book = Book(id=book_id, parse_status=Status.COMPLETED)
+                for result_field, book_field in EXTRACTED_FIELDS.items():
+                    value = result[result_field]
+                    hits[result_field] += value is not None
+                    setattr(book, book_field, value)
+                book.popular_reviews_count = len(book.popular_reviews or [])
+                # The next live parse compares with this result, its page regions are unknown
+                book.result_fingerprint = result_fingerprint(result)
+                book.page_fingerprint = ''
+                pending.append(book)
+                if len(pending) >= batch_size:
+                    updated += self._save(pending, options['dry_run'])
+                    pending = []
+        if pending:
+            updated += self._save(pending, options['dry_run'])
+
+        elapsed = time.monotonic() - started_at
+        self.stdout.write(f"Re-extracted {pages} pages in {elapsed:.1f}s ({pages / elapsed:.1f} pages/sec), {failed} failed")
+        self.stdout.write(f"{'Would update' if options['dry_run'] else 'Updated'} {updated} books")
+        for result_field, count in hits.items():
+            self.stdout.write(f"  {result_field}: {count}/{pages} ({count / pages:.0%})")
+
+    def _save(self, books: list[Book], dry_run: bool) -> int:
+        # A dry run only counts the batch, it is dropped like a saved one so memory stays bounded
+        if dry_run:
+            return len(books)
+        with transaction.atomic():
+            Book.objects.bulk_update(
+                books,
+                ['parse_status', 'popular_reviews_count', 'result_fingerprint', 'page_fingerprint', *EXTRACTED_FIELDS.values()],
+            )
+            invalidate_books(book.id for book in books)
+        return len(books)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.history import rollup_history
+
+
+class Command(BaseCommand):
+    help = "Downsample rating and rank history: raw points to hourly, hourly points to daily"
+
+    def handle(self, *args, **options):
+        rollup_history()
+        self.stdout.write(self.style.SUCCESS("History rollup finished"))
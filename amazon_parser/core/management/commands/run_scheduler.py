@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from core.jobs import enqueue_books
+from core.models import CrawlJob, JobKind
+from core.scheduler import RefreshScheduler
+
+
+class Command(BaseCommand):
+    help = "Run the refresh scheduler, queueing books for the crawl workers as they become stale"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-rate', type=float, default=None,
+            help='Upper limit of dispatched books per second',
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=60,
+            help='Seconds between reloads of due books',
+        )
+
+    def handle(self, *args, **options):
+        job = CrawlJob.objects.create(kind=JobKind.SCHEDULED)
+
+        def dispatch(book_id: int) -> None:
+            enqueue_books([book_id], job=job)
+
+        scheduler = RefreshScheduler(
+            dispatch,
+            max_rate=options['max_rate'],
+            poll_interval=options['poll_interval'],
+        )
+        self.stdout.write("Refresh scheduler started, press Ctrl+C to stop")
+        try:
+            scheduler.run()
+        except KeyboardInterrupt:
+            scheduler.stop()
@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.crawler import run_async_worker, run_worker
+
+
+class Command(BaseCommand):
+    help = "Process queued crawl tasks, run one or more of these next to the web server"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=settings.PARSER_CRAWL_WORKERS,
+            help='Number of crawler threads',
+        )
+        parser.add_argument(
+            '--async', action='store_true', dest='use_async',
+            help='Fetch with the asyncio backend, one thread keeps --concurrency books in flight',
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=settings.PARSER_ASYNC_CONCURRENCY,
+            help='Number of books in flight of an async worker',
+        )
+        parser.add_argument(
+            '--exit-when-idle', action='store_true',
+            help='Stop once the queue is empty instead of waiting for new tasks',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write("Crawl worker started, press Ctrl+C to stop")
+        try:
+            if options['use_async']:
+                stats = run_async_worker(concurrency=options['concurrency'], exit_when_idle=options['exit_when_idle'])
+            else:
+                stats = run_worker(workers=options['workers'], exit_when_idle=options['exit_when_idle'])
+        except KeyboardInterrupt:
+            return
+        self.stdout.write(self.style.SUCCESS(f"Worker finished: {stats}"))
@@ -0,0 +1,55 @@
+"""
+Amazon marketplace helpers shared by the forms, the parser and the crawler
+"""
+import re
+from typing import Final
+from urllib.parse import urlsplit
+
+# Languages that do not have their own Amazon storefront and fall back to amazon.com
+COM_FALLBACK_LANGUAGES: Final[tuple[str, ...]] = ("en", "no", "ru")
+
+ASIN_RE: Final[re.Pattern] = re.compile(r'/dp/([A-Z0-9]+)')
+
+
+def marketplace_tld(language: str | None) -> str:
+    """Return the Amazon top level domain used for the given book language."""
+    if not language or language in COM_FALLBACK_LANGUAGES:
+        return 'com'
+    return language
+
+
+def marketplace_host(language: str | None) -> str:
+    """Return the Amazon host used for the given book language, e.g. www.amazon.de"""
+    return f'www.amazon.{marketplace_tld(language)}'
+
+
+def build_book_url(book_id: str, language: str | None) -> str:
+    """Build the product page url for the given ASIN and language."""
+    return f'https://{marketplace_host(language)}/dp/{book_id}?language=en_GB'
+
+
+def build_reviews_url(book_url: str, page: int = 1) -> str | None:
+    """Build the url of a page of the book's review listing, newest reviews first, None without an ASIN."""
+    asin = extract_asin(book_url)
+    if not asin:
+        return None
+    parts = urlsplit(book_url)
+    return f'{parts.scheme}://{parts.netloc}/product-reviews/{asin}/?sortBy=recent&pageNumber={page}&language=en_GB'
+
+
+def url_host(url: str) -> str:
+    """Return the host of the url, used as a key for per-marketplace limits."""
+    return urlsplit(url).hostname or ''
+
+
+def extract_asin(url: str) -> str | None:
+    """Extract the ASIN from a product page url."""
+    match = ASIN_RE.search(url)
+    return match.group(1) if match else None
+
+
+def marketplace_of(url: str) -> str:
+    """Return the marketplace of a url for metrics labels: the Amazon TLD, e.g. "de", or else the host."""
+    host = url_host(url)
+    prefix, _, tld = host.partition('amazon.')
+    return tld if tld and prefix in ('', 'www.') else host or 'unknown'
@@ -0,0 +1,408 @@
+"""
+Per-stage timings and counters of the crawl, in Prometheus text format.
+
+Every process keeps its own samples in memory, recording one is a dict
+lookup and a few additions under a lock, cheap enough to always stay on.
+Crawl workers are separate processes from the web server, so they export
+their samples to PARSER_METRICS_DIR every PARSER_METRICS_EXPORT_INTERVAL
+seconds and the /metrics view merges those files with its own samples.
+"""
+import atexit
+import bisect
+from contextlib import contextmanager
+from contextvars import ContextVar
+import json
+import logging
+import os
+from pathlib import Path
+import socket
+import tempfile
+import threading
+import time
+from typing import Final
+
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from .marketplaces import marketplace_of
+
+logger = logging.getLogger(__name__)
+
+NETWORK_BUCKETS: Final = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CPU_BUCKETS: Final = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+DIRECT_ROUTE: Final = 'direct'
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._samples: dict[tuple[str, ...], list[float]] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _new_sample(self) -> list[float]:
+        raise NotImplementedError
+
+    def samples(self) -> list[tuple[tuple[str, ...], list[float]]]:
+        with self._lock:
+            return [(key, list(values)) for key, values in self._samples.items()]
+
+    def merge(self, into: dict[tuple[str, ...], list[float]], samples) -> None:
+        for key, values in samples:
+            key = tuple(key)
+            if key in into:
+                into[key] = [a + b for a, b in zip(into[key], values)]
+            else:
+                into[key] = list(values)
+
+    def _labels(self, key: tuple[str, ...], extra: str = '') -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, key)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_sample(self) -> list[float]:
+        return [0.0]
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        if not settings.PARSER_METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            sample = self._samples.get(key)
+            if sample is None:
+                sample = self._samples[key] = self._new_sample()
+            sample[0] += amount
+
+    def render(self, samples: dict) -> list[str]:
+        return [f'{self.name}{self._labels(key)} {_number(values[0])}' for key, values in sorted(samples.items())]
+
+
+class Histogram(_Metric):
+    """Samples are the count of every bucket, not cumulative, then the sum and the count of observations."""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...], buckets: tuple[float, ...]):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+
+    def _new_sample(self) -> list[float]:
+        return [0.0] * (len(self.buckets) + 3)
+
+    def observe(self, value: float, **labels: str) -> None:
+        if not settings.PARSER_METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            sample = self._samples.get(key)
+            if sample is None:
+                sample = self._samples[key] = self._new_sample()
+            sample[index] += 1
+            sample[-2] += value
+            sample[-1] += 1
+
+    @contextmanager
+    def time(self, **labels: str):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def render(self, samples: dict) -> list[str]:
+        lines = []
+        for key, values in sorted(samples.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), values):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{self._labels(key, le)} {_number(cumulative)}')
+            lines.append(f'{self.name}_sum{self._labels(key)} {values[-2]!r}')
+            lines.append(f'{self.name}_count{self._labels(key)} {_number(values[-1])}')
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+REGISTRY: list[_Metric] = []
+
+FETCH_STAGE_SECONDS = Histogram(
+    'amazon_parser_fetch_stage_seconds',
+    'Seconds per fetch stage: TCP connect, proxy tunnel and TLS handshake, time to first byte and body download',
+    ('stage', 'marketplace', 'proxy'), NETWORK_BUCKETS,
+)
+FETCH_RESPONSES = Counter(
+    'amazon_parser_fetch_responses_total',
+    'Fetch attempts by outcome: ok, captcha, throttled, error or failed (no response)',
+    ('outcome', 'marketplace', 'proxy'),
+)
+DOWNLOAD_BYTES = Counter(
+    'amazon_parser_download_bytes_total', 'Bytes of fetched page bodies', ('marketplace', 'proxy'),
+)
+PARSE_STAGE_SECONDS = Histogram(
+    'amazon_parser_parse_stage_seconds',
+    'Seconds per parse stage: tree_build, tree_build_partial, captcha_check or extract',
+    ('stage', 'marketplace'), CPU_BUCKETS,
+)
+EXTRACTOR_ERRORS = Counter(
+    'amazon_parser_extractor_errors_total', 'Extractors that raised on a page', ('extractor', 'marketplace'),
+)
+EXTRACTION_RULES = Counter(
+    'amazon_parser_extraction_rules_total', 'Extraction rules tried on pages, by outcome', ('field', 'rule', 'outcome', 'marketplace'),
+)
+PARSE_RESULTS = Counter(
+    'amazon_parser_parse_results_total',
+    'Parsed pages: changed results, unchanged results, or unchanged pages that were not extracted again',
+    ('outcome', 'marketplace'),
+)
+SNAPSHOT_WRITE_SECONDS = Histogram(
+    'amazon_parser_snapshot_write_seconds', 'Seconds to compress and archive a fetched page', ('marketplace',), CPU_BUCKETS,
+)
+DB_SAVE_SECONDS = Histogram(
+    'amazon_parser_db_save_seconds',
+    'Seconds per database write of parse results: a single book save or a result writer batch',
+    ('operation',), NETWORK_BUCKETS,
+)
+DB_SAVED_BOOKS = Counter(
+    'amazon_parser_db_saved_books_total', 'Books written with their parse results', ('operation',),
+)
+SESSION_EVENTS = Counter(
+    'amazon_parser_sessions_total',
+    'Pooled sessions created, restored from disk or retired, with the reason: age, requests, captchas or proxy',
+    ('event', 'reason', 'marketplace'),
+)
+
+
+def proxy_label(proxy) -> str:
+    """Label of the route a request took, never with the proxy credentials."""
+    return proxy.name if proxy is not None else DIRECT_ROUTE
+
+
+########################################################################################################
+# Connection timings of requests sessions
+
+# Set by fetch_page around a request, the connections opened for it add their handshake times
+_connection_timings: ContextVar[dict | None] = ContextVar('connection_timings', default=None)
+
+
+@contextmanager
+def connection_timings():
+    """Collect connect and tls seconds of the connections opened within the block."""
+    timings = {'connect': 0.0, 'tls': 0.0}
+    token = _connection_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _connection_timings.reset(token)
+
+
+def _timed_connection_class(base, tls: bool):
+    class TimedConnection(base):
+        def _new_conn(self):
+            started_at = time.perf_counter()
+            sock = super()._new_conn()
+            self._tcp_seconds = time.perf_counter() - started_at
+            return sock
+
+        def connect(self):
+            self._tcp_seconds = 0.0
+            started_at = time.perf_counter()
+            super().connect()
+            timings = _connection_timings.get()
+            if timings is not None:
+                timings['connect'] += self._tcp_seconds
+                # Proxy tunnel and TLS handshake, plain HTTP connections have neither
+                if tls or self._tunnel_host:
+                    timings['tls'] += time.perf_counter() - started_at - self._tcp_seconds
+
+    TimedConnection.__name__ = f'Timed{base.__name__}'
+    return TimedConnection
+
+
+def _timed_pool_classes() -> dict:
+    http_pool = type('TimedHTTPConnectionPool', (HTTPConnectionPool,), {
+        'ConnectionCls': _timed_connection_class(HTTPConnection, tls=False),
+    })
+    https_pool = type('TimedHTTPSConnectionPool', (HTTPSConnectionPool,), {
+        'ConnectionCls': _timed_connection_class(HTTPSConnection, tls=True),
+    })
+    return {'http': http_pool, 'https': https_pool}
+
+
+TIMED_POOL_CLASSES: Final = _timed_pool_classes()
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose new connections report their handshake times to connection_timings."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = TIMED_POOL_CLASSES
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+        manager.pool_classes_by_scheme = TIMED_POOL_CLASSES
+        return manager
+
+
+def observe_fetch(url: str, proxy, outcome: str, timings: dict | None = None,
+                  headers_seconds: float | None = None, total_seconds: float | None = None, size: int = 0) -> None:
+    """
+    Record a fetch attempt.
+
+    Args:
+        url: Fetched url, labelled by its marketplace
+        proxy (ProxyHealth, optional): Proxy the request went through
+        outcome: "ok", "captcha", "throttled", "error" or "failed"
+        timings: connect and tls seconds of a newly opened connection
+        headers_seconds: Seconds from sending the request, connecting included, to the response headers
+        total_seconds: Seconds from sending the request to the end of the body
+        size: Body size in bytes
+    """
+    labels = {'marketplace': marketplace_of(url), 'proxy': proxy_label(proxy)}
+    FETCH_RESPONSES.inc(outcome=outcome, **labels)
+    if headers_seconds is None:
+        return
+    handshake = 0.0
+    if timings:
+        for stage in ('connect', 'tls'):
+            if timings[stage]:
+                FETCH_STAGE_SECONDS.observe(timings[stage], stage=stage, **labels)
+                handshake += timings[stage]
+    FETCH_STAGE_SECONDS.observe(max(headers_seconds - handshake, 0.0), stage='ttfb', **labels)
+    if total_seconds is not None:
+        FETCH_STAGE_SECONDS.observe(max(total_seconds - headers_seconds, 0.0), stage='download', **labels)
+    if size:
+        DOWNLOAD_BYTES.inc(size, **labels)
+
+
+class HttpxTrace:
+    """httpx trace extension collecting the connection and response header times of one request."""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.timings = {'connect': 0.0, 'tls': 0.0}
+        self.headers_at: float | None = None
+        self._started: dict[str, float] = {}
+
+    async def __call__(self, event_name: str, info: dict) -> None:
+        now = time.perf_counter()
+        name, _, phase = event_name.rpartition('.')
+        if phase == 'started':
+            self._started[name] = now
+        elif phase == 'complete':
+            started_at = self._started.pop(name, now)
+            if name == 'connection.connect_tcp':
+                self.timings['connect'] += now - started_at
+            elif name == 'connection.start_tls':
+                self.timings['tls'] += now - started_at
+            elif name.endswith('.receive_response_headers'):
+                self.headers_at = now
+
+    @property
+    def headers_seconds(self) -> float | None:
+        return self.headers_at - self.started_at if self.headers_at is not None else None
+
+
+########################################################################################################
+# Export of worker samples and merging for the /metrics view
+
+def collect() -> dict:
+    """Samples of this process by metric name."""
+    return {metric.name: metric.samples() for metric in REGISTRY}
+
+
+def _export_path() -> Path:
+    return Path(settings.PARSER_METRICS_DIR) / f'{socket.gethostname()}-{os.getpid()}.json'
+
+
+def export() -> None:
+    """Write the samples of this process for the /metrics view of the web server."""
+    path = _export_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(collect(), f)
+    os.replace(tmp_path, path)
+
+
+_exporter: threading.Thread | None = None
+_exporter_lock = threading.Lock()
+
+
+def start_exporter() -> None:
+    """Export the samples of this process periodically and at exit, started by crawl workers."""
+    global _exporter
+    if not settings.PARSER_METRICS_ENABLED:
+        return
+    with _exporter_lock:
+        if _exporter is not None:
+            return
+
+        def _export_periodically():
+            while True:
+                time.sleep(settings.PARSER_METRICS_EXPORT_INTERVAL)
+                try:
+                    export()
+                except Exception as e:
+                    logger.error("Failed to export metrics", exc_info=e)
+
+        _exporter = threading.Thread(target=_export_periodically, name='metrics-exporter', daemon=True)
+        _exporter.start()
+        atexit.register(export)
+
+
+def _exported_samples() -> list[dict]:
+    """Samples of the other processes, files of processes gone for longer than the retention are removed."""
+    directory = Path(settings.PARSER_METRICS_DIR)
+    if not directory.exists():
+        return []
+    own_path = _export_path()
+    expired_before = time.time() - settings.PARSER_METRICS_RETENTION.total_seconds()
+    exported = []
+    for path in directory.glob('*.json'):
+        if path == own_path:
+            continue
+        try:
+            if path.stat().st_mtime < expired_before:
+                path.unlink(missing_ok=True)
+                continue
+            exported.append(json.loads(path.read_text()))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping metrics file {path.name}: {e}")
+    return exported
+
+
+def render_metrics() -> str:
+    """All metrics of this and the exporting processes in Prometheus text format."""
+    exported = _exported_samples()
+    lines = []
+    for metric in REGISTRY:
+        merged: dict[tuple[str, ...], list[float]] = {}
+        metric.merge(merged, metric.samples())
+        for samples in exported:
+            metric.merge(merged, samples.get(metric.name, []))
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.render(merged))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,54 @@
+# Generated by Django 5.2 on 2026-10-18 17:04
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0002_book_language"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PageSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("asin", models.CharField(max_length=20)),
+                ("fetched_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("content_hash", models.CharField(max_length=64)),
+                ("size", models.PositiveIntegerField()),
+                ("stored_size", models.PositiveIntegerField()),
+                (
+                    "book",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="snapshots",
+                        to="core.book",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["asin", "-fetched_at"], name="snapshot_asin_fetched_idx"
+                    ),
+                    models.Index(
+                        fields=["book", "-fetched_at"], name="snapshot_book_fetched_idx"
+                    ),
+                    models.Index(fields=["content_hash"], name="snapshot_hash_idx"),
+                ],
+            },
+        ),
+    ]
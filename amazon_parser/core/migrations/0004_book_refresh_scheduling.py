@@ -0,0 +1,27 @@
+# Generated by Django 5.2 on 2026-10-18 17:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0003_page_snapshot"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="next_parse_at",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="book",
+            name="parse_failures",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="book",
+            name="refresh_interval",
+            field=models.DurationField(blank=True, null=True),
+        ),
+    ]
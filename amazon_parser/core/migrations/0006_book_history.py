@@ -0,0 +1,122 @@
+# Generated by Django 5.2 on 2026-10-18 17:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0005_crawl_job_queue"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RankCategory",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=255, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="BookMetricsHistory",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("captured_at", models.DateTimeField()),
+                (
+                    "resolution",
+                    models.CharField(
+                        choices=[("raw", "Raw"), ("hour", "Hour"), ("day", "Day")],
+                        default="raw",
+                        max_length=8,
+                    ),
+                ),
+                ("rating", models.FloatField(blank=True, null=True)),
+                ("reviews_count", models.IntegerField(blank=True, null=True)),
+                (
+                    "book",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="metrics_history",
+                        to="core.book",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["book", "captured_at"], name="metrics_book_captured_idx"
+                    ),
+                    models.Index(
+                        fields=["resolution", "captured_at"],
+                        name="metrics_resolution_idx",
+                    ),
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="BookRankHistory",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("captured_at", models.DateTimeField()),
+                (
+                    "resolution",
+                    models.CharField(
+                        choices=[("raw", "Raw"), ("hour", "Hour"), ("day", "Day")],
+                        default="raw",
+                        max_length=8,
+                    ),
+                ),
+                ("rank", models.PositiveIntegerField()),
+                (
+                    "book",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="rank_history",
+                        to="core.book",
+                    ),
+                ),
+                (
+                    "category",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="core.rankcategory",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["book", "captured_at"], name="rank_book_captured_idx"
+                    ),
+                    models.Index(
+                        fields=["resolution", "captured_at"], name="rank_resolution_idx"
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2 on 2026-10-18 17:16
+
+from django.db import migrations, models
+
+
+def backfill_popular_reviews_count(apps, schema_editor):
+    Book = apps.get_model("core", "Book")
+    books = []
+    for book in Book.objects.exclude(popular_reviews=None).only("id", "popular_reviews").iterator(chunk_size=1000):
+        book.popular_reviews_count = len(book.popular_reviews or [])
+        books.append(book)
+        if len(books) >= 1000:
+            Book.objects.bulk_update(books, ["popular_reviews_count"])
+            books = []
+    Book.objects.bulk_update(books, ["popular_reviews_count"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0006_book_history"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="popular_reviews_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_popular_reviews_count, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="bookseries",
+            name="title",
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(fields=["created_at", "id"], name="book_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(fields=["name", "id"], name="book_name_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(fields=["rating", "id"], name="book_rating_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(
+                fields=["reviews_count", "id"], name="book_reviews_count_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(
+                fields=["popular_reviews_count", "id"], name="book_popular_reviews_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(
+                fields=["language", "created_at"], name="book_language_created_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-18 17:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0007_book_list_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="last_error",
+            field=models.TextField(blank=True),
+        ),
+    ]
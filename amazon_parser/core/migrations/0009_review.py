@@ -0,0 +1,63 @@
+# Generated by Django 5.2 on 2026-10-18 17:34
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0008_book_last_error"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="reviews_crawled_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name="Review",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("review_id", models.CharField(max_length=64)),
+                ("reviewer_name", models.CharField(blank=True, max_length=255)),
+                ("rating", models.FloatField(blank=True, null=True)),
+                ("title", models.TextField(blank=True)),
+                ("content", models.TextField(blank=True)),
+                ("reviewed_on", models.DateField(blank=True, null=True)),
+                (
+                    "first_seen_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                (
+                    "book",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="reviews",
+                        to="core.book",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["book", "-first_seen_at"], name="review_book_seen_idx"
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("book", "review_id"), name="review_book_review_id_uniq"
+                    )
+                ],
+            },
+        ),
+    ]
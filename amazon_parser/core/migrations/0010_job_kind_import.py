@@ -0,0 +1,25 @@
+# Generated by Django 5.2 on 2026-10-18 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0009_review"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="crawljob",
+            name="kind",
+            field=models.CharField(
+                choices=[
+                    ("all books", "All Books"),
+                    ("scheduled", "Scheduled"),
+                    ("single", "Single"),
+                    ("import", "Import"),
+                ],
+                max_length=32,
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2 on 2026-10-18 17:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0010_job_kind_import"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="page_fingerprint",
+            field=models.CharField(blank=True, editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name="book",
+            name="result_fingerprint",
+            field=models.CharField(blank=True, editable=False, max_length=32),
+        ),
+    ]
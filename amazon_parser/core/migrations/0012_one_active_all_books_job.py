@@ -0,0 +1,20 @@
+# Generated by Django 5.2 on 2026-10-18 18:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0011_book_fingerprints"),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name="crawljob",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("kind", "all books"), ("status__in", ["queued", "running"])),
+                fields=("kind",),
+                name="one_active_all_books_job",
+            ),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 # Create your models here.
 
@@ -23,7 +24,7 @@ class Language(models.TextChoices):
     SWEDEN = "se"
 
 class BookSeries(models.Model):
-    title = models.CharField(max_length=255)
+    title = models.CharField(max_length=255, db_index=True)
 
     def __str__(self) -> str:
         return str(self.title)
@@ -40,9 +41,181 @@ class Book(models.Model):
     reviews_count = models.IntegerField(null=True, blank=True)
     best_seller_ranks = models.JSONField(null=True, blank=True)
     popular_reviews = models.JSONField(null=True, blank=True)
+    # Number of popular reviews, kept next to the JSON so the book list can sort on an indexed column
+    popular_reviews_count = models.PositiveIntegerField(default=0)
     parse_status = models.CharField(max_length=255, null=True, blank=True, choices=Status.choices)
     parsed_at = models.DateTimeField(null=True, blank=True)
-    
+    # Refresh scheduling: per-book override of the refresh interval, next due time and failed parses in a row
+    refresh_interval = models.DurationField(null=True, blank=True)
+    next_parse_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    parse_failures = models.PositiveIntegerField(default=0)
+    # Error of the latest parse attempt, empty after a successful one
+    last_error = models.TextField(blank=True)
+    # Last crawl of the full review listing, see core.reviews
+    reviews_crawled_at = models.DateTimeField(null=True, blank=True)
+    # Fingerprints of the stored parse result and of the page regions it was extracted from, see core.fingerprints
+    result_fingerprint = models.CharField(max_length=32, blank=True, editable=False)
+    page_fingerprint = models.CharField(max_length=32, blank=True, editable=False)
+
+    class Meta:
+        # Sort orders of the book list, with the primary key as the tie breaker of keyset pagination
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='book_created_idx'),
+            models.Index(fields=['name', 'id'], name='book_name_idx'),
+            models.Index(fields=['rating', 'id'], name='book_rating_idx'),
+            models.Index(fields=['reviews_count', 'id'], name='book_reviews_count_idx'),
+            models.Index(fields=['popular_reviews_count', 'id'], name='book_popular_reviews_idx'),
+            models.Index(fields=['language', 'created_at'], name='book_language_created_idx'),
+        ]
+
     def __str__(self) -> str:
         return str(self.name)
-        
+
+
+class Review(models.Model):
+    """Review of a book from its review listing, stored once per Amazon review id."""
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='reviews')
+    # Amazon's review id, or a hash of the review's content for reviews shown without one
+    review_id = models.CharField(max_length=64)
+    reviewer_name = models.CharField(max_length=255, blank=True)
+    rating = models.FloatField(null=True, blank=True)
+    title = models.TextField(blank=True)
+    content = models.TextField(blank=True)
+    reviewed_on = models.DateField(null=True, blank=True)
+    first_seen_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'review_id'], name='review_book_review_id_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['book', '-first_seen_at'], name='review_book_seen_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.review_id} of book {self.book_id}'
+
+
+class PageSnapshot(models.Model):
+    """Index entry of an archived product page, the page body is stored once per content hash."""
+    book = models.ForeignKey(Book, on_delete=models.SET_NULL, related_name='snapshots', null=True, blank=True)
+    asin = models.CharField(max_length=20)
+    fetched_at = models.DateTimeField(default=timezone.now)
+    content_hash = models.CharField(max_length=64)
+    size = models.PositiveIntegerField()
+    stored_size = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['asin', '-fetched_at'], name='snapshot_asin_fetched_idx'),
+            models.Index(fields=['book', '-fetched_at'], name='snapshot_book_fetched_idx'),
+            models.Index(fields=['content_hash'], name='snapshot_hash_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.asin} @ {self.fetched_at:%Y-%m-%d %H:%M}'
+
+
+class JobKind(models.TextChoices):
+    ALL_BOOKS = 'all books'
+    SCHEDULED = 'scheduled'
+    SINGLE = 'single'
+    IMPORT = 'import'
+
+class TaskStatus(models.TextChoices):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+class CrawlJob(models.Model):
+    """A batch of book parses, e.g. one "Parse All Books" run."""
+    kind = models.CharField(max_length=32, choices=JobKind.choices)
+    status = models.CharField(max_length=32, choices=TaskStatus.choices, default=TaskStatus.QUEUED)
+    total = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'status'], name='job_kind_status_idx'),
+        ]
+        constraints = [
+            # At most one "Parse All Books" run is queued or running, see tasks.parse_all_books
+            models.UniqueConstraint(
+                fields=['kind'],
+                condition=models.Q(kind='all books', status__in=['queued', 'running']),
+                name='one_active_all_books_job',
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.kind} job #{self.pk} ({self.status})'
+
+
+class CrawlTask(models.Model):
+    """Parse of a single book within a job, claimed atomically by a worker."""
+    job = models.ForeignKey(CrawlJob, on_delete=models.CASCADE, related_name='tasks')
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='crawl_tasks')
+    status = models.CharField(max_length=32, choices=TaskStatus.choices, default=TaskStatus.QUEUED)
+    priority = models.SmallIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    claimed_by = models.CharField(max_length=128, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', '-priority', 'available_at'], name='task_claim_idx'),
+            models.Index(fields=['job', 'status'], name='task_job_status_idx'),
+            models.Index(fields=['claimed_by'], name='task_claimed_by_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f'task #{self.pk} of book {self.book_id} ({self.status})'
+
+
+class Resolution(models.TextChoices):
+    RAW = 'raw'
+    HOUR = 'hour'
+    DAY = 'day'
+
+class RankCategory(models.Model):
+    """Best seller category, history rows refer to it by id instead of repeating its name."""
+    name = models.CharField(max_length=255, unique=True)
+
+    def __str__(self) -> str:
+        return str(self.name)
+
+
+class BookMetricsHistory(models.Model):
+    """Rating and reviews count of a book at a point in time, or averaged over an hour or a day."""
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='metrics_history')
+    captured_at = models.DateTimeField()
+    resolution = models.CharField(max_length=8, choices=Resolution.choices, default=Resolution.RAW)
+    rating = models.FloatField(null=True, blank=True)
+    reviews_count = models.IntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['book', 'captured_at'], name='metrics_book_captured_idx'),
+            models.Index(fields=['resolution', 'captured_at'], name='metrics_resolution_idx'),
+        ]
+
+
+class BookRankHistory(models.Model):
+    """Best seller place of a book in one category at a point in time, or averaged over an hour or a day."""
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='rank_history')
+    category = models.ForeignKey(RankCategory, on_delete=models.CASCADE, related_name='+')
+    captured_at = models.DateTimeField()
+    resolution = models.CharField(max_length=8, choices=Resolution.choices, default=Resolution.RAW)
+    rank = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['book', 'captured_at'], name='rank_book_captured_idx'),
+            models.Index(fields=['resolution', 'captured_at'], name='rank_resolution_idx'),
+        ]
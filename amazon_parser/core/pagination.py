@@ -0,0 +1,152 @@
+"""
+Keyset (cursor) pagination.
+
+A page starts right after the sort key of the last row of the previous
+page instead of at an OFFSET, so every page is a range scan on the sort
+index however deep it is, and no COUNT(*) of the result set is needed.
+"""
+import base64
+from dataclasses import dataclass
+from datetime import datetime
+import json
+from typing import Iterator
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q, QuerySet
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class _CursorEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        # DjangoJSONEncoder cuts datetimes to milliseconds, a cursor needs the exact value
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values: list, backwards: bool = False) -> str:
+    payload = json.dumps({'v': values, 'b': backwards}, cls=_CursorEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> tuple[list, bool]:
+    """Return the sort key values and direction stored in the cursor."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return list(payload['v']), bool(payload.get('b'))
+    except (ValueError, TypeError, KeyError) as e:
+        raise InvalidCursor(cursor) from e
+
+
+@dataclass
+class KeysetPage:
+    object_list: list
+    has_next: bool
+    has_previous: bool
+    next_cursor: str | None
+    previous_cursor: str | None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self) -> int:
+        return len(self.object_list)
+
+    def has_other_pages(self) -> bool:
+        return self.has_next or self.has_previous
+
+
+class KeysetPaginator:
+    """
+    Paginates a queryset by its ordering fields, with the primary key as tie breaker.
+
+    Ascending fields sort NULLs first and descending ones NULLs last, the
+    same as SQLite does by default, so single-column indexes stay usable.
+    """
+
+    def __init__(self, queryset: QuerySet, per_page: int, ordering: list[str] | None = None):
+        ordering = ordering or [field for field in queryset.query.order_by if isinstance(field, str)]
+        self.keys = [(field.lstrip('-'), field.startswith('-')) for field in ordering if field != '?']
+        if not any(field in ('id', 'pk') for field, _ in self.keys):
+            self.keys.append(('id', self.keys[0][1] if self.keys else False))
+        self.queryset = queryset.annotate(**{f'_keyset_{i}': F(field) for i, (field, _) in enumerate(self.keys)})
+        self.per_page = per_page
+
+    @staticmethod
+    def _after(field: str, descending: bool, value) -> Q:
+        """Rows strictly after the value in the field's sort order."""
+        if descending:
+            if value is None:
+                return Q(pk__in=[])
+            return Q(**{f'{field}__lt': value}) | Q(**{f'{field}__isnull': True})
+        if value is None:
+            return Q(**{f'{field}__isnull': False})
+        return Q(**{f'{field}__gt': value})
+
+    @staticmethod
+    def _equal(field: str, value) -> Q:
+        if value is None:
+            return Q(**{f'{field}__isnull': True})
+        return Q(**{field: value})
+
+    def _seek(self, keys: list[tuple[str, bool]], values: list) -> Q:
+        """(k1 > v1) OR (k1 = v1 AND k2 > v2) OR ..."""
+        condition = Q(pk__in=[])
+        prefix = Q()
+        for (field, descending), value in zip(keys, values):
+            condition |= prefix & self._after(field, descending, value)
+            prefix &= self._equal(field, value)
+        return condition
+
+    def _cursor(self, obj, backwards: bool) -> str:
+        return encode_cursor([getattr(obj, f'_keyset_{i}') for i in range(len(self.keys))], backwards)
+
+    def page(self, cursor: str | None = None) -> KeysetPage:
+        """Return the page after the cursor, or before it for a backwards cursor."""
+        values, backwards = decode_cursor(cursor) if cursor else (None, False)
+        if values is not None and len(values) != len(self.keys):
+            raise InvalidCursor(cursor)
+        # Going backwards walks the reversed order from the cursor and flips the rows afterwards
+        keys = [(field, descending != backwards) for field, descending in self.keys]
+        queryset = self.queryset.order_by(*(
+            F(field).desc(nulls_last=True) if descending else F(field).asc(nulls_first=True)
+            for field, descending in keys
+        ))
+        if values is not None:
+            queryset = queryset.filter(self._seek(keys, values))
+        rows = list(queryset[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+        has_next = True if backwards else more
+        has_previous = more if backwards else values is not None
+        return KeysetPage(
+            object_list=rows,
+            has_next=has_next and bool(rows),
+            has_previous=has_previous and bool(rows),
+            next_cursor=self._cursor(rows[-1], False) if rows else None,
+            previous_cursor=self._cursor(rows[0], True) if rows else None,
+        )
+
+
+def keyset_batches(queryset: QuerySet, batch_size: int, ordering: list[str] | None = None) -> Iterator[list]:
+    """
+    Rows of the queryset in its order, batch_size rows at a time, for long running readers.
+
+    Every batch is a query of its own that is fetched completely, unlike
+    QuerySet.iterator() no read statement stays open between batches, which
+    on SQLite would keep the writes of every other connection from committing.
+    """
+    paginator = KeysetPaginator(queryset, batch_size, ordering)
+    cursor = None
+    while True:
+        page = paginator.page(cursor)
+        if page.object_list:
+            yield page.object_list
+        if not page.has_next:
+            return
+        cursor = page.next_cursor
@@ -0,0 +1,178 @@
+"""
+Staleness-driven refresh scheduling.
+
+Every book gets a next_parse_at due time from its last parse, its refresh
+interval (hourly for top ranked books, daily for the rest) and, after
+failures, an exponential backoff. RefreshScheduler keeps the books due
+soon in a priority queue and dispatches them evenly over the scheduling
+window with random jitter instead of in bursts.
+"""
+from datetime import datetime, timedelta
+import heapq
+import logging
+import random
+import threading
+import time
+from typing import Callable
+
+from django.conf import settings
+from django.db.models import Exists, F, OuterRef
+from django.utils import timezone
+
+from .models import Book, CrawlTask, Status, TaskStatus
+
+logger = logging.getLogger(__name__)
+
+
+def best_rank(best_seller_ranks: list[dict] | None) -> int | None:
+    """Return the best (lowest) place among the book's best seller ranks."""
+    places = []
+    for rank in best_seller_ranks or []:
+        try:
+            places.append(int(rank.get('place')))
+        except (TypeError, ValueError):
+            continue
+    return min(places) if places else None
+
+
+def refresh_interval_for(book: Book) -> timedelta:
+    """Return how often the book should be refreshed."""
+    if book.refresh_interval:
+        return book.refresh_interval
+    rank = best_rank(book.best_seller_ranks)
+    if rank is not None and rank <= settings.PARSER_TOP_RANK_THRESHOLD:
+        return settings.PARSER_TOP_RANK_REFRESH_INTERVAL
+    return settings.PARSER_REFRESH_INTERVAL
+
+
+def retry_backoff(failures: int) -> timedelta:
+    """Return the delay before retrying a book that failed the given number of times in a row."""
+    backoff = settings.PARSER_RETRY_BACKOFF_BASE * 2 ** max(failures - 1, 0)
+    return min(backoff, settings.PARSER_RETRY_BACKOFF_MAX)
+
+
+def fetch_retry_delay(attempt: int, retry_after: float | None = None) -> timedelta:
+    """
+    Return the delay before the given retry of a transient fetch failure.
+
+    Exponential backoff with jitter over the upper half of the interval, never
+    shorter than the server's Retry-After, capped at PARSER_RETRY_BACKOFF_MAX.
+    """
+    backoff = min(settings.PARSER_FETCH_RETRY_BASE * 2 ** max(attempt - 1, 0), settings.PARSER_FETCH_RETRY_MAX)
+    delay = backoff * random.uniform(0.5, 1)
+    if retry_after:
+        delay = max(delay, timedelta(seconds=retry_after))
+    return min(delay, settings.PARSER_RETRY_BACKOFF_MAX)
+
+
+def _jittered(delay: timedelta) -> timedelta:
+    jitter = settings.PARSER_SCHEDULER_JITTER
+    return delay * random.uniform(1 - jitter, 1 + jitter)
+
+
+def compute_next_parse_at(book: Book, now: datetime | None = None) -> datetime:
+    """Return when the book is due again after its latest parse attempt."""
+    now = now or timezone.now()
+    if book.parse_status == Status.ERROR:
+        return now + _jittered(retry_backoff(book.parse_failures))
+    return (book.parsed_at or now) + _jittered(refresh_interval_for(book))
+
+
+class RefreshScheduler:
+    """
+    Long-running dispatcher of due books.
+
+    Books due within the scheduling window are loaded into a heap ordered by
+    due time and staleness, then handed to dispatch one at a time with the
+    gap between dispatches set so that the window's load is spread evenly.
+    """
+
+    def __init__(
+        self,
+        dispatch: Callable[[int], None],
+        window: timedelta | None = None,
+        max_rate: float | None = None,
+        max_queue: int = 5000,
+        poll_interval: float = 60,
+    ):
+        """
+        Args:
+            dispatch: Callable starting the parse of a book id
+            window: Period over which due books are spread, PARSER_SCHEDULER_WINDOW by default
+            max_rate: Upper limit of dispatched books per second
+            max_queue: Maximum number of books held in the queue
+            poll_interval: Seconds between reloads of due books from the database
+        """
+        self.dispatch = dispatch
+        self.window = window or settings.PARSER_SCHEDULER_WINDOW
+        self.max_rate = max_rate
+        self.max_queue = max_queue
+        self.poll_interval = poll_interval
+        self._queue: list[tuple[float, float, int]] = []
+        self._queued_ids: set[int] = set()
+        self._rate = 0.0
+        self._stop = threading.Event()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def refill(self) -> None:
+        """Load books due within the window and recompute the dispatch rate."""
+        now = timezone.now()
+        due = Book.objects.filter(next_parse_at__lte=now + self.window) | Book.objects.filter(next_parse_at__isnull=True)
+        # Books already waiting in the crawl queue are not dispatched twice
+        due = due.exclude(Exists(CrawlTask.objects.filter(
+            book=OuterRef('pk'), status__in=(TaskStatus.QUEUED, TaskStatus.RUNNING),
+        )))
+        due_count = due.count()
+        self._rate = due_count / self.window.total_seconds()
+        if self.max_rate:
+            self._rate = min(self._rate, self.max_rate)
+
+        rows = (
+            due.exclude(id__in=self._queued_ids)
+            .order_by(F('next_parse_at').asc(nulls_first=True), F('parsed_at').asc(nulls_first=True))
+            .values_list('id', 'next_parse_at', 'parsed_at')
+        )
+        free_slots = self.max_queue - len(self._queue)
+        if free_slots <= 0:
+            return
+        for book_id, next_parse_at, parsed_at in rows[:free_slots].iterator(chunk_size=1000):
+            due_at = next_parse_at.timestamp() if next_parse_at else 0.0
+            stale_since = parsed_at.timestamp() if parsed_at else 0.0
+            heapq.heappush(self._queue, (due_at, stale_since, book_id))
+            self._queued_ids.add(book_id)
+        logger.info(
+            f"Scheduler queue: {len(self._queue)} books, {due_count} due within {self.window}, "
+            f"dispatching {self._rate * 3600:.0f} books/hour"
+        )
+
+    def _dispatch_gap(self) -> float:
+        if not self._rate:
+            return self.poll_interval
+        jitter = settings.PARSER_SCHEDULER_JITTER
+        # Books are never dispatched before they are due, so a quiet window must not delay newly due ones
+        return min(random.uniform(1 - jitter, 1 + jitter) / self._rate, self.poll_interval)
+
+    def run(self) -> None:
+        """Dispatch due books until stopped."""
+        next_refill = 0.0
+        while not self._stop.is_set():
+            if time.monotonic() >= next_refill:
+                self.refill()
+                next_refill = time.monotonic() + self.poll_interval
+
+            if not self._queue or self._queue[0][0] > time.time():
+                self._stop.wait(min(self.poll_interval, max(next_refill - time.monotonic(), 0.1)))
+                continue
+
+            _, _, book_id = heapq.heappop(self._queue)
+            self._queued_ids.discard(book_id)
+            # Lease the book for one window so it is not queued again while being parsed,
+            # the parse sets the real due time and a crashed parse is retried after the lease
+            Book.objects.filter(id=book_id).update(next_parse_at=timezone.now() + self.window)
+            try:
+                self.dispatch(book_id)
+            except Exception as e:
+                logger.error(f"Failed to dispatch book {book_id}", exc_info=e)
+            self._stop.wait(self._dispatch_gap())
@@ -0,0 +1,340 @@
+"""
+Pool of warmed HTTP sessions per marketplace, with cookie jars kept on disk.
+
+A session is warmed up once, with a visit of the marketplace home page,
+and then reused by every parser that fetches from that marketplace,
+keeping its cookie jar, proxy and User-Agent for its whole life. Jars are
+written to PARSER_SESSION_DIR whenever their cookies change and are
+loaded again after a restart. Worker processes share the directory, a
+process holds an exclusive lock on the jar of every session it uses, so
+no two processes restore or write the same jar; the locks go away with
+the process. Without fcntl, e.g. on Windows, jars are kept in memory
+only. Sessions are retired after
+PARSER_SESSION_MAX_AGE, PARSER_SESSION_MAX_REQUESTS requests or
+PARSER_SESSION_MAX_CAPTCHAS captchas, or when their proxy is no longer
+configured.
+"""
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+import json
+import logging
+import os
+from pathlib import Path
+import re
+import threading
+import time
+from typing import IO
+from urllib.parse import urlsplit
+import uuid
+
+import requests
+from django.conf import settings
+
+from .marketplaces import marketplace_of
+from .metrics import SESSION_EVENTS, TimedHTTPAdapter
+from .utils import ProxyHealth, ProxyState, browser_headers, get_proxy_manager
+
+try:
+    import fcntl
+except ImportError:  # jars on disk need file locks, without them sessions are kept in memory
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+def url_origin(url: str) -> str:
+    """Return the scheme and host of the url, sessions are pooled per origin."""
+    parts = urlsplit(url)
+    return f'{parts.scheme}://{parts.netloc}'
+
+
+@dataclass
+class PooledSession:
+    origin: str
+    session: requests.Session
+    proxy: ProxyHealth | None
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    # Wall clock time, so the age of a session carries over restarts
+    created_at: float = field(default_factory=time.time)
+    request_count: int = 0
+    captchas: int = 0
+    _saved_cookies: frozenset = field(default=frozenset(), repr=False)
+    # Open lock file of the jar while this process owns it
+    _jar_lock: IO | None = field(default=None, repr=False)
+
+    @property
+    def proxy_name(self) -> str | None:
+        return self.proxy.name if self.proxy else None
+
+    def cookie_state(self) -> frozenset:
+        return frozenset((cookie.name, cookie.value, cookie.domain, cookie.path) for cookie in self.session.cookies)
+
+    def retire_reason(self) -> str | None:
+        """Why the session should not be used any more, None while it is still good."""
+        if time.time() - self.created_at >= settings.PARSER_SESSION_MAX_AGE.total_seconds():
+            return 'age'
+        if self.request_count >= settings.PARSER_SESSION_MAX_REQUESTS:
+            return 'requests'
+        if self.captchas >= settings.PARSER_SESSION_MAX_CAPTCHAS:
+            return 'captchas'
+        return None
+
+
+def _new_http_session(proxy: ProxyHealth | None, headers: dict[str, str]) -> requests.Session:
+    session = requests.Session()
+    session.headers.update(headers)
+    if proxy is None:
+        # Proxies mount their own adapter, this one times connections of the direct route
+        session.mount('https://', TimedHTTPAdapter())
+        session.mount('http://', TimedHTTPAdapter())
+    else:
+        session.proxies.update(get_proxy_manager().get_proxy_dict(proxy.proxy))
+        session.mount('https://', proxy.adapter)
+        session.mount('http://', proxy.adapter)
+    return session
+
+
+class SessionPool:
+    """
+    Idle sessions per origin, handed out to one fetch at a time.
+
+    Settings are read on every call, so a pool outlives setting overrides,
+    e.g. of the load test.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Held while the jars of an origin are restored, acquire() waits for them
+        self._load_lock = threading.Lock()
+        self._idle: dict[str, list[PooledSession]] = {}
+        self._loaded: set[str] = set()
+
+    def _directory(self, origin: str) -> Path | None:
+        if not settings.PARSER_SESSION_DIR or fcntl is None:
+            return None
+        return Path(settings.PARSER_SESSION_DIR) / re.sub(r'[^\w.-]', '_', origin)
+
+    def _path(self, pooled: PooledSession) -> Path | None:
+        directory = self._directory(pooled.origin)
+        return directory / f'{pooled.id}.json' if directory else None
+
+    def acquire(self, url: str, proxy: ProxyHealth | None = None, avoid: set[str] | frozenset = frozenset(),
+                rate_limiter=None) -> PooledSession:
+        """
+        Take a session for the origin of the url out of the pool, a new warmed one if none is idle.
+
+        Args:
+            url: Url the session is going to fetch
+            proxy: Only take a session through this proxy
+            avoid: Ids of sessions not to take, e.g. ones that just got a captcha
+            rate_limiter: Limiter the warm-up request of a new session waits for
+        """
+        origin = url_origin(url)
+        if origin not in self._loaded:
+            self._load(origin)
+        with self._lock:
+            idle = self._idle.get(origin, [])
+            # The most recently used session first, so few sessions stay warm
+            for index in range(len(idle) - 1, -1, -1):
+                pooled = idle[index]
+                if pooled.id in avoid or (proxy is not None and pooled.proxy is not proxy):
+                    continue
+                # A pinned proxy is used whatever its state, e.g. to probe it
+                if proxy is None and pooled.proxy is not None and pooled.proxy.state == ProxyState.OPEN:
+                    continue
+                return idle.pop(index)
+        return self._create(origin, proxy, rate_limiter)
+
+    def release(self, pooled: PooledSession, retire: str | None = None) -> None:
+        """
+        Return the session to the pool, or retire it.
+
+        Args:
+            pooled: Session taken with acquire
+            retire: Reason to retire the session now, e.g. its proxy failed
+        """
+        reason = retire or pooled.retire_reason()
+        if reason:
+            self._retire(pooled, reason)
+            return
+        cookies = pooled.cookie_state()
+        if cookies != pooled._saved_cookies:
+            self._save(pooled, cookies)
+        with self._lock:
+            self._idle.setdefault(pooled.origin, []).append(pooled)
+
+    def _create(self, origin: str, proxy: ProxyHealth | None, rate_limiter) -> PooledSession:
+        proxy = proxy or get_proxy_manager().select()
+        pooled = PooledSession(origin=origin, session=_new_http_session(proxy, browser_headers()), proxy=proxy)
+        SESSION_EVENTS.inc(event='created', reason='', marketplace=marketplace_of(origin))
+        if settings.PARSER_SESSION_WARM_UP:
+            self._warm_up(pooled, rate_limiter)
+        return pooled
+
+    def _warm_up(self, pooled: PooledSession, rate_limiter) -> None:
+        """Visit the marketplace home page, for the cookies a browsing customer would have."""
+        url = f'{pooled.origin}/'
+        try:
+            with rate_limiter.slot(url) if rate_limiter else nullcontext():
+                response = pooled.session.get(url, timeout=10)
+            pooled.request_count += 1
+            logger.info(f"Warmed up session {pooled.id} through {pooled.proxy_name or 'direct route'}: {response.status_code}")
+        except requests.RequestException as e:
+            logger.warning(f"Warm-up of session {pooled.id} failed: {e}")
+
+    def _retire(self, pooled: PooledSession, reason: str) -> None:
+        logger.info(f"Retiring session {pooled.id} of {pooled.origin} ({reason}) after {pooled.request_count} requests")
+        SESSION_EVENTS.inc(event='retired', reason=reason, marketplace=marketplace_of(pooled.origin))
+        path = self._path(pooled)
+        if path:
+            path.unlink(missing_ok=True)
+            if pooled._jar_lock is not None:
+                self._unlock_jar(pooled._jar_lock, path)
+                pooled._jar_lock = None
+
+    @staticmethod
+    def _lock_jar(path: Path) -> IO | None:
+        """Take the exclusive lock of the jar, None while another process holds it."""
+        try:
+            lock = open(path.with_suffix('.lock'), 'a')
+        except OSError as e:
+            logger.warning(f"Failed to open the lock of session {path.stem}: {e}")
+            return None
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            return None
+        return lock
+
+    @staticmethod
+    def _unlock_jar(lock: IO, path: Path) -> None:
+        """Drop the lock of a removed jar, the jar goes first so a process locking it next finds it gone."""
+        path.with_suffix('.lock').unlink(missing_ok=True)
+        lock.close()
+
+    def _save(self, pooled: PooledSession, cookies: frozenset) -> None:
+        path = self._path(pooled)
+        if path is None:
+            return
+        data = {
+            'origin': pooled.origin,
+            'proxy': pooled.proxy_name,
+            'headers': dict(pooled.session.headers),
+            'created_at': pooled.created_at,
+            'requests': pooled.request_count,
+            'captchas': pooled.captchas,
+            'cookies': [
+                {
+                    'name': cookie.name,
+                    'value': cookie.value,
+                    'domain': cookie.domain,
+                    'path': cookie.path,
+                    'expires': cookie.expires,
+                    'secure': cookie.secure,
+                }
+                for cookie in pooled.session.cookies
+            ],
+        }
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # The jar of a new session is locked before it is written, so no other process restores it
+            if pooled._jar_lock is None:
+                pooled._jar_lock = self._lock_jar(path)
+                if pooled._jar_lock is None:
+                    return
+            temporary = path.with_suffix(f'.{os.getpid()}.tmp')
+            temporary.write_text(json.dumps(data))
+            os.replace(temporary, path)
+            pooled._saved_cookies = cookies
+        except OSError as e:
+            logger.warning(f"Failed to save session {pooled.id}: {e}")
+
+    def _load(self, origin: str) -> None:
+        """Restore the saved sessions of the origin, once, before any new session is created for it."""
+        with self._load_lock:
+            if origin in self._loaded:
+                return
+            try:
+                self._restore(origin)
+            finally:
+                self._loaded.add(origin)
+
+    def _restore(self, origin: str) -> None:
+        """Restore the saved sessions of the origin whose proxy is still configured and no other process uses."""
+        directory = self._directory(origin)
+        if directory is None or not directory.is_dir():
+            return
+        manager = get_proxy_manager()
+        proxies = {health.name: health for health in manager.health}
+        restored = []
+        for path in directory.glob('*.json'):
+            jar_lock = self._lock_jar(path)
+            if jar_lock is None:
+                continue
+            try:
+                data = json.loads(path.read_text())
+            except FileNotFoundError:
+                # Retired by the process that held it until now
+                self._unlock_jar(jar_lock, path)
+                continue
+            except (OSError, ValueError) as e:
+                logger.warning(f"Dropping unreadable session {path}: {e}")
+                path.unlink(missing_ok=True)
+                self._unlock_jar(jar_lock, path)
+                continue
+            # A session keeps its route, without it the cookies would come from another address
+            proxy = proxies.get(data['proxy']) if data['proxy'] else None
+            if (proxy is None) if data['proxy'] else bool(proxies):
+                path.unlink(missing_ok=True)
+                self._unlock_jar(jar_lock, path)
+                continue
+            session = _new_http_session(proxy, data['headers'])
+            now = time.time()
+            for cookie in data['cookies']:
+                if cookie['expires'] is not None and cookie['expires'] <= now:
+                    continue
+                session.cookies.set(
+                    cookie['name'], cookie['value'],
+                    domain=cookie['domain'], path=cookie['path'], expires=cookie['expires'], secure=cookie['secure'],
+                )
+            pooled = PooledSession(
+                origin=origin,
+                session=session,
+                proxy=proxy,
+                id=path.stem,
+                created_at=data['created_at'],
+                request_count=data['requests'],
+                captchas=data['captchas'],
+                _jar_lock=jar_lock,
+            )
+            if reason := pooled.retire_reason():
+                self._retire(pooled, reason)
+                continue
+            pooled._saved_cookies = pooled.cookie_state()
+            restored.append(pooled)
+        if restored:
+            SESSION_EVENTS.inc(len(restored), event='restored', reason='', marketplace=marketplace_of(origin))
+            logger.info(f"Restored {len(restored)} sessions of {origin}")
+            # Sessions are handed out from the end, the oldest first as they retire first
+            restored.sort(key=lambda pooled: pooled.created_at, reverse=True)
+            with self._lock:
+                self._idle.setdefault(origin, [])[:0] = restored
+
+    def stats(self) -> dict[str, int]:
+        """Idle sessions per origin."""
+        with self._lock:
+            return {origin: len(idle) for origin, idle in self._idle.items()}
+
+
+_session_pool: SessionPool | None = None
+_session_pool_lock = threading.Lock()
+
+
+def get_session_pool() -> SessionPool:
+    """Return the process wide session pool, shared by all parsers."""
+    global _session_pool
+    with _session_pool_lock:
+        if _session_pool is None:
+            _session_pool = SessionPool()
+        return _session_pool
@@ -0,0 +1,26 @@
+"""
+Invalidate the cached book pages when books, series or reviews change.
+
+Bulk writes send no signals, their callers invalidate the books themselves.
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import invalidate_books
+from .models import Book, BookSeries, Review
+
+
+@receiver([post_save, post_delete], sender=Book, dispatch_uid='core.book_changed')
+def book_changed(sender, instance: Book, **kwargs):
+    invalidate_books([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=BookSeries, dispatch_uid='core.series_changed')
+def series_changed(sender, instance: BookSeries, **kwargs):
+    # Only the book list and its series filter show series, no book's cached fragments
+    invalidate_books([])
+
+
+@receiver([post_save, post_delete], sender=Review, dispatch_uid='core.review_changed')
+def review_changed(sender, instance: Review, **kwargs):
+    invalidate_books([instance.book_id])
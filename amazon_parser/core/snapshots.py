@@ -0,0 +1,267 @@
+"""
+Content-addressed archive of fetched product pages.
+
+Page bodies are compressed and stored once per sha256 content hash under
+objects/<first two hash chars>/<hash><ext>. Every fetch adds a small
+PageSnapshot index row (ASIN, book, fetched_at, hash, sizes), so the latest
+or any past page of a book is a single index lookup away.
+
+A blob is written before its index row, compact() leaves blobs written or
+reused within BLOB_GRACE alone, so it never removes the blob of a snapshot
+whose row is still to be added. Pages archived in the background are
+written by one thread that adds the index rows of everything queued
+meanwhile with a single bulk insert.
+"""
+from datetime import datetime, timedelta
+import gzip
+import hashlib
+import logging
+import os
+from pathlib import Path
+import queue
+import tempfile
+import threading
+import time
+from typing import Final, Iterator
+
+from django import db
+from django.conf import settings
+from django.utils import timezone
+
+from .marketplaces import extract_asin, marketplace_of
+from .metrics import SNAPSHOT_WRITE_SECONDS
+from .models import PageSnapshot
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, gzip is always available
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+BLOB_EXTENSIONS: Final[dict[str, str]] = {'zstd': '.html.zst', 'gzip': '.html.gz'}
+BLOB_GRACE: Final = timedelta(minutes=10)
+
+_writer: threading.Thread | None = None
+# Pages waiting for the writer, archive_async() blocks while PARSER_SNAPSHOT_WRITE_QUEUE pages wait
+_queued: queue.Queue | None = None
+_writer_lock = threading.Lock()
+
+
+def _compress(content: bytes, compression: str) -> bytes:
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=10).compress(content)
+    return gzip.compress(content, compresslevel=6)
+
+
+def _decompress(data: bytes, compression: str) -> bytes:
+    if compression == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def _get_queue() -> queue.Queue:
+    global _writer, _queued
+    with _writer_lock:
+        if _writer is None:
+            _queued = queue.Queue(maxsize=settings.PARSER_SNAPSHOT_WRITE_QUEUE)
+            _writer = threading.Thread(target=_write_queued, args=(_queued,), name='snapshots', daemon=True)
+            _writer.start()
+        return _queued
+
+
+def _write_queued(queued: queue.Queue) -> None:
+    while True:
+        batch = [queued.get()]
+        # Pages queued while the previous batch was written go into the same insert
+        while len(batch) < queued.maxsize:
+            try:
+                batch.append(queued.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            _write_batch(batch)
+        finally:
+            for _ in batch:
+                queued.task_done()
+            db.close_old_connections()
+
+
+def _write_batch(batch: list[tuple['SnapshotStore', str, bytes, int | None, datetime]]) -> None:
+    snapshots = []
+    for store, url, content, book_id, fetched_at in batch:
+        try:
+            snapshots.append(store.store_page(url, content, book_id=book_id, fetched_at=fetched_at))
+        except Exception as e:
+            logger.error(f"Failed to archive snapshot of {url}", exc_info=e)
+    try:
+        PageSnapshot.objects.bulk_create(snapshots)
+    except Exception as e:
+        # The blobs are left to compact(), no index row refers to them
+        logger.error(f"Failed to add {len(snapshots)} snapshot index rows", exc_info=e)
+
+
+def wait_for_writer() -> None:
+    """Block until every page queued by archive_async() is archived."""
+    with _writer_lock:
+        queued = _queued
+    if queued is not None:
+        queued.join()
+
+
+class SnapshotStore:
+    """Compressed page store with deduplication by content hash."""
+
+    def __init__(self, root: Path | None = None, compression: str | None = None):
+        self.root = Path(root or settings.PARSER_SNAPSHOT_DIR)
+        compression = compression or settings.PARSER_SNAPSHOT_COMPRESSION
+        if compression == 'zstd' and zstandard is None:
+            logger.warning("zstandard is not installed, see the zstd extra, snapshots are compressed with gzip")
+            compression = 'gzip'
+        self.compression = compression
+
+    def blob_path(self, content_hash: str, compression: str | None = None) -> Path:
+        extension = BLOB_EXTENSIONS[compression or self.compression]
+        return self.root / 'objects' / content_hash[:2] / f'{content_hash}{extension}'
+
+    def _existing_blob(self, content_hash: str) -> tuple[Path, str] | None:
+        """Find the blob of the hash whatever compression it was written with."""
+        for compression in BLOB_EXTENSIONS:
+            path = self.blob_path(content_hash, compression)
+            if path.exists():
+                return path, compression
+        return None
+
+    def put_blob(self, content: bytes) -> tuple[str, int]:
+        """
+        Store the page body unless an identical one is already stored.
+
+        Returns:
+            tuple: content hash and stored (compressed) size
+        """
+        content_hash = hashlib.sha256(content).hexdigest()
+        existing = self._existing_blob(content_hash)
+        if existing:
+            try:
+                # A reused blob is new again for compact(), its new index row is not added yet
+                os.utime(existing[0])
+                return content_hash, existing[0].stat().st_size
+            except FileNotFoundError:
+                pass  # removed by compact() meanwhile, it is written again
+
+        path = self.blob_path(content_hash)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = _compress(content, self.compression)
+        # Write to a temporary file first so readers never see a partial blob
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return content_hash, len(data)
+
+    def read(self, content_hash: str) -> bytes:
+        """Return the decompressed page body of the hash."""
+        existing = self._existing_blob(content_hash)
+        if not existing:
+            raise FileNotFoundError(f"No snapshot blob for {content_hash}")
+        path, compression = existing
+        return _decompress(path.read_bytes(), compression)
+
+    def store_page(self, url: str, content: bytes, book_id: int | None = None, fetched_at: datetime | None = None) -> PageSnapshot:
+        """Store the page and return its index entry, which is not saved yet."""
+        with SNAPSHOT_WRITE_SECONDS.time(marketplace=marketplace_of(url)):
+            content_hash, stored_size = self.put_blob(content)
+        return PageSnapshot(
+            book_id=book_id,
+            asin=extract_asin(url) or '',
+            fetched_at=fetched_at or timezone.now(),
+            content_hash=content_hash,
+            size=len(content),
+            stored_size=stored_size,
+        )
+
+    def archive(self, url: str, content: bytes, book_id: int | None = None, fetched_at: datetime | None = None) -> PageSnapshot:
+        """Store the page and add its index entry."""
+        snapshot = self.store_page(url, content, book_id=book_id, fetched_at=fetched_at)
+        snapshot.save()
+        return snapshot
+
+    def archive_async(self, url: str, content: bytes, book_id: int | None = None) -> None:
+        """
+        Archive the page in a background thread, off the parse path.
+
+        Blocks while PARSER_SNAPSHOT_WRITE_QUEUE pages wait for the writer, so
+        a slow disk slows fetching down instead of piling page bodies up in memory.
+        """
+        _get_queue().put((self, url, content, book_id, timezone.now()))
+
+    def latest(self, asin: str | None = None, book_id: int | None = None) -> PageSnapshot | None:
+        """Return the most recent snapshot of a book or ASIN."""
+        snapshots = PageSnapshot.objects.all()
+        if book_id is not None:
+            snapshots = snapshots.filter(book_id=book_id)
+        if asin is not None:
+            snapshots = snapshots.filter(asin=asin)
+        return snapshots.order_by('-fetched_at').first()
+
+    def compact(self, keep_last: int | None = None, max_age_days: int | None = None) -> tuple[int, int]:
+        """
+        Apply the retention policy and remove blobs no snapshot refers to.
+
+        The newest keep_last snapshots of every ASIN are always kept, older ones
+        are removed once they are older than max_age_days. Blobs written or
+        reused within BLOB_GRACE before the sweep are kept, archiving may still
+        be about to add their index rows.
+
+        Returns:
+            tuple: number of removed index entries and removed blobs
+        """
+        keep_last = keep_last if keep_last is not None else settings.PARSER_SNAPSHOT_KEEP_LAST
+        max_age_days = max_age_days if max_age_days is not None else settings.PARSER_SNAPSHOT_MAX_AGE_DAYS
+        cutoff = timezone.now() - timedelta(days=max_age_days)
+
+        expired_ids = []
+        current_asin, seen = None, 0
+        rows = PageSnapshot.objects.order_by('asin', '-fetched_at').values_list('id', 'asin', 'fetched_at')
+        for snapshot_id, asin, fetched_at in rows.iterator(chunk_size=2000):
+            if asin != current_asin:
+                current_asin, seen = asin, 0
+            seen += 1
+            if seen > keep_last and fetched_at < cutoff:
+                expired_ids.append(snapshot_id)
+
+        for start in range(0, len(expired_ids), 500):
+            PageSnapshot.objects.filter(id__in=expired_ids[start:start + 500]).delete()
+
+        # Taken before the referenced hashes are read, a blob touched later is kept
+        recent = time.time() - BLOB_GRACE.total_seconds()
+        referenced = set(PageSnapshot.objects.values_list('content_hash', flat=True).distinct().iterator())
+        removed_blobs = 0
+        for path in self._iter_blobs():
+            if path.name.split('.', 1)[0] in referenced:
+                continue
+            try:
+                if path.stat().st_mtime >= recent:
+                    continue
+            except FileNotFoundError:
+                continue
+            path.unlink(missing_ok=True)
+            removed_blobs += 1
+        logger.info(f"Snapshot compaction removed {len(expired_ids)} index entries and {removed_blobs} blobs")
+        return len(expired_ids), removed_blobs
+
+    def _iter_blobs(self) -> Iterator[Path]:
+        objects_dir = self.root / 'objects'
+        if not objects_dir.exists():
+            return
+        for prefix_dir in objects_dir.iterdir():
+            if prefix_dir.is_dir():
+                # Skip blobs that are still being written
+                yield from (path for path in prefix_dir.iterdir() if path.suffix != '.tmp')
+
+
+def default_store() -> SnapshotStore | None:
+    """Return the configured store, or None when archiving is disabled."""
+    if not settings.PARSER_SNAPSHOTS_ENABLED:
+        return None
+    return SnapshotStore()
@@ -0,0 +1,222 @@
+"""
+Local stand-in for Amazon product pages.
+
+Serves the benchmark corpus at /dp/<ASIN> with configurable latency,
+injected 503 throttling and captcha pages, and a per-client rate limit, so
+crawl concurrency, proxy handling and retries can be tuned offline and
+reproducibly instead of against the real site.
+"""
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import math
+import random
+import re
+import threading
+import time
+import zlib
+
+from .benchmarks import load_corpus
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_PATH_RE = re.compile(r'^/dp/([A-Z0-9]{10})/?(?:\?.*)?$')
+CAPTCHA_PAGE = 'captcha.html'
+
+
+@dataclass
+class StorefrontConfig:
+    latency: float = 0.2
+    # Latency is drawn uniformly from latency * (1 - jitter) to latency * (1 + jitter)
+    latency_jitter: float = 0.5
+    error_rate: float = 0.0
+    captcha_rate: float = 0.0
+    # Requests per second allowed per client address, bursts up to rate_burst; 0 disables the limit
+    rate_limit: float = 0.0
+    rate_burst: int = 10
+    retry_after: int = 1
+    seed: int | None = None
+
+
+@dataclass
+class StorefrontStats:
+    requests: int = 0
+    pages: int = 0
+    errors: int = 0
+    captchas: int = 0
+    rate_limited: int = 0
+    not_found: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def count(self, outcome: str) -> None:
+        with self._lock:
+            self.requests += 1
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                'requests': self.requests, 'pages': self.pages, 'errors': self.errors,
+                'captchas': self.captchas, 'rate_limited': self.rate_limited, 'not_found': self.not_found,
+            }
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Crawlers open many connections at once, the default backlog of 5 would refuse them
+    request_queue_size = 256
+
+
+class _TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+
+    def take(self) -> float:
+        """Take a token, return 0 or the seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class FakeStorefront:
+    """Threaded HTTP server answering like a product page server under load."""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, config: StorefrontConfig | None = None):
+        """
+        Args:
+            host: Address to listen on
+            port: Port to listen on, 0 picks a free one
+            config: Latency, failure injection and rate limit settings
+        """
+        self.config = config or StorefrontConfig()
+        self.stats = StorefrontStats()
+        corpus = load_corpus()
+        self.pages = [page.content for page in corpus if page.name != CAPTCHA_PAGE]
+        self.captcha_page = next(page.content for page in corpus if page.name == CAPTCHA_PAGE)
+        self._random = random.Random(self.config.seed)
+        self._random_lock = threading.Lock()
+        self._buckets: dict[str, _TokenBucket] = {}
+        self._buckets_lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self.server = _Server((host, port), self._handler_class())
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def product_url(self, asin: str) -> str:
+        return f'{self.base_url}/dp/{asin}'
+
+    def page_for(self, asin: str) -> bytes:
+        """The same ASIN always gets the same corpus page."""
+        return self.pages[zlib.crc32(asin.encode()) % len(self.pages)]
+
+    def _roll(self, rate: float) -> bool:
+        with self._random_lock:
+            return self._random.random() < rate
+
+    def _latency(self) -> float:
+        config = self.config
+        with self._random_lock:
+            return config.latency * self._random.uniform(1 - config.latency_jitter, 1 + config.latency_jitter)
+
+    def _throttle_delay(self, client: str) -> float:
+        if not self.config.rate_limit:
+            return 0.0
+        with self._buckets_lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = _TokenBucket(self.config.rate_limit, self.config.rate_burst)
+            return bucket.take()
+
+    def _handler_class(self):
+        storefront = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _send(self, status: int, body: bytes = b'', headers: dict | None = None) -> None:
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                match = PRODUCT_PATH_RE.match(self.path)
+                if not match:
+                    storefront.stats.count('not_found')
+                    self._send(404)
+                    return
+                delay = storefront._throttle_delay(self.client_address[0])
+                if delay:
+                    storefront.stats.count('rate_limited')
+                    self._send(503, headers={'Retry-After': str(math.ceil(delay))})
+                    return
+                time.sleep(storefront._latency())
+                if storefront._roll(storefront.config.error_rate):
+                    storefront.stats.count('errors')
+                    self._send(503, headers={'Retry-After': str(storefront.config.retry_after)})
+                elif storefront._roll(storefront.config.captcha_rate):
+                    storefront.stats.count('captchas')
+                    self._send(200, storefront.captcha_page)
+                else:
+                    storefront.stats.count('pages')
+                    self._send(200, storefront.page_for(match.group(1)))
+
+            def log_message(self, format, *args):
+                logger.debug(f"{self.address_string()} {format % args}")
+
+        return Handler
+
+    def start(self) -> 'FakeStorefront':
+        """Serve in a background thread."""
+        self._thread = threading.Thread(target=self.server.serve_forever, name='storefront', daemon=True)
+        self._thread.start()
+        logger.info(f"Fake storefront listening on {self.base_url}")
+        return self
+
+    def serve_forever(self) -> None:
+        logger.info(f"Fake storefront listening on {self.base_url}")
+        self.server.serve_forever()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread:
+            self._thread.join()
+
+
+def add_storefront_arguments(parser) -> None:
+    """Add the StorefrontConfig options to a management command parser."""
+    parser.add_argument('--latency', type=float, default=0.2, help='Mean seconds before a page is answered')
+    parser.add_argument('--latency-jitter', type=float, default=0.5, help='Latency spread as a fraction of the mean')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 503')
+    parser.add_argument('--captcha-rate', type=float, default=0.0, help='Fraction of requests answered with a captcha page')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='Requests per second per client, 0 for no limit')
+    parser.add_argument('--rate-burst', type=int, default=10, help='Requests a client may burst over the rate limit')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds of injected 503 responses')
+    parser.add_argument('--seed', type=int, help='Random seed, makes injected failures reproducible')
+
+
+def storefront_config(options: dict) -> StorefrontConfig:
+    return StorefrontConfig(
+        latency=options['latency'],
+        latency_jitter=options['latency_jitter'],
+        error_rate=options['error_rate'],
+        captcha_rate=options['captcha_rate'],
+        rate_limit=options['rate_limit'],
+        rate_burst=options['rate_burst'],
+        retry_after=options['retry_after'],
+        seed=options['seed'],
+    )
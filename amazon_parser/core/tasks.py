@@ -1,52 +1,201 @@
 """
 Tasks for asynchronous processing of book parsing
 """
+import asyncio
+from dataclasses import dataclass, field
 from datetime import datetime
 import logging
 
-from .cache_utils import set_parsing_status
-from .models import Book
-from .utils import AmazonKDPParser
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .fingerprints import page_fingerprint, result_fingerprint
+from .history import record_history
+from .jobs import ACTIVE_STATUSES, active_job, enqueue_books
+from .marketplaces import marketplace_of
+from .metrics import DB_SAVE_SECONDS, DB_SAVED_BOOKS, PARSE_RESULTS
+from .models import Book, CrawlTask, JobKind, Status
+from .scheduler import compute_next_parse_at, fetch_retry_delay
+from .utils import AmazonKDPParser, FetchError, RetryableFetchError
 
 logger = logging.getLogger(__name__)
 
-def parse_single_book(book_id):
+@dataclass
+class ParseOutcome:
+    success: bool
+    changed: set[str] = field(default_factory=set)
+    # Set for transient failures, e.g. throttling: when the parse should be tried again
+    retry_at: datetime | None = None
+    error: str = ''
+    # The parse gave the stored result again, only the parse bookkeeping changed and no history is due
+    unchanged: bool = False
+
+def _set_if_changed(book, changed, field, value):
+    if getattr(book, field) != value:
+        setattr(book, field, value)
+        changed.add(field)
+
+def _apply_failure(book, error):
+    now = timezone.now()
+    changed = set()
+    retry_at = None
+    _set_if_changed(book, changed, 'parse_status', Status.ERROR)
+    _set_if_changed(book, changed, 'parse_failures', book.parse_failures + 1)
+    _set_if_changed(book, changed, 'last_error', str(error))
+    next_parse_at = compute_next_parse_at(book, now)
+    if isinstance(error, RetryableFetchError):
+        retry_at = now + fetch_retry_delay(book.parse_failures, error.retry_after)
+        next_parse_at = max(next_parse_at, retry_at)
+        logger.warning(f"Fetching book {book.id} failed ({error}), retrying at {retry_at:%H:%M:%S}")
+    elif isinstance(error, FetchError):
+        logger.error(f"Fetching book {book.id} failed: {error}")
+    else:
+        logger.error(f"Error parsing book {book.id}", exc_info=error)
+    _set_if_changed(book, changed, 'next_parse_at', next_parse_at)
+    return ParseOutcome(success=False, changed=changed, retry_at=retry_at, error=str(error))
+
+def _apply_parsed(book, changed):
+    _set_if_changed(book, changed, 'parse_status', Status.COMPLETED)
+    _set_if_changed(book, changed, 'parsed_at', timezone.now())
+    _set_if_changed(book, changed, 'parse_failures', 0)
+    _set_if_changed(book, changed, 'last_error', '')
+    _set_if_changed(book, changed, 'next_parse_at', compute_next_parse_at(book))
+
+def _apply_unchanged(book, page_hash, outcome):
+    changed = set()
+    _set_if_changed(book, changed, 'page_fingerprint', page_hash or '')
+    _apply_parsed(book, changed)
+    PARSE_RESULTS.inc(outcome=outcome, marketplace=marketplace_of(book.url))
+    return ParseOutcome(success=True, changed=changed, unchanged=True)
+
+def _apply_result(book, parsed_data, page_hash=None):
+    fingerprint = result_fingerprint(parsed_data)
+    if fingerprint == book.result_fingerprint:
+        return _apply_unchanged(book, page_hash, 'unchanged')
+    changed = set()
+    _set_if_changed(book, changed, 'rating', parsed_data.rating)
+    _set_if_changed(book, changed, 'reviews_count', parsed_data.reviews_count)
+    _set_if_changed(book, changed, 'best_seller_ranks', parsed_data.best_sellers_ranks)
+    _set_if_changed(book, changed, 'popular_reviews', parsed_data.reviews)
+    _set_if_changed(book, changed, 'popular_reviews_count', len(parsed_data.reviews or []))
+    _set_if_changed(book, changed, 'result_fingerprint', fingerprint)
+    _set_if_changed(book, changed, 'page_fingerprint', page_hash or '')
+    _apply_parsed(book, changed)
+    PARSE_RESULTS.inc(outcome='changed', marketplace=marketplace_of(book.url))
+    return ParseOutcome(success=True, changed=changed)
+
+def _page_hash(page):
+    """Fingerprint of the page regions, None when page fingerprints are off or the regions are unknown."""
+    if not settings.PARSER_PAGE_FINGERPRINTS:
+        return None
+    return page_fingerprint(page)
+
+def _page_unchanged(book, page_hash):
+    # The stored result was extracted from the same regions with the same rules, extracting again gives it back
+    return page_hash is not None and page_hash == book.page_fingerprint and bool(book.result_fingerprint)
+
+def parse_book(book, parser):
     """
-    Parse a single book by its ID
-    
+    Parse a book into its instance without saving it
+
     Args:
-        book_id (int): The ID of the book to parse
+        book (Book): The book to parse
+        parser (AmazonKDPParser): Parser whose session is reused across books
+
+    Returns:
+        ParseOutcome: whether parsing succeeded, the fields that changed and when to retry a transient failure
     """
-    book = Book.objects.get(id=book_id)
+    try:
+        page = parser.fetch_book_page(book.url, book_id=book.id)
+        page_hash = _page_hash(page)
+        if _page_unchanged(book, page_hash):
+            return _apply_unchanged(book, page_hash, 'page_unchanged')
+        parsed_data = parser.parse_page(page)
+    except Exception as e:
+        return _apply_failure(book, e)
+    return _apply_result(book, parsed_data, page_hash)
+
+async def parse_book_async(book, parser):
+    """
+    Parse a book into its instance without saving it, without blocking the event loop
+
+    Args:
+        book (Book): The book to parse
+        parser (AsyncAmazonKDPParser): Parser shared by all books of the event loop
 
+    Returns:
+        ParseOutcome: whether parsing succeeded, the fields that changed and when to retry a transient failure
+    """
     try:
-        # Call your parsing function
-        parser = AmazonKDPParser()
-        parsed_data = parser.parse_amazon_book(book.url)
-        book.rating = parsed_data.rating
-        book.reviews_count = parsed_data.reviews_count
-        book.best_seller_ranks = parsed_data.best_sellers_ranks
-        book.popular_reviews = parsed_data.reviews
-        book.parse_status = 'completed'
-        book.parsed_at = datetime.now()
-        book.save()
-        return True
+        page = await parser.fetch_book_page(book.url, book_id=book.id)
+        # Hashing a page body takes milliseconds, it runs with the parsing threads instead of on the event loop
+        page_hash = await asyncio.get_running_loop().run_in_executor(parser.executor, _page_hash, page)
+        if _page_unchanged(book, page_hash):
+            return _apply_unchanged(book, page_hash, 'page_unchanged')
+        parsed_data = await parser.parse_page(page)
     except Exception as e:
-        logger.error(f"Error parsing book {book_id}", exc_info=e)
-        book.parse_status = 'error'
-        book.save()
-        return False
+        return _apply_failure(book, e)
+    return _apply_result(book, parsed_data, page_hash)
+
+def parse_single_book(book_id, rate_limiter=None, parser=None):
+    """
+    Parse a single book by its ID and save the changed fields
+    
+    Args:
+        book_id (int): The ID of the book to parse
+        rate_limiter (HostRateLimiter, optional): Per-host limiter shared by a bulk crawl
+        parser (AmazonKDPParser, optional): Warm parser to reuse, a new one by default
+    """
+    book = Book.objects.get(id=book_id)
+    parser = parser or AmazonKDPParser(rate_limiter=rate_limiter)
+    outcome = parse_book(book, parser)
+    with DB_SAVE_SECONDS.time(operation='single'), transaction.atomic():
+        if outcome.changed:
+            book.save(update_fields=outcome.changed)
+            DB_SAVED_BOOKS.inc(operation='single')
+        if outcome.success and not outcome.unchanged:
+            record_history([book])
+    return outcome.success
 
 def parse_all_books():
     """
-    Parse all books in separate process
+    Queue a parse of all books for the crawl workers, unless one is already queued or running
+
+    The check and the job are one transaction, and the one_active_all_books_job
+    constraint rejects the job of a concurrent request that passed the check too.
+
+    Returns:
+        tuple: The job whose progress can be followed and whether it was queued now
     """
     try:
-        from django import db
-        db.connection.close()
-        set_parsing_status(True)
-        books = Book.objects.all()
-        for book in books:
-            parse_single_book(book.id)
-    finally:
-        set_parsing_status(False)
+        with transaction.atomic():
+            job = active_job(JobKind.ALL_BOOKS)
+            if job is not None:
+                return job, False
+            book_ids = Book.objects.order_by('id').values_list('id', flat=True).iterator(chunk_size=2000)
+            return enqueue_books(book_ids, kind=JobKind.ALL_BOOKS), True
+    except IntegrityError:
+        return active_job(JobKind.ALL_BOOKS), False
+
+def queue_single_book(book_id):
+    """
+    Queue a parse of a single book ahead of bulk crawls, for the crawl workers
+
+    A book that is already queued or being parsed on request is not queued again.
+
+    Args:
+        book_id (int): The ID of the book to parse
+
+    Returns:
+        CrawlTask: The task whose status can be followed
+    """
+    task = single_book_task(book_id)
+    if task is not None and task.status in ACTIVE_STATUSES:
+        return task
+    job = enqueue_books([book_id], kind=JobKind.SINGLE, priority=settings.PARSER_SINGLE_PARSE_PRIORITY)
+    return job.tasks.get()
+
+def single_book_task(book_id):
+    """Return the latest requested parse of the book, None if it was never requested."""
+    return CrawlTask.objects.filter(book_id=book_id, job__kind=JobKind.SINGLE).order_by('-id').first()
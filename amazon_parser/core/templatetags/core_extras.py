@@ -12,3 +12,13 @@ def pprint(value):
         return mark_safe(formatted_json)
     except:
         return value
+
+@register.filter
+def duration(value):
+    """Formats a timedelta as hours and minutes"""
+    try:
+        minutes = int(value.total_seconds() // 60)
+    except AttributeError:
+        return value
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}h {minutes:02d}m' if hours else f'{minutes}m'
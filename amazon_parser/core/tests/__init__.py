@@ -0,0 +1,16 @@
+"""Shared helpers of the core test modules."""
+from django.test import override_settings
+
+from ..models import Book
+
+# Tests never write to the configured cache, e.g. the file based one under data/. Enabled on import,
+# which the test runner does before it migrates the test database, whose data migrations send signals
+_isolated_cache = override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+_isolated_cache.enable()
+
+
+def create_books(count: int, **fields) -> list[Book]:
+    return [
+        Book.objects.create(name=f'Book {i}', url=f'https://www.amazon.com/dp/B{i:09d}', language='en', **fields)
+        for i in range(count)
+    ]
@@ -0,0 +1,59 @@
+from unittest import mock
+
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+
+from ..crawler import BookResultWriter, crawl_books
+from ..models import Book, BookMetricsHistory
+from ..tasks import ParseOutcome
+from . import create_books
+
+
+class BookResultWriterTests(TransactionTestCase):
+    def setUp(self):
+        [self.book] = create_books(1)
+
+    def test_failed_flush_keeps_batch(self):
+        writer = BookResultWriter(batch_size=100, flush_interval=3600)
+        self.book.rating, self.book.parsed_at = 4.5, timezone.now()
+        writer.add(self.book, {'rating', 'parsed_at'}, True)
+        with mock.patch('core.crawler.record_history', side_effect=RuntimeError('database is locked')):
+            with self.assertRaises(RuntimeError):
+                writer.flush()
+        self.assertIsNone(Book.objects.get(pk=self.book.pk).rating)
+        writer.close()
+        self.assertEqual(Book.objects.get(pk=self.book.pk).rating, 4.5)
+        self.assertEqual(BookMetricsHistory.objects.filter(book=self.book).count(), 1)
+
+    @override_settings(PARSER_WRITE_CLOSE_RETRIES=2)
+    def test_close_retries_failed_flush(self):
+        writer = BookResultWriter(batch_size=100, flush_interval=60)
+        self.book.rating, self.book.parsed_at = 4.5, timezone.now()
+        writer.add(self.book, {'rating', 'parsed_at'}, True)
+        with mock.patch('core.crawler.record_history', side_effect=[RuntimeError('database is locked')] * 2 + [None]), \
+                mock.patch('core.crawler.time.sleep') as sleep, self.assertLogs('core.crawler', level='WARNING'):
+            writer.close()
+        self.assertEqual([call.args for call in sleep.call_args_list], [(60,), (120,)])
+        self.assertEqual(Book.objects.get(pk=self.book.pk).rating, 4.5)
+
+
+class CrawlBooksTests(TransactionTestCase):
+    def test_results_are_written_while_the_crawl_reads_books(self):
+        books = create_books(60)
+        written_during_crawl = []
+
+        def parse_book(book, parser):
+            # Results of earlier books have to reach the database before the last book is read
+            written_during_crawl.append(Book.objects.filter(parsed_at__isnull=False).count())
+            book.rating, book.parsed_at = 4.0, timezone.now()
+            return ParseOutcome(success=True, changed={'rating', 'parsed_at'})
+
+        with mock.patch('core.tasks.parse_book', parse_book), \
+                override_settings(PARSER_WRITE_BATCH_SIZE=5, PARSER_WRITE_FLUSH_INTERVAL=0.05), \
+                self.assertNoLogs('core.crawler', level='ERROR'):
+            stats = crawl_books(Book.objects.order_by('id'), workers=2, chunk_size=10)
+
+        self.assertEqual((stats.total, stats.failed), (len(books), 0))
+        self.assertEqual(Book.objects.filter(rating=4.0).count(), len(books))
+        self.assertEqual(BookMetricsHistory.objects.count(), len(books))
+        self.assertGreater(max(written_during_crawl), 0)
@@ -0,0 +1,34 @@
+import csv
+import io
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from ..exports import dataset_rows
+from ..models import Book
+from . import create_books
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.books = create_books(7)
+        for book, rating in zip(self.books, [4.0, None, 3.5, 4.0, None, 5.0, 3.5]):
+            book.rating = rating
+            book.save(update_fields=['rating'])
+
+    @override_settings(PARSER_EXPORT_CHUNK_SIZE=2)
+    def test_rows_keep_queryset_order_across_chunks(self):
+        books = Book.objects.order_by('-rating', 'id')
+        rows = list(dataset_rows('books', books))
+        self.assertEqual([row[0] for row in rows], list(books.values_list('id', flat=True)))
+
+    @override_settings(PARSER_EXPORT_CHUNK_SIZE=3)
+    def test_csv_export(self):
+        response = self.client.get(reverse('export_books'), {'dataset': 'books', 'format': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([int(row['id']) for row in rows], [book.id for book in self.books])
+
+    def test_invalid_filter_is_rejected(self):
+        response = self.client.get(reverse('export_books'), {'date_from': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,93 @@
+import json
+from pathlib import Path
+import tempfile
+
+from bs4 import BeautifulSoup
+from django.test import SimpleTestCase, override_settings
+
+from ..benchmarks import extract, load_corpus
+from ..extraction import InvalidRules, NumberFormat, compile_selector, load_rules, rule_files
+from ..utils import AmazonKDPParser, FetchedPage
+
+
+class ExtractionRulesTests(SimpleTestCase):
+    def test_corpus_pages_match_manifest(self):
+        parser = AmazonKDPParser(snapshot_store=False)
+        for partial in (True, False):
+            with override_settings(PARSER_PARTIAL_PARSING=partial):
+                for page in load_corpus():
+                    with self.subTest(page=page.name, partial=partial):
+                        self.assertEqual(extract(parser, page), page.expected)
+
+    def test_marketplace_pages_get_their_number_format(self):
+        pages = {page.name: page for page in load_corpus()}
+        parser = AmazonKDPParser(snapshot_store=False)
+        self.assertEqual(extract(parser, pages['de_full.html'])['reviews_count'], 2871)
+        self.assertEqual(extract(parser, pages['fr_full.html'])['rating'], 4.2)
+
+    def test_page_language_picks_the_number_format(self):
+        # German marketplace, but requested with language=en_GB: the ranks are English formatted
+        page = {page.name: page for page in load_corpus()}['de_english.html']
+        self.assertEqual(FetchedPage(url=page.url, content=page.content).language, 'en')
+        result = extract(AmazonKDPParser(snapshot_store=False), page)
+        self.assertEqual([rank['place'] for rank in result['best_sellers_ranks']], ['12345', '45', '1203'])
+        self.assertEqual(FetchedPage(url=page.url, content=b'<html><body></body></html>').language, '')
+
+    def test_selector_combinators(self):
+        soup = BeautifulSoup(
+            '<div id="a" class="x y"><p>1</p><span class="s">2</span><ul><li><b data-v="k">3</b></li></ul></div>'
+            '<span class="s">4</span>',
+            'html.parser',
+        )
+
+        def select(selector):
+            return [
+                element.get_text() for element in soup.find_all(True)
+                if any(compiled.matches(element) for compiled in compile_selector(selector))
+            ]
+
+        self.assertEqual(select('div#a.x > span.s'), ['2'])
+        self.assertEqual(select('div li b[data-v=k]'), ['3'])
+        self.assertEqual(select('p + span'), ['2'])
+        self.assertEqual(select('div ~ span.s'), ['4'])
+        self.assertEqual(select('p, ul b'), ['1', '3'])
+
+    def test_invalid_selector(self):
+        with self.assertRaises(InvalidRules):
+            compile_selector('div > :hover')
+
+    def test_number_format(self):
+        numbers = NumberFormat(decimal=',', thousands='.')
+        self.assertEqual(numbers.number('4,6'), 4.6)
+        self.assertEqual(numbers.integer('2.871 Sternebewertungen'), 2871)
+        self.assertEqual(
+            NumberFormat().rank('#12,345 in Books, Kids'), {'place': '12345', 'rank_name': 'in Books, Kids'},
+        )
+
+    def _write_rules(self, directory: str, **files) -> dict[str, Path]:
+        paths = {}
+        for name, content in files.items():
+            paths[name] = Path(directory) / f'{name}.json'
+            paths[name].write_text(json.dumps(content))
+        return paths
+
+    def test_invalid_rule_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with self.assertRaises(InvalidRules):
+                load_rules(self._write_rules(directory, de={'fields': {}}))
+            with self.assertRaises(InvalidRules):
+                load_rules(self._write_rules(directory, default={}, de={'extends': 'fr'}, fr={'extends': 'de'}))
+            with self.assertRaises(InvalidRules):
+                load_rules(self._write_rules(directory, default={'fields': {'rating': [{'type': 'float'}]}}))
+
+    def test_extends_and_override_directory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self._write_rules(directory, de={'extends': 'default', 'numbers': {'decimal': ',', 'thousands': '.'}})
+            with override_settings(PARSER_EXTRACTION_RULES_DIRS=[directory]):
+                files = rule_files()
+            self.assertEqual(files['de'], Path(directory) / 'de.json')
+            rules = load_rules(files)
+        soup = BeautifulSoup(load_corpus()[0].content, 'lxml')
+        self.assertEqual(rules['de'].numbers, NumberFormat(decimal=',', thousands='.'))
+        self.assertEqual(rules['de'].rules.extract(soup, rules['de'].numbers, 'de').keys(),
+                         rules['default'].rules.extract(soup, rules['default'].numbers, 'default').keys())
@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import transaction
+from django.test import TestCase, override_settings
+
+from .. import history
+from ..models import BookMetricsHistory, BookRankHistory, RankCategory, Resolution
+from . import create_books
+
+
+class HistoryTests(TestCase):
+    def setUp(self):
+        history._category_ids.clear()
+        [self.book] = create_books(1)
+
+    def tearDown(self):
+        history._category_ids.clear()
+
+    def record(self, at: datetime, rating: float, reviews_count: int, place: int) -> None:
+        self.book.parsed_at = at
+        self.book.rating, self.book.reviews_count = rating, reviews_count
+        self.book.best_seller_ranks = [{'place': str(place), 'rank_name': 'in Kindle Store ('}]
+        history.record_history([self.book])
+
+    def test_rolled_back_categories_are_not_cached(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            history.category_ids(['Poetry'])
+            raise RuntimeError
+        self.assertNotIn('Poetry', history._category_ids)
+        self.assertFalse(RankCategory.objects.filter(name='Poetry').exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            ids = history.category_ids(['Poetry'])
+        self.assertEqual(history._category_ids, ids)
+        self.assertEqual(RankCategory.objects.get(name='Poetry').id, ids['Poetry'])
+
+    def test_rollup(self):
+        now = datetime(2026, 5, 10, 12, 30, tzinfo=dt_timezone.utc)
+        old = now - timedelta(days=3)
+        hour = old.replace(minute=0)
+        self.record(hour + timedelta(minutes=5), 4.0, 10, 100)
+        self.record(hour + timedelta(minutes=45), 5.0, 12, 300)
+        self.record(hour + timedelta(hours=1, minutes=5), 4.5, 14, 50)
+        self.record(now - timedelta(minutes=10), 4.8, 20, 10)
+
+        with override_settings(PARSER_HISTORY_RAW_RETENTION=timedelta(days=2),
+                               PARSER_HISTORY_HOURLY_RETENTION=timedelta(days=30)):
+            history.rollup_history(now)
+
+        metrics = list(BookMetricsHistory.objects.order_by('captured_at').values_list(
+            'resolution', 'captured_at', 'rating', 'reviews_count',
+        ))
+        self.assertEqual(metrics, [
+            (Resolution.HOUR, hour, 4.5, 12),
+            (Resolution.HOUR, hour + timedelta(hours=1), 4.5, 14),
+            (Resolution.RAW, now - timedelta(minutes=10), 4.8, 20),
+        ])
+        ranks = list(BookRankHistory.objects.order_by('captured_at').values_list('resolution', 'rank'))
+        self.assertEqual(ranks, [(Resolution.HOUR, 200), (Resolution.HOUR, 50), (Resolution.RAW, 10)])
+        self.assertEqual(RankCategory.objects.get().name, 'Kindle Store')
+
+        # Hourly points past their retention become daily ones
+        with override_settings(PARSER_HISTORY_RAW_RETENTION=timedelta(days=2),
+                               PARSER_HISTORY_HOURLY_RETENTION=timedelta(days=1)):
+            history.rollup_history(now)
+        daily = BookMetricsHistory.objects.get(resolution=Resolution.DAY)
+        self.assertEqual((daily.captured_at, daily.rating, daily.reviews_count), (hour.replace(hour=0), 4.5, 14))
+        self.assertEqual(BookRankHistory.objects.get(resolution=Resolution.DAY).rank, 125)
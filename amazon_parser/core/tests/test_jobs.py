@@ -0,0 +1,90 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from ..crawler import BookResultWriter
+from ..jobs import claim_tasks, complete_task, enqueue_books, renew_leases, requeue_stale_tasks
+from ..models import CrawlJob, CrawlTask, JobKind, TaskStatus
+from ..tasks import parse_all_books
+from . import create_books
+
+
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        self.books = create_books(5)
+        self.job = enqueue_books(book.id for book in self.books)
+
+    def test_two_claimers_get_disjoint_tasks(self):
+        first = claim_tasks('worker-a', 3)
+        second = claim_tasks('worker-b', 3)
+        self.assertEqual(len(first), 3)
+        self.assertEqual(len(second), 2)
+        self.assertFalse({task.id for task in first} & {task.id for task in second})
+        self.assertEqual(claim_tasks('worker-c', 3), [])
+        self.assertEqual(CrawlTask.objects.filter(status=TaskStatus.RUNNING).count(), 5)
+        self.assertEqual(len({task.claimed_by for task in first + second}), 2)
+
+    def test_expired_lease_is_requeued_and_claimed_again(self):
+        [stale] = claim_tasks('worker-a', 1)
+        self.assertEqual(requeue_stale_tasks(timedelta(minutes=15)), 0)
+        CrawlTask.objects.filter(pk=stale.pk).update(claimed_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(requeue_stale_tasks(timedelta(minutes=15)), 1)
+
+        reclaimed = claim_tasks('worker-b', 5)
+        self.assertIn(stale.id, {task.id for task in reclaimed})
+        task = next(task for task in reclaimed if task.id == stale.id)
+        self.assertEqual(task.attempts, 2)
+        # The first claim lost the task, its result must not overwrite the new claim
+        self.assertFalse(complete_task(stale, success=False, error='late'))
+        self.assertTrue(complete_task(task, success=True))
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.error), (TaskStatus.DONE, ''))
+
+    def test_renewed_lease_is_kept(self):
+        tasks = claim_tasks('worker-a', 5)
+        CrawlTask.objects.update(claimed_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(renew_leases({tasks[0].claimed_by}), 5)
+        self.assertEqual(requeue_stale_tasks(timedelta(minutes=15)), 0)
+
+
+class ClaimFencingTests(TransactionTestCase):
+    def setUp(self):
+        [self.book] = create_books(1)
+
+    def test_results_of_lost_claims_are_not_written(self):
+        enqueue_books([self.book.id])
+        [lost] = claim_tasks('worker-a', 1)
+        requeue_stale_tasks(timedelta(0))
+        [held] = claim_tasks('worker-b', 1)
+        writer = BookResultWriter(flush_interval=3600)
+        writer.add(self.book, set(), False, task_id=lost.id, claimed_by=lost.claimed_by, error='late')
+        self.assertEqual(writer.claims(), {lost.claimed_by})
+        writer.close()
+        task = CrawlTask.objects.get(pk=held.pk)
+        self.assertEqual((task.status, task.claimed_by), (TaskStatus.RUNNING, held.claimed_by))
+
+
+class ParseAllBooksTests(TestCase):
+    def setUp(self):
+        self.books = create_books(3)
+
+    def test_active_job_is_reused(self):
+        job, created = parse_all_books()
+        self.assertTrue(created)
+        self.assertEqual(job.total, len(self.books))
+        self.assertEqual(parse_all_books(), (job, False))
+        self.assertEqual(CrawlTask.objects.count(), len(self.books))
+
+        CrawlJob.objects.filter(pk=job.pk).update(status=TaskStatus.DONE)
+        _, created = parse_all_books()
+        self.assertTrue(created)
+
+    def test_concurrent_job_is_rejected(self):
+        job, _ = parse_all_books()
+        # A request that checked for an active job before this one was queued
+        with mock.patch('core.tasks.active_job', side_effect=[None, job]):
+            self.assertEqual(parse_all_books(), (job, False))
+        self.assertEqual(CrawlJob.objects.filter(kind=JobKind.ALL_BOOKS).count(), 1)
+        self.assertEqual(CrawlTask.objects.count(), len(self.books))
@@ -0,0 +1,64 @@
+from django.test import TestCase
+
+from ..models import Book
+from ..pagination import InvalidCursor, KeysetPaginator
+from . import create_books
+
+
+class KeysetPaginatorTests(TestCase):
+    def setUp(self):
+        ratings = [4.5, None, 3.0, 4.5, None, 5.0, 3.0, None, 4.0]
+        for book, rating in zip(create_books(len(ratings)), ratings):
+            book.rating = rating
+            book.save(update_fields=['rating'])
+
+    def walk(self, paginator: KeysetPaginator) -> tuple[list[int], list[int]]:
+        """Ids of every page forwards, then backwards from the last page."""
+        forwards, pages = [], []
+        page = paginator.page()
+        while True:
+            pages.append(page)
+            forwards += [book.id for book in page]
+            if not page.has_next:
+                break
+            page = paginator.page(page.next_cursor)
+        backwards = [book.id for book in pages[-1]]
+        page = pages[-1]
+        while page.has_previous:
+            page = paginator.page(page.previous_cursor)
+            backwards = [book.id for book in page] + backwards
+        return forwards, backwards
+
+    def test_round_trips_with_null_values(self):
+        expected = {
+            # Ascending fields sort NULLs first, descending ones NULLs last
+            'rating': sorted(Book.objects.all(), key=lambda book: (book.rating is not None, book.rating or 0, book.id)),
+            '-rating': sorted(Book.objects.all(), key=lambda book: (book.rating is None, -(book.rating or 0), -book.id)),
+        }
+        for ordering, books in expected.items():
+            for per_page in (1, 2, 4, 20):
+                with self.subTest(ordering=ordering, per_page=per_page):
+                    paginator = KeysetPaginator(Book.objects.all(), per_page, [ordering])
+                    forwards, backwards = self.walk(paginator)
+                    self.assertEqual(forwards, [book.id for book in books])
+                    self.assertEqual(backwards, forwards)
+
+    def test_mixed_directions(self):
+        books = sorted(Book.objects.all(), key=lambda book: (book.rating is None, -(book.rating or 0), book.name))
+        paginator = KeysetPaginator(Book.objects.all(), 2, ['-rating', 'name'])
+        forwards, backwards = self.walk(paginator)
+        self.assertEqual(forwards, [book.id for book in books])
+        self.assertEqual(backwards, forwards)
+
+    def test_first_and_last_page_flags(self):
+        paginator = KeysetPaginator(Book.objects.all(), 4, ['rating'])
+        first = paginator.page()
+        self.assertFalse(first.has_previous)
+        self.assertTrue(first.has_next)
+        self.assertFalse(paginator.page(paginator.page(first.next_cursor).next_cursor).has_next)
+
+    def test_invalid_cursor(self):
+        paginator = KeysetPaginator(Book.objects.all(), 2, ['rating'])
+        for cursor in ('not a cursor', KeysetPaginator(Book.objects.all(), 2, ['rating', 'name']).page().next_cursor):
+            with self.subTest(cursor=cursor), self.assertRaises(InvalidCursor):
+                paginator.page(cursor)
@@ -0,0 +1,38 @@
+from pathlib import Path
+import tempfile
+
+from django.test import SimpleTestCase, override_settings
+
+from ..sessions import SessionPool
+
+
+class SessionPoolTests(SimpleTestCase):
+    url = 'https://www.amazon.com/dp/B000000001'
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = override_settings(PARSER_SESSION_DIR=self.directory.name, PARSER_SESSION_WARM_UP=False)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        self.directory.cleanup()
+
+    def test_jars_are_restored_once_unlocked(self):
+        owner = SessionPool()
+        pooled = owner.acquire(self.url)
+        pooled.session.cookies.set('session-id', '123', domain='.amazon.com', path='/')
+        owner.release(pooled)
+
+        # Another process, flock locks of separate opens conflict like those of separate processes
+        other = SessionPool()
+        self.assertNotEqual(other.acquire(self.url).id, pooled.id)
+
+        pooled._jar_lock.close()
+        restarted = SessionPool()
+        restored = restarted.acquire(self.url)
+        self.assertEqual(restored.id, pooled.id)
+        self.assertEqual(restored.session.cookies.get('session-id'), '123')
+
+        restarted.release(restored, retire='test')
+        self.assertEqual([path for path in Path(self.directory.name).rglob('*') if path.is_file()], [])
@@ -0,0 +1,70 @@
+from datetime import timedelta
+import os
+from pathlib import Path
+import tempfile
+import time
+
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from ..models import PageSnapshot
+from ..snapshots import BLOB_GRACE, SnapshotStore, wait_for_writer
+
+
+class SnapshotStoreTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = SnapshotStore(root=Path(self.directory.name), compression='gzip')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def age(self, path: Path) -> None:
+        old = time.time() - BLOB_GRACE.total_seconds() - 60
+        os.utime(path, (old, old))
+
+    def test_archive_deduplicates(self):
+        first = self.store.archive('https://www.amazon.com/dp/B000000001', b'<html>page</html>')
+        second = self.store.archive('https://www.amazon.com/dp/B000000001', b'<html>page</html>')
+        self.assertEqual(first.content_hash, second.content_hash)
+        self.assertEqual(len(list(self.store._iter_blobs())), 1)
+        self.assertEqual(self.store.read(first.content_hash), b'<html>page</html>')
+
+    def test_compact_keeps_recent_unreferenced_blobs(self):
+        content_hash, _ = self.store.put_blob(b'<html>about to be indexed</html>')
+        self.assertEqual(self.store.compact(), (0, 0))
+        path = self.store.blob_path(content_hash)
+        self.assertTrue(path.exists())
+
+        self.age(path)
+        # Reusing the blob for a new snapshot makes it recent again
+        self.store.put_blob(b'<html>about to be indexed</html>')
+        self.assertEqual(self.store.compact(), (0, 0))
+
+        self.age(path)
+        self.assertEqual(self.store.compact(), (0, 1))
+        self.assertFalse(path.exists())
+
+    def test_compact_applies_retention(self):
+        now = timezone.now()
+        for days in range(4):
+            self.store.archive(
+                'https://www.amazon.com/dp/B000000001', f'<html>{days}</html>'.encode(),
+                fetched_at=now - timedelta(days=days * 100),
+            )
+        for path in self.store._iter_blobs():
+            self.age(path)
+        self.assertEqual(self.store.compact(keep_last=2, max_age_days=90), (2, 2))
+        self.assertEqual(PageSnapshot.objects.count(), 2)
+        self.assertEqual(len(list(self.store._iter_blobs())), 2)
+
+
+class ArchiveAsyncTests(TransactionTestCase):
+    def test_queued_pages_are_indexed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = SnapshotStore(root=Path(directory), compression='gzip')
+            for i in range(10):
+                store.archive_async(f'https://www.amazon.com/dp/B00000000{i}', f'<html>{i % 3}</html>'.encode())
+            wait_for_writer()
+            self.assertEqual(PageSnapshot.objects.count(), 10)
+            self.assertEqual(len(list(store._iter_blobs())), 3)
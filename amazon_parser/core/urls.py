@@ -1,12 +1,20 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 urlpatterns = [
     path('', views.book_list, name='book_list'),
     path('books/<int:pk>/', views.book_detail, name='book_detail'),
     path('books/add/', views.add_book, name='add_book'),
+    path('books/import/', views.import_books, name='import_books'),
     path('books/<int:pk>/edit/', views.edit_book, name='edit_book'),
     path('books/<int:pk>/parse/', views.parse_book, name='parse_book'),
+    path('books/<int:pk>/parse/status/', views.parse_status, name='parse_status'),
     path('books/parse-all/', views.parse_all_books, name='parse_all_books'),
+    path('books/export/', views.export_books, name='export_books'),
     path('books/<int:pk>/delete/', views.delete_book, name='delete_book'),
+    path('metrics/', views.metrics, name='metrics'),
+    path('api/books/', api.books, name='api_books'),
+    path('api/books/<int:pk>/', api.book, name='api_book'),
+    path('api/series/', api.series, name='api_series'),
+    path('api/parse-status/', api.parse_status, name='api_parse_status'),
 ] 
\ No newline at end of file
@@ -2,19 +2,28 @@
 """
 Amazon KDP Parser with captcha avoidance techniques (no proxies)
 """
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from enum import Enum
 import logging
 import re
-from datetime import datetime
-from pathlib import Path
+from contextlib import nullcontext
+import threading
 from typing import Final
 
 import requests
 import time
 import random
 from bs4 import BeautifulSoup
+from django.conf import settings
+from requests.adapters import HTTPAdapter
 
-from amazon_parser.settings import BASE_DIR
+from .extraction import extract_fields
+from .html_backends import build_partial_tree, build_tree, region_spans
+from .marketplaces import marketplace_of
+from .metrics import EXTRACTOR_ERRORS, PARSE_STAGE_SECONDS, TimedHTTPAdapter, connection_timings, observe_fetch
+from .snapshots import default_store
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -22,20 +31,63 @@ logger = logging.getLogger(__name__)
 
 ########################################################################################################
 
+class ProxyState(str, Enum):
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+
+@dataclass
+class ProxyHealth:
+    """Request outcomes of a proxy and its circuit breaker state."""
+    proxy: dict
+    adapter: HTTPAdapter
+    requests: int = 0
+    errors: int = 0
+    captchas: int = 0
+    # Exponentially weighted moving averages, recent requests weigh the most
+    latency: float | None = None
+    error_rate: float = 0.0
+    captcha_rate: float = 0.0
+    consecutive_failures: int = 0
+    state: ProxyState = ProxyState.CLOSED
+    opened_at: float = 0.0
+
+    @property
+    def name(self) -> str:
+        return f"{self.proxy['host']}:{self.proxy['port']}"
+
+    @property
+    def weight(self) -> float:
+        """Selection weight, fast proxies without errors and captchas get the most traffic."""
+        latency = max(self.latency or 1.0, 0.1)
+        return max((1 - self.error_rate) * (1 - self.captcha_rate), 0.02) / latency
+
+
 class HttpsProxyManager:
+    EWMA_ALPHA: Final[float] = 0.2
+
     def __init__(self, proxy_list: list[str]):
         """
         Initialize with list of proxies in format "host:port:user:pass"
+
+        Every proxy gets its own HTTPAdapter, so its keep-alive connections
+        are reused by all sessions that go through it.
         """
-        self.proxies = []
+        self.health: list[ProxyHealth] = []
+        self._lock = threading.Lock()
         for proxy in proxy_list:
             host, port, user, password = proxy.strip().split(':')
-            self.proxies.append({
+            proxy = {
                 'host': host,
                 'port': port,
                 'user': user,
                 'password': password
-            })
+            }
+            self.health.append(ProxyHealth(
+                proxy=proxy,
+                adapter=TimedHTTPAdapter(pool_connections=4, pool_maxsize=settings.PARSER_PROXY_POOL_SIZE),
+            ))
 
     def get_proxy_dict(self, proxy: dict) -> dict:
         """Convert proxy info into requests format for HTTPS only"""
@@ -47,12 +99,249 @@ class HttpsProxyManager:
             'https': proxy_url
         }
 
-    def get_random_proxy(self) -> dict:
-        """Get a random proxy from the list"""
-        return self.get_proxy_dict(random.choice(self.proxies))
-    
+    def select(self) -> ProxyHealth | None:
+        """
+        Pick a proxy weighted by its health, None when no proxies are configured.
+
+        Proxies with an open circuit are skipped until their cooldown has passed,
+        then a single probe request is let through (half-open state).
+        """
+        now = time.monotonic()
+        if not self.health:
+            return None
+        with self._lock:
+            candidates = []
+            for health in self.health:
+                if health.state == ProxyState.OPEN and now - health.opened_at >= settings.PARSER_PROXY_COOLDOWN:
+                    health.state = ProxyState.HALF_OPEN
+                    logger.info(f"Probing proxy {health.name} again")
+                    return health
+                if health.state == ProxyState.CLOSED:
+                    candidates.append(health)
+            if not candidates:
+                # Every circuit is open, keep crawling through the one that failed longest ago
+                return min(self.health, key=lambda health: health.opened_at)
+            return random.choices(candidates, weights=[health.weight for health in candidates])[0]
+
+    def record(self, health: ProxyHealth, latency: float | None, outcome: str) -> None:
+        """
+        Record the outcome of a request made through the proxy.
+
+        Args:
+            health: Proxy the request went through
+            latency: Seconds until the response arrived, None if there was no response
+            outcome: "ok", "error" or "captcha"
+        """
+        alpha = self.EWMA_ALPHA
+        with self._lock:
+            health.requests += 1
+            health.errors += outcome == 'error'
+            health.captchas += outcome == 'captcha'
+            health.error_rate += alpha * ((outcome == 'error') - health.error_rate)
+            health.captcha_rate += alpha * ((outcome == 'captcha') - health.captcha_rate)
+            if latency is not None:
+                health.latency = latency if health.latency is None else health.latency + alpha * (latency - health.latency)
+
+            if outcome == 'ok':
+                health.consecutive_failures = 0
+                if health.state != ProxyState.CLOSED:
+                    logger.info(f"Proxy {health.name} recovered")
+                health.state = ProxyState.CLOSED
+                return
+            health.consecutive_failures += 1
+            if health.state == ProxyState.HALF_OPEN or (
+                health.state == ProxyState.CLOSED
+                and health.consecutive_failures >= settings.PARSER_PROXY_FAILURE_THRESHOLD
+            ):
+                logger.warning(f"Opening circuit of proxy {health.name} after {health.consecutive_failures} failures")
+                health.state = ProxyState.OPEN
+                health.opened_at = time.monotonic()
+
+    def stats(self) -> list[dict]:
+        """Return per-proxy request statistics."""
+        with self._lock:
+            return [
+                {
+                    'proxy': health.name,
+                    'state': health.state.value,
+                    'requests': health.requests,
+                    'errors': health.errors,
+                    'captchas': health.captchas,
+                    'latency': round(health.latency, 3) if health.latency is not None else None,
+                    'error_rate': round(health.error_rate, 3),
+                    'captcha_rate': round(health.captcha_rate, 3),
+                    'weight': round(health.weight, 3),
+                }
+                for health in self.health
+            ]
+
+
+_proxy_manager: HttpsProxyManager | None = None
+_proxy_manager_lock = threading.Lock()
+
+
+def get_proxy_manager() -> HttpsProxyManager:
+    """Return the process wide proxy manager, so proxy health outlives single parsers."""
+    global _proxy_manager
+    with _proxy_manager_lock:
+        if _proxy_manager is None:
+            _proxy_manager = HttpsProxyManager(settings.PARSER_PROXIES)
+        return _proxy_manager
+
 ########################################################################################################
 
+# Pages visited before product pages so a session looks like a browsing customer
+WARM_UP_URLS: Final = (
+    "https://www.amazon.com/",
+    "https://www.amazon.com/books-used-books-textbooks/b/?ie=UTF8&node=283155",
+    "https://www.amazon.com/Kindle-eBooks/b/?ie=UTF8&node=154606011",
+)
+
+# Elements the extractors read: the product details block, with the ranks and usually the
+# rating, the rating block for layouts that place it elsewhere, and the review lists
+EXTRACTOR_REGIONS: Final = (
+    'detailBulletsWrapper_feature_div',
+    'detailBullets_averageCustomerReviews',
+    'cm-cr-dp-review-list',
+    'cm-cr-global-review-list',
+)
+# Pages without the product details block have an unknown layout and are parsed whole
+REQUIRED_REGION: Final = 'detailBulletsWrapper_feature_div'
+
+CAPTCHA_RE: Final = re.compile(rb'(?<![\w-])id\s*=\s*["\']?captchacharacters')
+# Primary subtag of the page language, <html lang="de-de"> -> "de"; pages requested with language=en_GB are English
+HTML_LANG_RE: Final = re.compile(rb'<html\b[^>]*?\slang\s*=\s*["\']?([a-zA-Z]{2,3})\b', re.IGNORECASE)
+
+# Throttling and transient server errors, Amazon answers 503 when a client requests too fast
+RETRYABLE_STATUS_CODES: Final = frozenset({429, 500, 502, 503, 504})
+
+
+class FetchError(Exception):
+    """The page can not be fetched."""
+
+
+class RetryableFetchError(FetchError):
+    """Transient fetch failure, the page should be fetched again later."""
+
+    def __init__(self, message: str, retry_after: float | None = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Return the seconds to wait from a Retry-After header, given as seconds or as an HTTP date."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def browser_headers() -> dict[str, str]:
+    """Return request headers of a common browser, with a random user agent."""
+    # Rotate between common user agents
+    user_agents = [
+        'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+        'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+        'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/119.0',
+        'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Safari/605.1.15'
+    ]
+    headers = {
+        'User-Agent': random.choice(user_agents),
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+        'Accept-Language': 'en-US,en;q=0.9',
+        'Referer': 'https://www.amazon.com/',
+        'sec-ch-ua': '"Google Chrome";v="120", "Chromium";v="120", "Not=A?Brand";v="24"',
+        'sec-ch-ua-mobile': '?0',
+        'sec-ch-ua-platform': '"Windows"',
+        'Connection': 'keep-alive'
+    }
+    headers.update({
+        'Accept-Encoding': 'gzip, deflate, br',
+        'Cache-Control': 'max-age=0',
+        'Upgrade-Insecure-Requests': '1',
+        'Sec-Fetch-Dest': 'document',
+        'Sec-Fetch-Mode': 'navigate',
+        'Sec-Fetch-Site': 'none',
+        'Sec-Fetch-User': '?1',
+        'DNT': '1',
+    })
+    return headers
+
+
+@dataclass
+class FetchedPage:
+    """Raw page body with a lazily built tree, so every page is parsed only once."""
+    url: str
+    content: bytes
+    encoding: str | None = None
+    # Elements the tree is built from with partial parsing, product page ones by default
+    regions: tuple[str, ...] = EXTRACTOR_REGIONS
+    required_region: str = REQUIRED_REGION
+    _soup: BeautifulSoup | None = field(default=None, repr=False)
+    _captcha: bool | None = field(default=None, repr=False)
+    _language: str | None = field(default=None, repr=False)
+    _spans: dict[str, tuple[int, int] | None] | None = field(default=None, repr=False)
+    _spans_failed: bool = field(default=False, repr=False)
+
+    @property
+    def is_captcha(self) -> bool:
+        """Whether Amazon answered with a captcha instead of the page, a byte scan that builds no tree."""
+        if self._captcha is None:
+            with PARSE_STAGE_SECONDS.time(stage='captcha_check', marketplace=marketplace_of(self.url)):
+                self._captcha = CAPTCHA_RE.search(self.content) is not None
+        return self._captcha
+
+    @property
+    def language(self) -> str:
+        """Language of the page from its html element, e.g. "en", empty when it names none; a byte scan."""
+        if self._language is None:
+            match = HTML_LANG_RE.search(self.content)
+            self._language = match.group(1).decode().lower() if match else ''
+        return self._language
+
+    @property
+    def region_spans(self) -> dict[str, tuple[int, int] | None] | None:
+        """Offsets of the regions in the content, None when they can not be cut out or the required one is missing."""
+        if self._spans is None and not self._spans_failed:
+            try:
+                self._spans = region_spans(self.content, self.regions)
+            except ValueError as e:
+                logger.debug(f"Regions of {self.url} can not be cut out: {e}")
+            if self._spans is None or self._spans.get(self.required_region) is None:
+                self._spans, self._spans_failed = None, True
+        return self._spans
+
+    @property
+    def soup(self) -> BeautifulSoup:
+        """
+        Tree for the extractors.
+
+        With PARSER_PARTIAL_PARSING only the regions of the page are parsed,
+        pages whose regions can not be cut out are parsed whole.
+        """
+        if self._soup is None:
+            marketplace = marketplace_of(self.url)
+            if settings.PARSER_PARTIAL_PARSING:
+                with PARSE_STAGE_SECONDS.time(stage='tree_build_partial', marketplace=marketplace):
+                    spans = self.region_spans
+                    if spans is not None:
+                        self._soup = build_partial_tree(
+                            self.content, self.regions, self.required_region, self.encoding, spans=spans,
+                        )
+            if self._soup is None:
+                with PARSE_STAGE_SECONDS.time(stage='tree_build', marketplace=marketplace):
+                    self._soup = build_tree(self.content, self.encoding)
+        return self._soup
+
+
 @dataclass
 class ParsedResult:
     rating: float | None
@@ -64,290 +353,189 @@ class ParsedResult:
 class AmazonKDPParser:
     """Parser for Amazon KDP website with basic captcha avoidance."""
 
-    HTML_PAGES_DATA: Final[Path] = BASE_DIR / 'data'
-
-    def __init__(self):
-        """Initialize the parser with a requests session."""
-        self.proxy_manager = HttpsProxyManager([
-            "91.132.12.165:12323:14a0693892686:42fbec1479",
-            "141.98.58.86:12323:14a0693892686:42fbec1479",
-            "205.233.201.252:12323:14a0693892686:42fbec1479",
-        ])
-        self.session = requests.Session()
-        self.configure_session()
-        self._page_title = None
-
-    def configure_session(self):
-        """Configure the session with headers that make it look like a real browser."""
-        # Rotate between common user agents
-        user_agents = [
-            'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/119.0',
-            'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Safari/605.1.15'
-        ]
-        headers = {
-            'User-Agent': random.choice(user_agents),
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Referer': 'https://www.amazon.com/',
-            'sec-ch-ua': '"Google Chrome";v="120", "Chromium";v="120", "Not=A?Brand";v="24"',
-            'sec-ch-ua-mobile': '?0',
-            'sec-ch-ua-platform': '"Windows"',
-            'Connection': 'keep-alive'
-        }
-        headers.update({
-            'Accept-Encoding': 'gzip, deflate, br',
-            'Cache-Control': 'max-age=0',
-            'Upgrade-Insecure-Requests': '1',
-            'Sec-Fetch-Dest': 'document',
-            'Sec-Fetch-Mode': 'navigate',
-            'Sec-Fetch-Site': 'none',
-            'Sec-Fetch-User': '?1',
-            'DNT': '1',
-        })
-
-        # Update session headers
-        self.session.headers.update(headers)
-        self.session.proxies.update(self.proxy_manager.get_random_proxy())
-        print(self.session.proxies)
-
-        # self.session.cookies.update({
-        #     'session-id': f'{random.randint(100000000, 999999999)}',
-        #     'session-id-time': f'{int(time.time())}',
-        #     'i18n-prefs': 'USD',
-        #     'sp-cdn': 'L5Z9:US',
-        #     'ubid-main': f'{random.randint(100000000, 999999999)}',
-        #     'csm-hit': f'tb:{random.randint(100000000, 999999999)}+s-{random.randint(100000000, 999999999)}|{int(time.time())}',
-        # })
-
-    def fetch_page(self, url, max_retries=3):
+    def __init__(self, rate_limiter=None, snapshot_store=None, session_pool=None):
+        """
+        Initialize the parser, every fetch takes a warmed session from the session pool.
+
+        Args:
+            rate_limiter (HostRateLimiter, optional): Shared per-host limiter used by concurrent crawls
+            snapshot_store (SnapshotStore, optional): Archive for fetched pages, the configured one by default
+            session_pool (SessionPool, optional): Pool of warmed sessions, the process wide one by default
+        """
+        from .sessions import get_session_pool
+
+        self.rate_limiter = rate_limiter
+        self.snapshot_store = snapshot_store if snapshot_store is not None else default_store()
+        self.proxy_manager = get_proxy_manager()
+        self.session_pool = session_pool or get_session_pool()
+
+    def _request_slot(self, url: str):
+        """Return a context holding a rate limiter slot for the url host, if limited."""
+        if self.rate_limiter is None:
+            return nullcontext()
+        return self.rate_limiter.slot(url)
+
+    def _record_proxy_outcome(self, proxy: ProxyHealth | None, latency: float | None, outcome: str):
+        """Report the request outcome to the proxy manager."""
+        if proxy is not None:
+            self.proxy_manager.record(proxy, latency, outcome)
+
+    def _acquire_session(self, url: str, tried: set[str], proxy: ProxyHealth | None):
+        pooled = self.session_pool.acquire(url, proxy, avoid=tried, rate_limiter=self.rate_limiter)
+        tried.add(pooled.id)
+        return pooled
+
+    def fetch_page(self, url, max_retries=3, proxy: ProxyHealth | None = None):
         """
         Fetch the page with captcha avoidance techniques.
 
+        Every attempt takes a warmed session from the session pool and gives
+        it back afterwards. Captchas and connection errors are retried at
+        once with another session, through another proxy, nothing here
+        sleeps: throttling responses and exhausted retries raise
+        RetryableFetchError so the caller can reschedule the page and move
+        on to other work.
+
         Args:
             url (str, optional): Target URL
-            max_retries (int): Maximum number of retry attempts
+            max_retries (int): Maximum number of immediate attempts
+            proxy (ProxyHealth, optional): Fetch through this proxy whatever its state, e.g. to probe it,
+                through any healthy one by default
 
         Returns:
-            str: HTML content if successful, None otherwise
+            FetchedPage: Page content with its parsed tree
+
+        Raises:
+            RetryableFetchError: The page may be fetched later, with the server's Retry-After if given
+            FetchError: The page can not be fetched, e.g. it does not exist
         """
         target_url = url 
+        reason = "no attempts made"
+        tried: set[str] = set()
+        # proxy is the route of the current attempt below
+        pinned_proxy = proxy
 
         for attempt in range(max_retries):
+            logger.info(f"Attempt {attempt + 1}/{max_retries} to fetch {target_url}")
+
+            # Randomize the URL slightly to avoid pattern detection
+            # Add a harmless parameter that makes each request look unique
+            # modified_url = f"{target_url}{'&' if '?' in target_url else '?'}_={random.randint(1000000, 9999999)}"
+
+            # Fetch the page
+            pooled = self._acquire_session(target_url, tried, pinned_proxy)
+            proxy = pooled.proxy
             try:
-                logger.info(f"Attempt {attempt + 1}/{max_retries} to fetch {target_url}")
-
-                # Add delays between requests to appear more human-like
-                if attempt > 0:
-                    delay = random.uniform(2, 5)
-                    logger.info(f"Waiting {delay:.2f} seconds before retry")
-                    time.sleep(delay)
-
-                # Randomize the URL slightly to avoid pattern detection
-                # Add a harmless parameter that makes each request look unique
-                # modified_url = f"{target_url}{'&' if '?' in target_url else '?'}_={random.randint(1000000, 9999999)}"
-
-                # Fetch the page
-                response = self.session.get(
-                    target_url,
-                    timeout=15  # Add timeout to prevent hanging
+                with self._request_slot(target_url), connection_timings() as timings:
+                    started_at = time.monotonic()
+                    response = pooled.session.get(
+                        target_url,
+                        timeout=15  # Add timeout to prevent hanging
+                    )
+            except requests.RequestException as e:
+                logger.error(f"Error during fetch: {str(e)}")
+                observe_fetch(target_url, proxy, 'failed')
+                self._record_proxy_outcome(proxy, None, 'error')
+                reason = f"request failed: {e}"
+                # The cookies of a session belong to its route, a session whose proxy failed goes with it
+                failed = proxy is not None and proxy.state != ProxyState.CLOSED
+                self.session_pool.release(pooled, retire='proxy' if failed else None)
+                # Retrying the same route makes no sense
+                if proxy is None:
+                    break
+                continue
+            pooled.request_count += 1
+            latency = time.monotonic() - started_at
+            timed = dict(
+                timings=timings,
+                headers_seconds=response.elapsed.total_seconds(),
+                total_seconds=latency,
+                size=len(response.content),
+            )
+
+            if response.status_code in RETRYABLE_STATUS_CODES:
+                logger.warning(f"Throttled: {response.status_code}, reason: {response.reason}")
+                observe_fetch(target_url, proxy, 'throttled', **timed)
+                self._record_proxy_outcome(proxy, latency, 'error')
+                self.session_pool.release(pooled)
+                raise RetryableFetchError(
+                    f"HTTP {response.status_code} {response.reason}",
+                    retry_after=parse_retry_after(response.headers.get('Retry-After')),
                 )
-                if not response.ok:
-                    logger.error(f"Failed to fetch data. Response: {response.status_code}, reason: {response.reason}")
+            if not response.ok:
+                logger.error(f"Failed to fetch data. Response: {response.status_code}, reason: {response.reason}")
+                observe_fetch(target_url, proxy, 'error', **timed)
+                self._record_proxy_outcome(proxy, latency, 'error')
+                self.session_pool.release(pooled)
+                raise FetchError(f"HTTP {response.status_code} {response.reason}")
+
+            # Hand raw bytes to the tree builder, response.text may sniff the charset over the whole body
+            page = FetchedPage(
+                url=target_url,
+                content=response.content,
+                encoding=response.encoding if 'charset' in response.headers.get('Content-Type', '').lower() else None,
+            )
+
+            # Check for captcha in the response
+            if page.is_captcha:
+                logger.warning("Captcha detected, trying different approach")
+                observe_fetch(target_url, proxy, 'captcha', **timed)
+                self._record_proxy_outcome(proxy, latency, 'captcha')
+                reason = "captcha"
+                pooled.captchas += 1
+                self.session_pool.release(pooled)
+                # The next attempt takes another session, without proxies from the same address
+                if proxy is None:
                     break
+                continue
 
-                soup = BeautifulSoup(response.text, 'html.parser')
-
-                # Check for captcha in the response
-                if soup.find(id="captchacharacters"):
-                    logger.warning("Captcha detected, trying different approach")
-                    self.configure_session()
-                    time.sleep(random.uniform(5, 10))
-                    continue
-
-                return response.text
-            except Exception as e:
-                logger.error(f"Error during fetch: {str(e)}")
+            observe_fetch(target_url, proxy, 'ok', **timed)
+            self._record_proxy_outcome(proxy, latency, 'ok')
+            self.session_pool.release(pooled)
+            return page
 
         logger.error("All attempts failed")
-        return None
-
-    def warm_up_session(self):
-        """
-        Warm up the session by visiting other Amazon pages first.
-        This can help avoid captchas by making the session look more natural.
-        """
-        warm_up_urls = [
-            "https://www.amazon.com/",
-            "https://www.amazon.com/books-used-books-textbooks/b/?ie=UTF8&node=283155",
-            "https://www.amazon.com/Kindle-eBooks/b/?ie=UTF8&node=154606011"
-        ]
-
-        logger.info("Warming up session with preliminary requests")
-        for url in warm_up_urls:
-            try:
-                logger.info(f"Visiting {url}")
-                response = self.session.get(url, timeout=10)
-                logger.info(f"Status: {response.status_code}")
+        raise RetryableFetchError(f"All attempts failed, last: {reason}")
 
-                # Add random delay between requests
-                time.sleep(random.uniform(1, 3))
-            except Exception as e:
-                logger.warning(f"Warm-up request failed: {str(e)}")
-
-        logger.info("Session warm-up complete")
-
-    def _validate_response(self, soup):
+    def _validate_response(self, page: FetchedPage):
         """Validate the response and raise an exception if it's not valid."""
-        captcha = soup.find(id="captchacharacters")
-        if captcha:
+        if page.is_captcha:
             raise Exception("Captcha detected")
         else:
+            soup = page.soup
             title = soup.title.string if soup.title else "No title found"
             logger.info(f"Successfully bypassed without captcha! Page title: {title}")
-            self._page_title = title[:20].strip() if title != "No title found" else None
-
-    def _get_rating_and_reviews_count(self, soup: BeautifulSoup) -> tuple[str | None, str | None]:
-        """
-        :return: tuple of rating and reviews count
-        """
-        customer_reviews_div = soup.find(id="detailBullets_averageCustomerReviews")
-        if customer_reviews_div:
-            rating_span = customer_reviews_div.find('span', class_='a-size-base a-color-base')
-            if rating_span:
-                rating = float(rating_span.text.strip())
-            else:
-                logger.warning("No rating span found")
-                rating = None
-            reviews_count_span = customer_reviews_div.find(id="acrCustomerReviewText")
-            if reviews_count_span:
-                reviews_count = float(reviews_count_span.text.strip().split()[0].replace(',', ''))
-            else:
-                logger.warning("No reviews count span found")
-                reviews_count = None
-            return rating, reviews_count
-        else:
-            logger.warning("No customer reviews div found")
-            return None, None
 
-    def _get_best_sellers_ranks(self, soup: BeautifulSoup) -> list[dict] | None:
-        """
-        :return: list of best sellers ranks values
-        """
-        def _parse_rank(rank_text: str) -> dict:
-            rank_text = rank_text.replace(',', '')
-            digit = re.search(r'\d+', rank_text)
-            if digit:
-                place = digit.group()
-                rank_name = rank_text.replace(place, '').replace("#", '').strip()
-                return {'place': place, 'rank_name': rank_name}
-            else:
-                return {'place': None, 'rank_name': rank_text}
-            
-        ranks_ul = soup.find('h2', string='Product details').find_next_sibling(id='detailBullets_feature_div').find_next_sibling('ul')
-        first_rank_span = ranks_ul.find_next('span', class_='a-text-bold',)
-        if first_rank_span and first_rank_span.text.strip() == 'Best Sellers Rank:':
-            first_rank_value = first_rank_span.next_sibling.text.strip()
-            # find all other ranks
-            rankings = [_parse_rank(first_rank_value)]
-            sub_ranks = ranks_ul.find('ul', class_="zg_hrsr").find_all('li')
-            for sub_rank in sub_ranks:
-                sub_rank_text = sub_rank.get_text(strip=True)
-                rankings.append(_parse_rank(sub_rank_text))
-            return rankings
-        else:
-            logger.warning("No \"Best Sellers Rank\" ul element found")
-            return None
-
-    def _get_popular_reviews(self, soup: BeautifulSoup) -> list[dict] | None:
-        reviews_potential_containers_ids = ["cm-cr-dp-review-list", "cm-cr-global-review-list"]
-        reviews = []
-
-        for review_ul_container in reviews_potential_containers_ids:
-            reviews_ul = soup.find(id=review_ul_container)
-            if reviews_ul:
-                items = reviews_ul.find_all('li')
-                for item in items:
-                    reviewer_span = item.find('span', class_='a-profile-name')
-                    reviewer_name = reviewer_span.get_text(strip=True) if reviewer_span else None
-                    starts_span = item.find('span', class_='a-icon-alt')
-                    starts_value = starts_span.get_text(strip=True) if starts_span else None
-
-                    # review_title_span = item.find('span', class_='cr-original-review-content')
-                    review_title_span = item.find('span', class_='a-letter-space').find_next_sibling('span')
-                    if not review_title_span:
-                        review_title_span = item.find('span', class_='cr-translated-review-content')
-                    review_title = review_title_span.get_text(strip=True) if review_title_span else None
-
-                    review_content_span = item.find('span', {
-                        'data-hook': 'review-body',
-                        'class': 'a-size-base review-text'
-                    })
-                    review_content = review_content_span.find(class_='cr-original-review-content')
-                    if not review_content:
-                        review_content_div = review_content_span.find(
-                            'div', {
-                                'data-hook': 'review-collapsed',
-                                'class': 'a-expander-content reviewText review-text-content a-expander-partial-collapse-content'
-                            }
-                        )
-                        if not review_content_div:
-                            review_content = None
-                        else:
-                            review_content = review_content_div.find('span')
-                    review_content_text = review_content.get_text(strip=True) if review_content else None
-                    reviews.append(
-                        {
-                            'reviewer_name': reviewer_name,
-                            'starts_value': starts_value,
-                            'review_title': review_title,
-                            'review_content': review_content_text,
-                        }
-                    )
-        return reviews
-
-    def _parse_page(self, page_content: str) -> ParsedResult:
+    def parse_page(self, page: FetchedPage) -> ParsedResult:
         """Parse the page and return the content."""
-        soup = BeautifulSoup(page_content, 'html.parser')
-        self._validate_response(soup)
-        if not self.HTML_PAGES_DATA.exists():
-            self.HTML_PAGES_DATA.mkdir()
-        if self._page_title:
-            content_filename = self.HTML_PAGES_DATA / f'{self._page_title}.html'
-        else:
-            content_filename = str(datetime.now())
-        with open(content_filename, 'w') as f:
-            f.write(page_content)
-        try:
-            rating, reviews_count = self._get_rating_and_reviews_count(soup)
-        except Exception as e:
-            logger.exception(f"Error getting rating and reviews count", exc_info=e)
-            rating, reviews_count = None, None
-        try:
-            best_sellers_ranks = self._get_best_sellers_ranks(soup)
-        except Exception as e:
-            logger.exception(f"Error getting best sellers ranks", exc_info=e)
-            best_sellers_ranks = None
-        try:
-            reviews = self._get_popular_reviews(soup)
-        except Exception as e:
-            logger.exception(f"Error getting popular reviews", exc_info=e)
-            reviews = None
+        self._validate_response(page)
+        soup = page.soup
+        marketplace = marketplace_of(page.url)
+        with PARSE_STAGE_SECONDS.time(stage='extract', marketplace=marketplace):
+            try:
+                fields = extract_fields(soup, marketplace, page.language)
+            except Exception as e:
+                logger.exception("Error extracting fields", exc_info=e)
+                EXTRACTOR_ERRORS.inc(extractor='rules', marketplace=marketplace)
+                fields = {}
+        rating, reviews_count = fields.get('rating'), fields.get('reviews_count')
         data = ParsedResult(
             rating=float(rating) if rating else None,
             reviews_count=int(reviews_count) if reviews_count else None,
-            best_sellers_ranks=best_sellers_ranks if best_sellers_ranks else None,
-            reviews=reviews if reviews else None,
+            best_sellers_ranks=fields.get('best_sellers_ranks') or None,
+            reviews=fields.get('reviews') or None,
         )
         logger.info('Successfully parsed page, data: %s', data)
         return data
     
-    def parse_amazon_book(self, url: str) -> ParsedResult:
+    def fetch_book_page(self, url: str, book_id: int | None = None) -> FetchedPage:
+        """Fetch the Amazon book page and archive it."""
+        page = self.fetch_page(url)
+        if self.snapshot_store:
+            self.snapshot_store.archive_async(url, page.content, book_id=book_id)
+        return page
+
+    def parse_amazon_book(self, url: str, book_id: int | None = None) -> ParsedResult:
         """Parse the Amazon book page and return the data."""
-        html_content = self.fetch_page(url)
-        if not html_content:
-            raise Exception("Failed to fetch data")
-        else:
-            return self._parse_page(html_content)
+        return self.parse_page(self.fetch_book_page(url, book_id=book_id))
 
@@ -1,47 +1,113 @@
 import logging
 
-from multiprocessing import Process
-import re
+from django.conf import settings
+from django.core.cache import cache
 from django.db import IntegrityError
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
-from django.views.decorators.http import require_POST
-from django.core.paginator import Paginator
+from django.views.decorators.http import require_GET, require_POST
+from django.core.paginator import Page, Paginator
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
 
-from .cache_utils import get_parsing_status
-from .models import Book, BookSeries, Language
-from .forms import BookForm
+from .cache import book_cache_key, book_version, list_cache_key, series_choices
+from .exports import DATASETS, FORMATS, available_formats, export, export_filename
+from .history import book_chart_data
+from .importers import InvalidImport, import_books as import_book_rows, read_rows
+from .jobs import ACTIVE_STATUSES, active_job, job_progress
+from .models import Book, Language
+from .forms import BookForm, BookImportForm
+from .marketplaces import extract_asin
+from .metrics import render_metrics
+from .pagination import InvalidCursor, KeysetPaginator
 from .filters import BookFilter
-from .tasks import parse_single_book, parse_all_books as parse_all_books_task
+from .tasks import queue_single_book, single_book_task, parse_all_books as parse_all_books_task
 
 logger = logging.getLogger(__name__)
 
+HISTORY_RANGES = ('7', '30', '90', '365')
+BOOKS_PER_PAGE = 50
+
+def _book_list_page(book_filter, params, keyset: bool):
+    """
+    Return the requested page of the filtered books, cached until a book or series changes.
+
+    The rows and the count are cached instead of the rendered table, whose
+    forms carry the CSRF token of the request.
+    """
+    key = list_cache_key(params)
+    cached = cache.get(key)
+    if cached is None:
+        books = book_filter.qs
+        # The primary key makes the order total, so rows with equal sort values keep their page
+        books = books.order_by(*books.query.order_by, 'id')
+        if keyset:
+            paginator = KeysetPaginator(books, BOOKS_PER_PAGE)
+            try:
+                cached = paginator.page(params.get('cursor'))
+            except InvalidCursor:
+                cached = paginator.page()
+        else:
+            page = Paginator(books, BOOKS_PER_PAGE).get_page(params.get('page'))
+            cached = (list(page.object_list), page.number, page.paginator.count)
+        cache.set(key, cached, settings.PARSER_PAGE_CACHE_TIMEOUT)
+    if keyset:
+        return cached
+    books, number, count = cached
+    paginator = Paginator(Book.objects.none(), BOOKS_PER_PAGE)
+    paginator.count = count
+    return Page(books, number, paginator)
+
 def book_list(request):
-    book_filter = BookFilter(request.GET, queryset=Book.objects.all())
-    
-    books = book_filter.qs
+    book_filter = BookFilter(request.GET, queryset=Book.objects.select_related('series'))
+    series = series_choices()
+    # The select is rendered from the cached series, the submitted one is still validated against the table
+    series_field = book_filter.form.fields['series']
+    series_field.widget.choices = [('', series_field.empty_label), *series]
+    all_series = sorted({title for _, title in series})
     
-    all_series = BookSeries.objects.values_list('title', flat=True).distinct()
-    
-    paginator = Paginator(books, 50)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    keyset = 'cursor' in request.GET or settings.PARSER_BOOK_LIST_PAGINATION == 'keyset'
+    page_obj = _book_list_page(book_filter, request.GET, keyset)
+
+    parsing_job = active_job()
     
     context = {
         'page_obj': page_obj,
+        'keyset_pagination': keyset,
         'filter': book_filter,
+        'export_datasets': DATASETS,
+        'export_formats': available_formats(),
         'all_series': all_series,
         'language_choices': Language.choices,
-        'parsing_in_progress': get_parsing_status(),
+        'parsing_in_progress': parsing_job is not None,
+        'parsing_progress': job_progress(parsing_job) if parsing_job else None,
     }
     
     return render(request, 'core/book_list.html', context)
 
 def book_detail(request, pk):
     book = get_object_or_404(Book, pk=pk)
+
+    history_days = request.GET.get('days', '')
+    history_days = int(history_days) if history_days in HISTORY_RANGES else 30
+
+    chart_key = book_cache_key(book.pk, f'chart:{history_days}')
+    history_data = cache.get(chart_key)
+    if history_data is None:
+        history_data = book_chart_data(book, history_days)
+        cache.set(chart_key, history_data, settings.PARSER_PAGE_CACHE_TIMEOUT)
+
+    parse_task = single_book_task(book.pk)
     
     return render(request, 'core/book_detail.html', {
         'book': book,
+        'parse_in_progress': parse_task is not None and parse_task.status in ACTIVE_STATUSES,
+        'parse_poll_interval': settings.PARSER_SINGLE_PARSE_POLL_INTERVAL,
+        'book_version': book_version(book.pk),
+        'cache_timeout': settings.PARSER_PAGE_CACHE_TIMEOUT,
+        'history_days': history_days,
+        'history_ranges': HISTORY_RANGES,
+        'history_data': history_data,
     })
 
 def add_book(request):
@@ -61,6 +127,37 @@ def add_book(request):
     
     return render(request, 'core/add_book.html', {'form': form})
 
+def import_books(request):
+    result = None
+    if request.method == 'POST':
+        form = BookImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            try:
+                result = import_book_rows(
+                    read_rows(form.cleaned_data['text']),
+                    default_language=form.cleaned_data['language'] or None,
+                    enqueue=form.cleaned_data['parse'],
+                )
+            except InvalidImport as e:
+                form.add_error(None, str(e))
+            else:
+                messages.success(
+                    request,
+                    f'Imported {len(result.created)} books, {result.duplicates} already stored, '
+                    f'{len(result.errors)} invalid rows'
+                    + (', parsing queued' if result.job else ''),
+                )
+                if not result.errors:
+                    return redirect('book_list')
+    else:
+        form = BookImportForm()
+
+    return render(request, 'core/import_books.html', {
+        'form': form,
+        'errors': result.errors[:settings.PARSER_IMPORT_MAX_SHOWN_ERRORS] if result else [],
+        'hidden_errors': max(len(result.errors) - settings.PARSER_IMPORT_MAX_SHOWN_ERRORS, 0) if result else 0,
+    })
+
 def edit_book(request, pk):
     book = get_object_or_404(Book, pk=pk)
     
@@ -75,11 +172,7 @@ def edit_book(request, pk):
             messages.error(request, 'An error occurred while editing a book')
             return render(request, 'core/edit_book.html', {'form': form, 'book': book})
     else:
-        match = re.search(r'/dp/([A-Z0-9]+)', book.url)
-        if match:
-            book_id = match.group(1)
-        else:
-            book_id = None
+        book_id = extract_asin(book.url)
 
         form = BookForm(
             instance=book,
@@ -95,22 +188,40 @@ def edit_book(request, pk):
 def parse_book(request, pk):
     book = get_object_or_404(Book, pk=pk)
     
-    # Call the parse function
-    parse_single_book(book.pk)
+    # The crawl workers parse the book, the page follows the task with parse_status
+    queue_single_book(book.pk)
     
-    messages.info(request, f'Parsing started for book: {book.name}')
+    messages.info(request, f'Parsing queued for book: {book.name}')
     return redirect('book_detail', pk=book.pk)
 
+@require_GET
+def parse_status(request, pk):
+    book = get_object_or_404(Book, pk=pk)
+    task = single_book_task(book.pk)
+    return JsonResponse({
+        'active': task is not None and task.status in ACTIVE_STATUSES,
+        'task': task and {
+            'status': task.status,
+            'attempts': task.attempts,
+            # When a queued task is tried again after a throttled fetch
+            'available_at': task.available_at,
+            'finished_at': task.finished_at,
+            'error': task.error,
+        },
+        'book': {
+            'parse_status': book.parse_status,
+            'parsed_at': book.parsed_at,
+        },
+    })
+
 @require_POST
 def parse_all_books(request):
-    if get_parsing_status():
+    job, created = parse_all_books_task()
+    if not created:
         messages.info(request, 'Parsing already in progress')
         return redirect('book_list')
     
-    books = Book.objects.all()
-    process = Process(target=parse_all_books_task, daemon=True)
-    process.start()
-    messages.success(request, f'Parsing started for all {books.count()} books')
+    messages.success(request, f'Parsing queued for all {job.total} books')
     return redirect('book_list')
 
 @require_POST
@@ -119,3 +230,27 @@ def delete_book(request, pk):
     book.delete()
     messages.success(request, f'Book "{book.name}" was successfully deleted.')
     return redirect('book_list')
+
+@require_GET
+def export_books(request):
+    # Takes the filter and sort parameters of the book list
+    dataset = request.GET.get('dataset', 'books')
+    export_format = request.GET.get('format', 'csv')
+    if dataset not in DATASETS:
+        return HttpResponseBadRequest(f"Unknown dataset, expected one of: {', '.join(DATASETS)}")
+    if export_format not in available_formats():
+        return HttpResponseBadRequest(f"Unavailable format, expected one of: {', '.join(available_formats())}")
+
+    book_filter = BookFilter(request.GET, queryset=Book.objects.select_related('series'))
+    if not book_filter.is_valid():
+        return HttpResponseBadRequest(f"Invalid filter: {book_filter.errors.as_text()}")
+    books = book_filter.qs
+    books = books.order_by(*books.query.order_by, 'id')
+    response = StreamingHttpResponse(export(dataset, export_format, books), content_type=FORMATS[export_format][0])
+    response['Content-Disposition'] = f'attachment; filename="{export_filename(dataset, export_format, timezone.now())}"'
+    return response
+
+@require_GET
+def metrics(request):
+    # Prometheus text exposition format
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')